@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+_parse_response 微基准：单遍容错提取器 vs 原五级降级方案
+
+语料位于 parse_corpus/，为按提示词输出格式整理的Gemini响应样例
+（含代码块、未转义换行/引号、尾随逗号、前置说明中的括号组、截断输出、纯文本、
+只有键没有值的成员、漏写结束引号的数组元素）。
+另外按倍数放大几个样例，模拟长篇且格式有问题的响应。
+
+样例旁的 <名称>.expected.json 为 extract_json 应返回的 {"parsed", "repairs"}，
+计时前先逐个核对，不一致时列出差异并以非零状态退出。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_parse.py [--repeat 200] [--json results.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ai_service import GeminiNegotiationService  # noqa: E402
+from services.json_extractor import extract_json  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_corpus")
+
+# 只用到解析相关方法，不需要初始化SDK
+parser = GeminiNegotiationService.__new__(GeminiNegotiationService)
+# 纯文本样例每次都会记一条"未找到JSON对象"警告，计时时不输出日志
+logging.getLogger("services.ai_service").setLevel(logging.ERROR)
+
+
+def legacy_clean_json_string(json_str):
+    json_str = json_str.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+    json_str = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', json_str)
+    json_str = json_str.replace('\\\\n', '\\n')
+    json_str = json_str.replace('\\"', '"')
+    return json_str
+
+
+def legacy_parse(response_text):
+    """原 _parse_response 的五级降级方案（去掉日志输出），返回 (结果, 成功的方案编号)"""
+    try:
+        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        if json_match:
+            return parser._process_parsed_data(json.loads(json_match.group(0))), 1
+    except Exception:
+        pass
+    try:
+        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        if json_match:
+            json_str = legacy_clean_json_string(json_match.group(0))
+            return parser._process_parsed_data(json.loads(json_str)), 2
+    except Exception:
+        pass
+    try:
+        code_block_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', response_text, re.DOTALL)
+        if code_block_match:
+            json_str = legacy_clean_json_string(code_block_match.group(1))
+            return parser._process_parsed_data(json.loads(json_str)), 3
+    except Exception:
+        pass
+    # 方案4总能返回结果，方案5实际不可达
+    return parser._extract_structured_info(response_text), 4
+
+
+def load_corpus(scale):
+    samples = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".txt"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+                samples[name[:-4]] = f.read()
+
+    # 放大样例：长文本字段 + 大量前置括号组
+    long_strategy = samples["02_raw_newlines"].replace(
+        "【执行优化】", "【执行优化】" + "补充说明：房东的顾虑需要逐条回应。\n" * scale, 1)
+    samples[f"long_raw_newlines_x{scale}"] = long_strategy
+    long_quotes = samples["03_inner_quotes"].replace(
+        "【执行优化】", "【执行优化】" + "强调\"按时交租\"和\"爱护房屋\"。" * scale, 1)
+    samples[f"long_inner_quotes_x{scale}"] = long_quotes
+    samples[f"brace_groups_x{scale}"] = "{城市}{价格}说明 " * scale + samples["04_preamble_braces"]
+    return samples
+
+
+def load_expected():
+    """样例名 -> (解析结果, 修复列表)"""
+    expected = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".expected.json"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+                data = json.load(f)
+            expected[name[:-len(".expected.json")]] = (data["parsed"], data["repairs"])
+    return expected
+
+
+def check_expected(samples):
+    """核对有期望输出的样例，返回不一致的 [(样例, 期望, 实际)]"""
+    mismatches = []
+    for name, want in load_expected().items():
+        got = extract_json(samples[name])
+        if got != want:
+            mismatches.append((name, want, got))
+    return mismatches
+
+
+TEXT_FIELDS = ("negotiation_strategy", "risk_assessment", "market_insights")
+
+
+def summarize(result):
+    return {
+        "suggested_price": result.get("suggested_price"),
+        "talking_points": len(result.get("talking_points") or []),
+        # 非空的长文本字段数，降级到文本提取时通常会丢失
+        "text_fields": sum(1 for field in TEXT_FIELDS if result.get(field)),
+    }
+
+
+def bench(fn, text, repeat, rounds=5):
+    """repeat次调用分成rounds轮，取最快一轮的平均耗时（微秒），减少机器负载波动的影响"""
+    per_round = max(1, repeat // rounds)
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(per_round):
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / per_round * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    arg_parser.add_argument("--repeat", type=int, default=200)
+    arg_parser.add_argument("--scale", type=int, default=300, help="放大样例的重复倍数")
+    arg_parser.add_argument("--json", dest="json_path", help="将结果写入JSON文件")
+    args = arg_parser.parse_args()
+
+    samples = load_corpus(args.scale)
+    mismatches = check_expected(samples)
+    for name, want, got in mismatches:
+        print(f"{name}: 期望 {json.dumps(want, ensure_ascii=False)}\n{' ' * len(name)}  实际 {json.dumps(got, ensure_ascii=False)}")
+
+    rows = []
+    sink = io.StringIO()
+    for name, text in samples.items():
+        with contextlib.redirect_stdout(sink):
+            legacy_result, legacy_stage = legacy_parse(text)
+            new_result = parser._parse_response(text)
+            _, repairs = extract_json(text)
+            legacy_us = bench(legacy_parse, text, args.repeat)
+            new_us = bench(parser._parse_response, text, args.repeat)
+        sink.seek(0)
+        sink.truncate()
+        rows.append({
+            "sample": name,
+            "bytes": len(text.encode("utf-8")),
+            "legacy_us": round(legacy_us, 1),
+            "new_us": round(new_us, 1),
+            "speedup": round(legacy_us / new_us, 2) if new_us else None,
+            "legacy_stage": legacy_stage,
+            "repairs": repairs,
+            "legacy": summarize(legacy_result),
+            "new": summarize(new_result),
+        })
+
+    header = f"{'sample':<28}{'bytes':>8}{'legacy_us':>11}{'new_us':>9}{'speedup':>9}  stage  repairs / (price, points, text fields) legacy -> new"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        legacy, new = row["legacy"], row["new"]
+        print(f"{row['sample']:<28}{row['bytes']:>8}{row['legacy_us']:>11}{row['new_us']:>9}{row['speedup']:>9}"
+              f"  {row['legacy_stage']:>5}  {','.join(row['repairs']) or '-'} / "
+              f"({legacy['suggested_price']}, {legacy['talking_points']}, {legacy['text_fields']}) -> "
+              f"({new['suggested_price']}, {new['talking_points']}, {new['text_fields']})")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "scale": args.scale, "results": rows,
+                       "mismatches": [name for name, _, _ in mismatches]}, f, ensure_ascii=False, indent=2)
+
+    if mismatches:
+        print(f"{len(mismatches)} 个样例与期望输出不一致")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+冷启动计时：导入 main 的耗时，以及从启动 uvicorn 到 /health 可用、到模型句柄预热完成、到进程退出的耗时
+
+每轮使用新的临时SQLite库（包含建表），也可以用 --database-url 指定已有的库（启动时会补齐缺少的列）。
+在不同提交上分别运行并保存JSON，即可跟踪启动耗时的变化：
+    python benchmarks/coldstart.py --runs 5 --json results/coldstart-before.json
+    python benchmarks/coldstart.py --runs 5 --compare results/coldstart-before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import _delta, _git_commit  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+METRICS = ("import_s", "health_s", "models_ready_s", "shutdown_s")
+
+
+def _env(database_url: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = database_url
+    env.setdefault("GEMINI_API_KEY", "coldstart")
+    # 冷启动只关心进程本身，后台加载照常进行但不计入
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def measure_import(database_url: str) -> float:
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=_env(database_url),
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_boot(database_url: str, port: int, timeout: float) -> Dict[str, Optional[float]]:
+    """启动uvicorn，轮询 /health 和 /models，然后发送SIGTERM等待退出"""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)], cwd=BACKEND_DIR,
+                               env=_env(database_url), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    health = models_ready = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=2) as client:
+            deadline = started + timeout
+            while time.perf_counter() < deadline and models_ready is None:
+                if process.poll() is not None:
+                    raise RuntimeError(f"服务启动失败，退出码 {process.returncode}")
+                try:
+                    if health is None and client.get("/health").status_code == 200:
+                        health = time.perf_counter() - started
+                    if health is not None and client.get("/models").json().get("ready"):
+                        models_ready = time.perf_counter() - started
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.01)
+    finally:
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        shutdown = time.perf_counter() - stopping
+    return {"health_s": health, "models_ready_s": models_ready, "shutdown_s": shutdown}
+
+
+def summarize(runs: List[Dict[str, Optional[float]]]) -> Dict[str, Dict[str, Optional[float]]]:
+    summary = {}
+    for metric in METRICS:
+        values = sorted(run[metric] for run in runs if run.get(metric) is not None)
+        summary[metric] = {
+            "median": round(statistics.median(values), 4) if values else None,
+            "min": round(values[0], 4) if values else None,
+            "max": round(values[-1], 4) if values else None,
+        }
+    return summary
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(f"{'指标':<16}{'中位数(s)':>22}{'最小(s)':>22}{'最大(s)':>12}")
+    for metric, stats in result["summary"].items():
+        base = (baseline or {}).get("summary", {}).get(metric, {})
+        cells = [f"{stats[key]}{_delta(stats[key], base.get(key))}" if stats[key] is not None else "-"
+                 for key in ("median", "min")]
+        print(f"{metric:<16}" + "".join(f"{cell:>22}" for cell in cells) + f"{stats['max'] if stats['max'] is not None else '-':>12}")
+    if baseline:
+        print(f"对比基线: {baseline['meta'].get('commit')} @ {baseline['meta'].get('timestamp')}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="冷启动计时")
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--port", type=int, default=18099)
+    arg_parser.add_argument("--timeout", type=float, default=60, help="单轮等待启动完成的最长时间（秒）")
+    arg_parser.add_argument("--database-url", help="使用已有的数据库，默认每轮新建临时SQLite库")
+    arg_parser.add_argument("--json", dest="json_path", help="把结果写入JSON文件")
+    arg_parser.add_argument("--compare", help="与之前保存的JSON结果对比")
+    args = arg_parser.parse_args()
+
+    runs = []
+    for index in range(args.runs):
+        workdir = tempfile.mkdtemp(prefix="coldstart-")
+        try:
+            database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'coldstart.db')}"
+            run = {"import_s": measure_import(database_url)}
+            run.update(measure_boot(database_url, args.port, args.timeout))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        runs.append(run)
+        print(f"第{index + 1}轮: " + ", ".join(f"{key}={value:.3f}" if value is not None else f"{key}=-" for key, value in run.items()))
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.json_path:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json_path)), exist_ok=True)
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
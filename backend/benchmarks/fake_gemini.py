@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+本地Gemini替身：实现SDK使用的 GenerateContent / StreamGenerateContent / CountTokens 三个gRPC接口
+
+响应延迟按指定分布采样，可按比例返回格式有问题的输出或错误，用于在不消耗配额的情况下压测后端。
+SDK的异步客户端只走TLS gRPC，因此启动时在 --cert-dir 下生成自签名证书（需要openssl命令），
+后端通过 GRPC_DEFAULT_SSL_ROOTS_FILE_PATH 信任该证书。
+
+用法（在 backend 目录下）：
+    python benchmarks/fake_gemini.py --port 50051 --latency lognormal:1.5,0.5 --malformed-rate 0.1
+
+    # 另一个终端启动后端，指向替身
+    GEMINI_API_KEY=fake GEMINI_API_ENDPOINT=localhost:50051 \\
+    GRPC_DEFAULT_SSL_ROOTS_FILE_PATH=benchmarks/.fake_gemini/cert.pem \\
+    uvicorn main:app --port 8088
+
+延迟分布写法：fixed:秒 | uniform:最小,最大 | lognormal:中位数,sigma | exponential:均值
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+
+import grpc
+import google.ai.generativelanguage as glm
+
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+DEFAULT_CERT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".fake_gemini")
+
+MALFORMATIONS = ("unescaped_newline", "trailing_comma", "stray_quote", "truncated", "prose_only")
+
+
+def parse_latency(spec: str):
+    """把延迟分布写法转换为采样函数（返回秒）"""
+    kind, _, raw = spec.partition(":")
+    args = [float(value) for value in raw.split(",") if value]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(args[0]), args[1])
+    if kind == "exponential":
+        return lambda: random.expovariate(1 / args[0])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+def ensure_certificate(cert_dir: str):
+    """生成（或复用）localhost的自签名证书，返回 (证书路径, 私钥路径)"""
+    cert_path = os.path.join(cert_dir, "cert.pem")
+    key_path = os.path.join(cert_dir, "key.pem")
+    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+        os.makedirs(cert_dir, exist_ok=True)
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "3650",
+             "-keyout", key_path, "-out", cert_path, "-subj", "/CN=localhost",
+             "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+            check=True, capture_output=True
+        )
+    return cert_path, key_path
+
+
+def _prompt_text(request) -> str:
+    return "".join(part.text for content in request.contents for part in content.parts)
+
+
+def _advice(case: dict) -> dict:
+    current_price = int(case.get("当前报价") or 5000)
+    budget = int(case.get("目标价格") or current_price * 0.9)
+    suggested = max(budget, current_price - max(100, (current_price - budget) // 2))
+    return {
+        "suggested_price": suggested,
+        "negotiation_strategy": "【基础策略】先肯定房屋条件，再以市场对比为依据提出目标价。\n"
+                                "【市场武器】列举周边同类房源报价。\n【关系筹码】强调长期稳定租住。\n"
+                                "【执行优化】当面沟通，选择月底空置压力大的时机。" * 3,
+        "talking_points": [
+            "开场信任建立：您好，房子收拾得很用心",
+            "市场对比引入：附近同户型大多在这个价位",
+            "关系优势强化：我可以签两年，省去您找租客的麻烦",
+            f"价格锚定成交：如果能到{suggested}元，今天就可以定下来",
+            "异议应对预案：可以一次付半年，换一个更合适的价格",
+        ],
+        "risk_assessment": "1.房东坚持原价 2.以押金或付款方式换取让步 3.房东不再回复 4.底线为预算价",
+        "success_probability": 0.65,
+        "market_insights": "该价位供给充足，淡季房东出租压力较大，租客有一定议价空间。",
+    }
+
+
+def _cases(prompt: str):
+    """从完整/精简/打包三种提示词中取出各案例的报价和目标价"""
+    if "用户消息是一个JSON数组" in prompt:
+        start = prompt.rfind("[{")
+        try:
+            return json.loads(prompt[start:]), True
+        except ValueError:
+            return [{}], True
+    case = {}
+    for label in ("当前报价", "目标价格"):
+        match = re.search(label + r'["：:]*\s*"?(\d+)', prompt)
+        if match:
+            case[label] = int(match.group(1))
+    return [case], False
+
+
+def _malform(text: str, kind: str) -> str:
+    if kind == "unescaped_newline":
+        return text.replace("\\n", "\n")
+    if kind == "trailing_comma":
+        return text.replace("]", ",]").rstrip("}") + ",}"
+    if kind == "stray_quote":
+        return text.replace("长期稳定租住", "\"长期\"稳定租住", 1)
+    if kind == "truncated":
+        return text[:int(len(text) * random.uniform(0.5, 0.9))]
+    return "根据您提供的信息，建议先和房东当面沟通，以周边房源价格为依据争取优惠。"
+
+
+class FakeGemini:
+    def __init__(self, args):
+        self.latency = parse_latency(args.latency)
+        self.malformed_rate = args.malformed_rate
+        self.error_rate = args.error_rate
+        self.chunk_size = args.chunk_size
+        self.chunk_delay = args.chunk_delay
+        self.requests = 0
+
+    def _response_text(self, request) -> str:
+        cases, packed = _cases(_prompt_text(request))
+        if packed:
+            body = [{"index": case.get("index", i), **_advice(case)} for i, case in enumerate(cases)]
+        else:
+            body = _advice(cases[0])
+        text = "```json\n" + json.dumps(body, ensure_ascii=False, indent=2) + "\n```"
+        if random.random() < self.malformed_rate:
+            text = _malform(text, random.choice(MALFORMATIONS))
+        return text
+
+    async def _fail_maybe(self, context):
+        self.requests += 1
+        if random.random() < self.error_rate:
+            await context.abort(random.choice([grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED]), "fake error")
+
+    @staticmethod
+    def _response(text: str):
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(
+            index=0, finish_reason=glm.Candidate.FinishReason.STOP,
+            content=glm.Content(role="model", parts=[glm.Part(text=text)])
+        )])
+
+    async def generate_content(self, request, context):
+        await self._fail_maybe(context)
+        await asyncio.sleep(self.latency())
+        return self._response(self._response_text(request))
+
+    async def stream_generate_content(self, request, context):
+        await self._fail_maybe(context)
+        await asyncio.sleep(self.latency())
+        text = self._response_text(request)
+        for start in range(0, len(text), self.chunk_size):
+            yield self._response(text[start:start + self.chunk_size])
+            await asyncio.sleep(self.chunk_delay)
+
+    async def count_tokens(self, request, context):
+        # 中文约每1.5个字符一个token
+        return glm.CountTokensResponse(total_tokens=max(1, int(len(_prompt_text(request)) / 1.5)))
+
+    def handler(self):
+        def serializer(message_class):
+            return dict(request_deserializer=message_class.deserialize, response_serializer=lambda message: type(message).serialize(message))
+
+        return grpc.method_handlers_generic_handler(SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(self.generate_content, **serializer(glm.GenerateContentRequest)),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(self.stream_generate_content, **serializer(glm.GenerateContentRequest)),
+            "CountTokens": grpc.unary_unary_rpc_method_handler(self.count_tokens, **serializer(glm.CountTokensRequest)),
+        })
+
+
+async def serve(args):
+    cert_path, key_path = ensure_certificate(args.cert_dir)
+    with open(cert_path, "rb") as cert, open(key_path, "rb") as key:
+        credentials = grpc.ssl_server_credentials([(key.read(), cert.read())])
+    fake = FakeGemini(args)
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((fake.handler(),))
+    server.add_secure_port(f"{args.host}:{args.port}", credentials)
+    await server.start()
+    print(f"Gemini替身已启动: {args.host}:{args.port}（证书: {cert_path}）", flush=True)
+    try:
+        await server.wait_for_termination()
+    finally:
+        print(f"共处理 {fake.requests} 个请求", flush=True)
+        await server.stop(None)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="本地Gemini替身")
+    arg_parser.add_argument("--host", default="localhost")
+    arg_parser.add_argument("--port", type=int, default=50051)
+    arg_parser.add_argument("--latency", default="lognormal:1.5,0.5", help="响应延迟分布")
+    arg_parser.add_argument("--malformed-rate", type=float, default=0.0, help="返回格式有问题的输出的比例")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="返回UNAVAILABLE/RESOURCE_EXHAUSTED的比例")
+    arg_parser.add_argument("--chunk-size", type=int, default=64, help="流式响应每个分块的字符数")
+    arg_parser.add_argument("--chunk-delay", type=float, default=0.01, help="流式分块间隔（秒）")
+    arg_parser.add_argument("--cert-dir", default=DEFAULT_CERT_DIR)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    args = arg_parser.parse_args()
+    try:
+        parse_latency(args.latency)
+    except (ValueError, IndexError):
+        arg_parser.error(f"无效的延迟分布: {args.latency}")
+    random.seed(args.seed)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
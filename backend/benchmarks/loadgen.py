@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+异步压测：按权重混合请求 /negotiate、/market-analysis/{location}、/stats，
+统计各接口的吞吐量、错误数和 p50/p95/p99 延迟，结果可输出为JSON以便在不同提交之间对比
+
+先用 fake_gemini.py 启动Gemini替身、seed.py 生成数据，再启动后端，然后：
+    python benchmarks/loadgen.py --concurrency 64 --duration 30 --json results/after.json
+    python benchmarks/loadgen.py --concurrency 64 --duration 30 --compare results/after.json
+
+--mix 设置请求权重（默认 negotiate=1,market=4,stats=1）；
+--unique-ratio 控制 /negotiate 请求中不重复内容的比例（其余从少量固定请求中抽取，可命中缓存/合并）。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import CITIES, PROPERTY_TYPES, location_text  # noqa: E402
+
+ENDPOINTS = ("negotiate", "market", "stats")
+QUERY_LOCATIONS = ["北京", "北京朝阳区", "上海浦东新区", "深圳南山", "广东", "杭州", "朝阳", "南山区", "成都武侯区", "苏州"]
+
+
+def parse_mix(raw: str) -> Dict[str, float]:
+    mix = {}
+    for item in raw.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise ValueError(f"未知的接口: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.mix = parse_mix(args.mix)
+        self.latencies: Dict[str, List[float]] = {name: [] for name in self.mix}
+        self.statuses: Dict[str, Dict[str, int]] = {name: {} for name in self.mix}
+        # 重复请求池：模拟客户端重试和相同房源被多人查询
+        self.repeated = [self._negotiate_body() for _ in range(max(1, args.repeat_pool))]
+
+    def _negotiate_body(self) -> Dict[str, Any]:
+        city = self.rng.choice(list(CITIES))
+        property_type, factor, area = self.rng.choice(PROPERTY_TYPES)
+        price = int(CITIES[city][1] * factor * self.rng.uniform(0.8, 1.2)) // 10 * 10
+        body = {
+            "property_info": {
+                "location": location_text(self.rng, city),
+                "current_price": price,
+                "property_type": property_type,
+                "area": area,
+                "landlord_type": self.rng.choice(["个人房东", "中介"]),
+            },
+            "user_budget": int(price * self.rng.uniform(0.8, 0.95)) // 10 * 10,
+            "urgency": self.rng.choice(["urgent", "normal", "flexible"]),
+            "model_name": self.args.model,
+        }
+        if self.args.prompt_mode:
+            body["prompt_mode"] = self.args.prompt_mode
+        return body
+
+    def _request(self):
+        endpoint = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if endpoint == "negotiate":
+            unique = self.rng.random() < self.args.unique_ratio
+            body = self._negotiate_body() if unique else self.rng.choice(self.repeated)
+            return endpoint, "POST", "/negotiate", body
+        if endpoint == "market":
+            return endpoint, "GET", f"/market-analysis/{self.rng.choice(QUERY_LOCATIONS)}", None
+        return endpoint, "GET", "/stats", None
+
+    async def _worker(self, client: httpx.AsyncClient, deadline: float, budget: List[int], record_after: float):
+        while time.perf_counter() < deadline:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+            endpoint, method, path, body = self._request()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            if started < record_after:
+                # 预热阶段的请求不计入统计
+                continue
+            self.statuses[endpoint][status] = self.statuses[endpoint].get(status, 0) + 1
+            if status == "200":
+                self.latencies[endpoint].append(elapsed)
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+            started = time.perf_counter()
+            record_after = started + args.warmup
+            deadline = record_after + args.duration
+            budget = [args.requests or sys.maxsize]
+            await asyncio.gather(*(self._worker(client, deadline, budget, record_after) for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - record_after
+            health = None
+            try:
+                health = (await client.get("/health")).json()
+            except (httpx.HTTPError, ValueError):
+                pass
+        return self.report(elapsed, health)
+
+    def report(self, elapsed: float, health: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        endpoints = {}
+        total_ok = total = 0
+        for name in self.mix:
+            ordered = sorted(self.latencies[name])
+            count = sum(self.statuses[name].values())
+            total += count
+            total_ok += len(ordered)
+            endpoints[name] = {
+                "requests": count,
+                "ok": len(ordered),
+                "errors": count - len(ordered),
+                "statuses": self.statuses[name],
+                "throughput_rps": round(len(ordered) / elapsed, 2),
+                "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else None,
+                **{f"p{int(q * 100)}_ms": round(percentile(ordered, q) * 1000, 2) if ordered else None
+                   for q in (0.5, 0.95, 0.99)},
+                "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+            }
+        return {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "args": vars(self.args),
+            },
+            "duration_s": round(elapsed, 2),
+            "total": {"requests": total, "ok": total_ok, "throughput_rps": round(total_ok / elapsed, 2)},
+            "endpoints": endpoints,
+            "server_health": health,
+        }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _delta(current: Optional[float], baseline: Optional[float]) -> str:
+    if current is None or baseline is None or baseline == 0:
+        return ""
+    return f"({(current - baseline) / baseline * 100:+.1f}%)"
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    header = f"{'接口':<10}{'请求':>8}{'错误':>6}{'吞吐(rps)':>22}{'p50(ms)':>22}{'p95(ms)':>22}{'p99(ms)':>22}"
+    print(header)
+    for name, stats in result["endpoints"].items():
+        base = (baseline or {}).get("endpoints", {}).get(name, {})
+        cells = [f"{stats[key]}{_delta(stats[key], base.get(key))}" if stats[key] is not None else "-"
+                 for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")]
+        print(f"{name:<10}{stats['requests']:>8}{stats['errors']:>6}" + "".join(f"{cell:>22}" for cell in cells))
+    total = result["total"]
+    base_total = (baseline or {}).get("total", {})
+    print(f"总计 {total['ok']}/{total['requests']} 成功，{total['throughput_rps']} rps"
+          f"{_delta(total['throughput_rps'], base_total.get('throughput_rps'))}，持续 {result['duration_s']}s")
+    if baseline:
+        print(f"对比基线: {baseline['meta'].get('commit')} @ {baseline['meta'].get('timestamp')}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="后端异步压测")
+    arg_parser.add_argument("--base-url", default="http://localhost:8088")
+    arg_parser.add_argument("--concurrency", type=int, default=32, help="并发连接数")
+    arg_parser.add_argument("--duration", type=float, default=30, help="统计时长（秒）")
+    arg_parser.add_argument("--requests", type=int, default=0, help="请求总数上限，0为不限（以时长为准）")
+    arg_parser.add_argument("--warmup", type=float, default=3, help="预热时长（秒），不计入统计")
+    arg_parser.add_argument("--mix", default="negotiate=1,market=4,stats=1", help="各接口的请求权重")
+    arg_parser.add_argument("--unique-ratio", type=float, default=0.8, help="/negotiate中内容不重复的请求比例")
+    arg_parser.add_argument("--repeat-pool", type=int, default=20, help="重复请求池大小")
+    arg_parser.add_argument("--model", default="gemini-2.5-flash")
+    arg_parser.add_argument("--prompt-mode", choices=["full", "compact"], default=None)
+    arg_parser.add_argument("--timeout", type=float, default=120)
+    arg_parser.add_argument("--seed", type=int, default=1)
+    arg_parser.add_argument("--json", dest="json_path", help="把结果写入JSON文件")
+    arg_parser.add_argument("--compare", help="与之前保存的JSON结果对比")
+    args = arg_parser.parse_args()
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        arg_parser.error(str(e))
+
+    result = asyncio.run(LoadGenerator(args).run())
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.json_path:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json_path)), exist_ok=True)
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+压测数据生成：向数据库批量写入合成的谈判会话与用户反馈，并重建区域市场数据
+
+位置覆盖多个城市/区县和几种常见写法（"北京朝阳区三里屯"、"深圳南山"、"广东省深圳市南山区"），
+报价按城市租金水平对数正态分布，建议价和成交价围绕报价随机折让。
+会话ID从 id_sequences 中预留，写入后与后端的ID分配器保持一致。
+
+用法（在 backend 目录下，DATABASE_URL 指定目标库）：
+    python benchmarks/seed.py --sessions 100000 --feedback-ratio 0.2
+    DATABASE_URL=sqlite:///./bench.db python benchmarks/seed.py --sessions 1000000 --batch-size 10000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+from sqlalchemy import func, select, update  # noqa: E402
+
+import database  # noqa: E402
+from models import IdSequence, NegotiationSession, UserFeedback  # noqa: E402
+from services import market_data  # noqa: E402
+from services.location import parse_location  # noqa: E402
+from synthetic import CITIES, LANDLORD_TYPES, MODELS, PROPERTY_TYPES, URGENCIES, location_text  # noqa: E402
+
+STRATEGY = ("【基础策略】先肯定房屋条件，再以市场对比为依据提出目标价。【市场武器】列举周边同类房源报价。"
+            "【关系筹码】强调长期稳定租住。【执行优化】当面沟通，选择月底空置压力大的时机。") * 3
+TALKING_POINTS = ["您好，我对这套房很感兴趣", "附近同户型大多在这个价位", "我可以签两年",
+                  "如果价格合适今天就可以定", "可以一次付半年"]
+
+
+def session_rows(rng: random.Random, start_id: int, count: int, now: datetime, with_text: bool):
+    parsed_cache = {}
+    for session_id in range(start_id, start_id + count):
+        city = rng.choice(list(CITIES))
+        location = location_text(rng, city)
+        parsed = parsed_cache.get(location)
+        if parsed is None:
+            parsed = parsed_cache[location] = parse_location(location)
+        property_type, factor, area = rng.choice(PROPERTY_TYPES)
+        current_price = int(rng.lognormvariate(0, 0.25) * CITIES[city][1] * factor) // 10 * 10
+        budget = int(current_price * rng.uniform(0.75, 0.98)) // 10 * 10
+        model = rng.choice(MODELS)
+        advised = rng.random() < 0.95
+        created_at = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+        yield {
+            "id": session_id,
+            "location": location,
+            "province": parsed.province,
+            "city": parsed.city,
+            "district": parsed.district,
+            "current_price": current_price,
+            "property_type": property_type,
+            "area": int(area * rng.uniform(0.8, 1.3)),
+            "description": "精装修，临近地铁" if rng.random() < 0.5 else None,
+            "landlord_type": rng.choice(LANDLORD_TYPES),
+            "user_budget": budget,
+            "urgency": rng.choice(URGENCIES),
+            "additional_info": None,
+            "suggested_price": (current_price + budget) // 2 if advised else None,
+            "negotiation_strategy": STRATEGY if advised and with_text else None,
+            "talking_points": TALKING_POINTS if advised and with_text else None,
+            "risk_assessment": "注意观察房东态度" if advised and with_text else None,
+            "success_probability": round(rng.uniform(0.3, 0.85), 2) if advised else None,
+            "market_insights": "该价位供给充足" if advised and with_text else None,
+            "model_used": model if advised else None,
+            "prompt_mode": rng.choice(["full", "compact"]) if advised and model != "fallback" else None,
+            "prompt_tokens": rng.randint(600, 2500) if advised and model != "fallback" else None,
+            "response_tokens": rng.randint(500, 1500) if advised and model != "fallback" else None,
+            "latency_ms": rng.randint(2000, 30000) if advised and model != "fallback" else None,
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+
+
+def feedback_row(rng: random.Random, session: dict) -> dict:
+    outcome = rng.choices(["success", "partial", "failed"], weights=[5, 3, 2])[0]
+    actual_price = None
+    if outcome != "failed" and rng.random() < 0.8:
+        actual_price = int(session["current_price"] * rng.uniform(0.85, 0.99)) // 10 * 10
+    return {
+        "session_id": session["id"],
+        "success": outcome,
+        "actual_price": actual_price,
+        "feedback_text": None,
+        "rating": rng.randint(1, 5),
+        "created_at": session["created_at"] + timedelta(days=rng.randint(0, 7)),
+    }
+
+
+def reserve_ids(db, count: int) -> int:
+    """与后端ID分配器共用 id_sequences，预留count个会话ID，返回起始ID"""
+    name = NegotiationSession.__tablename__
+    max_id = db.scalar(select(func.max(NegotiationSession.id))) or 0
+    sequence = db.get(IdSequence, name)
+    start = max(max_id + 1, sequence.next_value if sequence else 0)
+    if sequence is None:
+        db.add(IdSequence(name=name, next_value=start + count))
+    else:
+        db.execute(update(IdSequence).where(IdSequence.name == name).values(next_value=start + count))
+    db.commit()
+    return start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="生成压测用的合成会话与反馈数据")
+    arg_parser.add_argument("--sessions", type=int, default=100000)
+    arg_parser.add_argument("--feedback-ratio", type=float, default=0.2, help="有反馈的会话比例")
+    arg_parser.add_argument("--batch-size", type=int, default=5000)
+    arg_parser.add_argument("--no-advice-text", action="store_true", help="不写入建议正文，只保留数值字段")
+    arg_parser.add_argument("--no-rebuild", action="store_true", help="写入后不重建区域市场数据")
+    arg_parser.add_argument("--seed", type=int, default=42)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    database.init_db()
+    db = database.SessionLocal()
+    started = time.perf_counter()
+    try:
+        start_id = reserve_ids(db, args.sessions)
+        sessions, feedback = [], []
+        totals = {"sessions": 0, "feedback": 0}
+
+        def flush():
+            db.execute(NegotiationSession.__table__.insert(), sessions)
+            if feedback:
+                db.execute(UserFeedback.__table__.insert(), feedback)
+            db.commit()
+            totals["sessions"] += len(sessions)
+            totals["feedback"] += len(feedback)
+            sessions.clear()
+            feedback.clear()
+            print(f"\r已写入 {totals['sessions']}/{args.sessions} 个会话", end="", flush=True)
+
+        for row in session_rows(rng, start_id, args.sessions, datetime.now(), not args.no_advice_text):
+            sessions.append(row)
+            if rng.random() < args.feedback_ratio:
+                feedback.append(feedback_row(rng, row))
+            if len(sessions) >= args.batch_size:
+                flush()
+        if sessions:
+            flush()
+        written = totals["sessions"]
+        print(f"\r已写入 {written} 个会话、{totals['feedback']} 条反馈（ID {start_id}-{start_id + written - 1}），"
+              f"耗时 {time.perf_counter() - started:.1f}s")
+
+        if not args.no_rebuild:
+            rebuild_started = time.perf_counter()
+            regions = market_data.rebuild(db)
+            print(f"已重建 {regions} 个地区的市场数据，耗时 {time.perf_counter() - rebuild_started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+压测用的合成数据：城市/区县/地标、户型与位置写法，seed.py 与 loadgen.py 共用
+"""
+
+import random
+
+# 城市 -> (省份写法, 月租中位数, 区县, 地标/小区)
+CITIES = {
+    "北京": ("北京", 6500, ["朝阳区", "海淀区", "东城区", "西城区", "丰台区", "通州区"], ["三里屯", "望京", "中关村", "国贸"]),
+    "上海": ("上海", 6800, ["浦东新区", "徐汇区", "静安区", "闵行区", "杨浦区"], ["陆家嘴", "张江", "徐家汇"]),
+    "深圳": ("广东省", 5800, ["南山区", "福田区", "罗湖区", "宝安区", "龙岗区"], ["科技园", "车公庙", "西丽"]),
+    "广州": ("广东省", 4200, ["天河区", "越秀区", "海珠区", "番禺区"], ["珠江新城", "体育西"]),
+    "杭州": ("浙江省", 4300, ["西湖区", "滨江区", "余杭区", "拱墅区"], ["文三路", "未来科技城"]),
+    "成都": ("四川省", 2800, ["武侯区", "锦江区", "青羊区", "成华区"], ["春熙路", "天府三街"]),
+    "南京": ("江苏省", 3500, ["鼓楼区", "玄武区", "建邺区", "江宁区"], ["新街口", "河西"]),
+    "武汉": ("湖北省", 2900, ["洪山区", "江汉区", "武昌区"], ["光谷", "街道口"]),
+    "西安": ("陕西省", 2500, ["雁塔区", "碑林区", "未央区"], ["小寨", "高新路"]),
+    "苏州": ("江苏省", 3300, ["姑苏区", "吴中区", "工业园区"], ["金鸡湖", "石路"]),
+}
+PROPERTY_TYPES = [("一居室", 1.0, 45), ("两居室", 1.5, 75), ("三居室", 2.0, 100), ("合租单间", 0.45, 18)]
+LANDLORD_TYPES = ["个人房东", "中介", "二房东", None]
+URGENCIES = ["urgent", "normal", "normal", "flexible"]
+MODELS = ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-1.5-pro", "fallback"]
+
+
+def location_text(rng: random.Random, city: str) -> str:
+    province, _, districts, landmarks = CITIES[city]
+    district = rng.choice(districts)
+    style = rng.random()
+    if style < 0.4:
+        return f"{city}{district}{rng.choice(landmarks)}"
+    if style < 0.7:
+        # 省略"区"字的简写，如 "深圳南山"
+        return f"{city}{district[:-1] if len(district) == 3 else district}"
+    if style < 0.9 and province != city:
+        return f"{province}{city}市{district}"
+    return f"{city} {district}"
@@ -1,42 +1,181 @@
 """
 数据库配置和连接
+
+请求路径使用异步引擎（SQLite: aiosqlite，PostgreSQL: asyncpg），数据库I/O不阻塞事件循环；
+同步引擎只用于启动时建表/补列和命令行维护工具。
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 数据库URL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./rent_negotiator.db")
 
-# 创建SQLAlchemy引擎
+# 同步驱动 -> 异步驱动
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def _async_url(url: str) -> str:
+    """把DATABASE_URL转换为对应的异步驱动URL，已指定驱动时按后端替换"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"不支持的数据库: {backend}")
+    return parsed.set(drivername=_ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+_is_sqlite = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+_is_memory = _is_sqlite and make_url(DATABASE_URL).database in (None, "", ":memory:")
+
+def _pool_options() -> dict:
+    """连接池参数，内存SQLite使用单连接池，不适用"""
+    if _is_memory:
+        return {}
+    return {
+        # aiosqlite默认不复用连接（NullPool），显式使用连接池
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": not _is_sqlite,
+    }
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """
+    每个SQLite连接建立时设置：
+    - WAL：读写互不阻塞，写入只追加日志
+    - busy_timeout：写锁被占用时等待而不是立即报 database is locked
+    """
+    cursor = dbapi_connection.cursor()
+    if not _is_memory:
+        cursor.execute(f"PRAGMA journal_mode={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+    cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.close()
+
+# 创建SQLAlchemy引擎（同步，用于建表和维护工具）
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    connect_args={"check_same_thread": False} if _is_sqlite else {}
 )
 
+# 请求路径使用的异步引擎
+async_engine = create_async_engine(_async_url(DATABASE_URL), **_pool_options())
+
+if _is_sqlite:
+    event.listen(engine, "connect", _configure_sqlite)
+    event.listen(async_engine.sync_engine, "connect", _configure_sqlite)
+
 # 创建SessionLocal类
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False：提交后不再隐式刷新对象，避免在等待AI响应期间占用连接
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # 创建Base类
 Base = declarative_base()
 
-def get_db():
+# 位置全文索引（SQLite FTS5 trigram）是否可用，由init_db设置
+_location_fts = False
+
+async def get_db():
     """
-    数据库依赖注入
+    数据库依赖注入（异步会话）
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def close_db():
+    """关闭异步连接池"""
+    await async_engine.dispose()
 
 def init_db():
     """
     初始化数据库
     """
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    if os.getenv("LOCATION_FTS", "false").lower() == "true":
+        _create_location_fts()
+
+def location_fts_enabled() -> bool:
+    return _location_fts
+
+def dialect_insert(db):
+    """
+    按会话绑定的数据库返回支持 on_conflict_do_update 的 insert（PostgreSQL / SQLite）
+
+    db 可以是同步Session或AsyncSession
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def _add_missing_columns():
+    """
+    create_all 不会修改已存在的表：为旧数据库补齐后来新增的列和索引
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def _create_location_fts():
+    """
+    为 negotiation_sessions.location 建立FTS5 trigram外部内容索引，并用触发器保持同步
+
+    仅SQLite（3.34+，需带FTS5）；不支持时只记录警告，位置查询仍可走省/市/区索引
+    """
+    global _location_fts
+    if engine.dialect.name != "sqlite":
+        return
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'negotiation_sessions_fts'"
+            )).first() is not None
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS negotiation_sessions_fts USING fts5("
+                "location, content='negotiation_sessions', content_rowid='id', tokenize='trigram')"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS negotiation_sessions_fts_ai AFTER INSERT ON negotiation_sessions BEGIN "
+                "INSERT INTO negotiation_sessions_fts(rowid, location) VALUES (new.id, new.location); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS negotiation_sessions_fts_ad AFTER DELETE ON negotiation_sessions BEGIN "
+                "INSERT INTO negotiation_sessions_fts(negotiation_sessions_fts, rowid, location) "
+                "VALUES ('delete', old.id, old.location); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS negotiation_sessions_fts_au AFTER UPDATE OF location ON negotiation_sessions BEGIN "
+                "INSERT INTO negotiation_sessions_fts(negotiation_sessions_fts, rowid, location) "
+                "VALUES ('delete', old.id, old.location); "
+                "INSERT INTO negotiation_sessions_fts(rowid, location) VALUES (new.id, new.location); END"
+            ))
+            if not exists:
+                # 新建索引时为已有会话建立索引
+                conn.execute(text("INSERT INTO negotiation_sessions_fts(negotiation_sessions_fts) VALUES ('rebuild')"))
+        _location_fts = True
+    except Exception as e:
+        logger.warning("位置全文索引不可用", extra={"error": str(e)})
@@ -1,21 +1,48 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, ConfigDict
+from typing import Optional, List, Dict, Any, Literal, AsyncIterator, Tuple, Union
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
+from datetime import date, datetime
+import asyncio
+import json
+import logging
+import math
 import os
-from dotenv import load_dotenv
-from services.ai_service import GeminiNegotiationService
-from database import get_db, init_db
+from contextlib import asynccontextmanager
+from services.batch import group_by
+from services.admission import AdmissionRejected
+from services.log import setup_logging, shutdown_logging, dropped_count, RequestContextMiddleware
+from services import metrics
+from services.metrics import ServerTimingMiddleware, stage
+from services import market_data
+from services.location import parse_location
+from services.archive import ARCHIVED_COLUMNS
+from services import history
+from services.http_cache import CACHE_CONTROL, SESSIONS, market_version_name
+from services.container import ServiceContainer
+from database import get_db
 from models import NegotiationSession, UserFeedback, MarketData
 
-# 加载环境变量
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动：日志线程、建表、后台组件、模型预热；关闭时按相反顺序停止"""
+    # 结构化日志（后台线程写出）
+    setup_logging()
+    await container.startup()
+    try:
+        yield
+    finally:
+        await container.shutdown()
+        shutdown_logging()
 
 app = FastAPI(
     title="租房谈判助手 API",
     description="基于AI的智能租房砍价工具",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 配置CORS
@@ -25,13 +52,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing"],
 )
 
-# 初始化AI服务
-ai_service = GeminiNegotiationService()
+# 各阶段耗时写入Server-Timing响应头（SERVER_TIMING_ENABLED=true 或带追踪请求头时）
+app.add_middleware(ServerTimingMiddleware)
+
+# 请求ID与追踪标记（X-Debug-Trace: 1 时记录完整prompt和模型响应）
+app.add_middleware(RequestContextMiddleware)
 
-# 初始化数据库
-init_db()
+# 各组件在首次访问时创建，后台任务随应用生命周期启动和停止
+container = ServiceContainer()
+
+logger = logging.getLogger(__name__)
 
 # 数据模型
 class PropertyInfo(BaseModel):
@@ -43,13 +76,21 @@ class PropertyInfo(BaseModel):
     landlord_type: Optional[str] = None  # 房东类型：个人/中介
     
 class NegotiationRequest(BaseModel):
+    # model_name 是请求字段，不是pydantic的保留前缀
+    model_config = ConfigDict(protected_namespaces=())
+    
     property_info: PropertyInfo
     user_budget: int  # 用户预算
     urgency: str = "normal"  # 紧急程度：urgent/normal/flexible
     additional_info: Optional[str] = None  # 额外信息
     model_name: str = "gemini-1.5-pro"  # AI模型选择
+    bypass_cache: bool = False  # 跳过建议缓存，强制重新生成
+    prompt_mode: Optional[Literal["full", "compact"]] = None  # 提示词模式，默认使用PROMPT_MODE配置
 
 class NegotiationAdvice(BaseModel):
+    # model_used 是响应字段，不是pydantic的保留前缀
+    model_config = ConfigDict(protected_namespaces=())
+    
     session_id: int  # 会话ID
     suggested_price: int  # 建议砍价到的价格
     negotiation_strategy: str  # 谈判策略
@@ -57,6 +98,14 @@ class NegotiationAdvice(BaseModel):
     risk_assessment: str  # 风险评估
     success_probability: float  # 成功概率
     market_insights: str  # 市场洞察
+    model_used: Optional[str] = None  # 实际给出建议的模型（对冲时可能与请求不同，fallback表示兜底建议）
+
+class BatchNegotiationRequest(BaseModel):
+    items: List[NegotiationRequest]  # 待评估的房源，最多BATCH_MAX_ITEMS个
+    pack: bool = False  # 把同模型的多套房源打包进一次模型调用（使用精简提示词，忽略prompt_mode）
+
+class BatchNegotiationResponse(BaseModel):
+    results: List[NegotiationAdvice]  # 与items顺序一致
 
 class FeedbackRequest(BaseModel):
     session_id: int
@@ -71,34 +120,81 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "llm_queue": container.ai_service.limiter.snapshot(),
+        "llm_latency": container.ai_service.latency.snapshot(),
+        "llm_coalescing": container.ai_service.in_flight.stats(),
+        "llm_admission": container.ai_service.scheduler.snapshot(),
+        "log_dropped": dropped_count(),
+        "session_writer": container.session_writer.stats(),
+        "batch": container.batch_policy.snapshot(),
+        "pricing": container.ai_service.pricing.snapshot(),
+        "comparables": container.ai_service.comparables.stats(),
+        "archive": container.archiver.snapshot(),
+        "shared_state": container.shared_state.snapshot(),
+        "http_cache": container.http_cache.stats()
+    }
+
+def _component_metrics():
+    """抓取时读取各组件已有的状态"""
+    limiter = container.ai_service.limiter.snapshot()
+    yield "rent_llm_in_flight", "gauge", "各模型进行中的调用数", [({"model": name}, item["in_flight"]) for name, item in limiter.items()]
+    yield "rent_llm_queued", "gauge", "各模型等待并发名额的调用数", [({"model": name}, item["queued"]) for name, item in limiter.items()]
+    cache = container.ai_service.cache.counters
+    yield "rent_advice_cache_lookups_total", "counter", "建议缓存查询次数，按结果", [({"result": name}, value) for name, value in cache.items()]
+    coalescing = container.ai_service.in_flight.stats()
+    yield "rent_llm_coalesced_total", "counter", "合并到进行中相同请求的次数", [({}, coalescing["coalesced"])]
+    admission = container.ai_service.scheduler.snapshot()
+    yield "rent_admission_total", "counter", "模型调用准入结果", [
+        ({"result": name}, admission[name]) for name in ("admitted", "queued", "shed_queue_full", "shed_timeout")
+    ]
+    writer = container.session_writer.stats()
+    yield "rent_session_write_queue", "gauge", "会话写入队列中的操作数", [({}, writer["queued"])]
+    yield "rent_session_write_failed_total", "counter", "会话写入失败次数", [({}, writer["failed"])]
+    yield "rent_log_dropped_total", "counter", "日志队列满时丢弃的日志数", [({}, dropped_count())]
+
+metrics.REGISTRY.register_collector(_component_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus文本格式的指标（多进程部署时为所有worker的合计）"""
+    snapshot = container.shared_state.combined("metrics", metrics.REGISTRY.snapshot())
+    return Response(content=metrics.REGISTRY.render(snapshot), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/models")
-async def get_available_models():
+async def get_available_models(request: Request):
     """
     获取可用的AI模型列表
+    
+    内容来自内存，按正文生成ETag，预热完成后状态变化ETag随之改变
     """
-    return {
-        "models": ai_service.available_models,
-        "descriptions": {
-            "gemini-2.5-pro": "最新最强的Gemini模型",
-            "gemini-2.5-flash": "Gemini 2.5 快速版",
-            "gemini-2.0-flash": "Gemini 2.0 快速版", 
-            "gemini-1.5-pro": "稳定的Gemini 1.5 Pro",
-            "gemini-1.5-flash": "Gemini 1.5 快速版",
-            "gemini-pro": "基础版本（兜底）"
+    async def build():
+        return {
+            "models": container.ai_service.available_models,
+            "ready": container.ai_service.ready_models(),
+            "status": container.ai_service.model_status,
+            "descriptions": {
+                "gemini-2.5-pro": "最新最强的Gemini模型",
+                "gemini-2.5-flash": "Gemini 2.5 快速版",
+                "gemini-2.0-flash": "Gemini 2.0 快速版", 
+                "gemini-1.5-pro": "稳定的Gemini 1.5 Pro",
+                "gemini-1.5-flash": "Gemini 1.5 快速版",
+                "gemini-pro": "基础版本（兜底）"
+            }
         }
-    }
+    
+    return await container.http_cache.respond(request, "models", CACHE_CONTROL["models"], build)
 
-@app.post("/negotiate", response_model=NegotiationAdvice)
-async def get_negotiation_advice(request: NegotiationRequest, db: Session = Depends(get_db)):
-    """
-    获取租房谈判建议
-    """
-    try:
-        # 保存谈判会话到数据库
-        session = NegotiationSession(
+async def _create_session(request: NegotiationRequest) -> int:
+    """分配会话ID并排队写入数据库，返回会话ID"""
+    parsed_location = parse_location(request.property_info.location)
+    with stage("session_create"):
+        return await container.session_writer.create(dict(
             location=request.property_info.location,
+            province=parsed_location.province,
+            city=parsed_location.city,
+            district=parsed_location.district,
             current_price=request.property_info.current_price,
             property_type=request.property_info.property_type,
             area=request.property_info.area,
@@ -107,46 +203,243 @@ async def get_negotiation_advice(request: NegotiationRequest, db: Session = Depe
             user_budget=request.user_budget,
             urgency=request.urgency,
             additional_info=request.additional_info
-        )
-        db.add(session)
-        db.commit()
-        db.refresh(session)
-        
-        # 将property_info转换为字典
-        property_dict = {
-            "location": request.property_info.location,
-            "current_price": request.property_info.current_price,
-            "property_type": request.property_info.property_type,
-            "area": request.property_info.area,
-            "description": request.property_info.description,
-            "landlord_type": request.property_info.landlord_type
-        }
+        ))
+
+def _property_dict(request: NegotiationRequest) -> Dict[str, Any]:
+    """将property_info转换为字典"""
+    return {
+        "location": request.property_info.location,
+        "current_price": request.property_info.current_price,
+        "property_type": request.property_info.property_type,
+        "area": request.property_info.area,
+        "description": request.property_info.description,
+        "landlord_type": request.property_info.landlord_type
+    }
+
+async def _apply_advice(session_id: int, request: NegotiationRequest, advice_data: Dict[str, Any]):
+    """排队更新会话记录，保存AI建议（写入时一并计入区域市场数据）"""
+    usage = advice_data.get("usage") or {}
+    with stage("advice_save"):
+        await container.session_writer.save_advice(session_id, dict(
+            suggested_price=advice_data["suggested_price"],
+            negotiation_strategy=advice_data["negotiation_strategy"],
+            talking_points=advice_data["talking_points"],
+            risk_assessment=advice_data["risk_assessment"],
+            success_probability=advice_data["success_probability"],
+            market_insights=advice_data["market_insights"],
+            model_used=advice_data.get("model_used"),
+            prompt_mode=usage.get("prompt_mode"),
+            prompt_tokens=usage.get("prompt_tokens"),
+            response_tokens=usage.get("response_tokens"),
+            latency_ms=usage.get("latency_ms")
+        ), request.property_info.location, request.property_info.current_price)
+
+def _check_model(model_name: str):
+    """请求指定的模型必须在可用模型列表中，否则在创建会话之前返回400"""
+    if not container.ai_service.is_available(model_name):
+        raise HTTPException(status_code=400, detail=f"不支持的模型: {model_name}，可用模型见 /models")
+
+def _retry_after(error: AdmissionRejected) -> int:
+    return max(1, math.ceil(error.retry_after))
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/negotiate", response_model=NegotiationAdvice)
+async def get_negotiation_advice(request: NegotiationRequest):
+    """
+    获取租房谈判建议
+    """
+    _check_model(request.model_name)
+    try:
+        session_id = await _create_session(request)
         
         # 调用AI服务
-        advice_data = await ai_service.get_negotiation_advice(
-            property_dict,
+        advice_data = await container.ai_service.get_negotiation_advice(
+            _property_dict(request),
             request.user_budget,
             request.urgency,
             request.additional_info,
-            request.model_name
+            request.model_name,
+            use_cache=not request.bypass_cache,
+            prompt_mode=request.prompt_mode
         )
         
-        # 更新会话记录，保存AI建议
-        session.suggested_price = advice_data["suggested_price"]
-        session.negotiation_strategy = advice_data["negotiation_strategy"]
-        session.talking_points = advice_data["talking_points"]
-        session.risk_assessment = advice_data["risk_assessment"]
-        session.success_probability = advice_data["success_probability"]
-        session.market_insights = advice_data["market_insights"]
-        db.commit()
+        await _apply_advice(session_id, request, advice_data)
         
-        return NegotiationAdvice(session_id=session.id, **advice_data)
+        return NegotiationAdvice(session_id=session_id, **advice_data)
         
+    except AdmissionRejected as e:
+        # ADMISSION_SHED_MODE=reject 时过载直接返回429，由客户端稍后重试
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(_retry_after(e))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成谈判建议失败: {str(e)}")
 
+@app.post("/negotiate/stream")
+async def stream_negotiation_advice(request: NegotiationRequest):
+    """
+    以Server-Sent Events流式返回谈判建议
+    
+    事件顺序：session（会话ID）→ preview（定价模型即时预估，模型未就绪时没有）
+    → field（每个完整字段/每条话术）→ done（完整建议）
+    """
+    _check_model(request.model_name)
+    try:
+        session_id = await _create_session(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"生成谈判建议失败: {str(e)}")
+    
+    async def event_stream():
+        yield _sse("session", {"session_id": session_id})
+        try:
+            async for event in container.ai_service.stream_negotiation_advice(
+                _property_dict(request),
+                request.user_budget,
+                request.urgency,
+                request.additional_info,
+                request.model_name,
+                use_cache=not request.bypass_cache,
+                prompt_mode=request.prompt_mode
+            ):
+                if "preview" in event:
+                    yield _sse("preview", event["preview"])
+                    continue
+                if "advice" not in event:
+                    yield _sse("field", event)
+                    continue
+                
+                advice_data = event["advice"]
+                # 流结束后再持久化建议
+                await _apply_advice(session_id, request, advice_data)
+                yield _sse("done", NegotiationAdvice(session_id=session_id, **advice_data).model_dump())
+        except AdmissionRejected as e:
+            yield _sse("error", {"detail": str(e), "retry_after": _retry_after(e)})
+        except Exception as e:
+            yield _sse("error", {"detail": f"生成谈判建议失败: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _validate_batch(batch: BatchNegotiationRequest):
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="批量请求不能为空")
+    if len(batch.items) > container.batch_policy.max_items:
+        raise HTTPException(status_code=400, detail=f"批量请求最多包含{container.batch_policy.max_items}套房源")
+    for item in batch.items:
+        _check_model(item.model_name)
+
+async def _batch_advice(batch: BatchNegotiationRequest, session_ids: List[int]) -> AsyncIterator[Tuple[int, NegotiationAdvice]]:
+    """
+    并发评估批量请求中的每套房源，按完成顺序产出 (序号, 建议)
+    
+    单套房源失败时只对该房源使用fallback建议，不影响其他房源
+    """
+    items = batch.items
+    
+    async def finish(index: int, advice_data: Dict[str, Any]) -> Tuple[int, NegotiationAdvice]:
+        try:
+            await _apply_advice(session_ids[index], items[index], advice_data)
+        except Exception as e:
+            logger.error("保存批量建议失败", extra={"session_id": session_ids[index], "error": str(e)})
+        return index, NegotiationAdvice(session_id=session_ids[index], **advice_data)
+    
+    def fallback(index: int, error: Exception) -> Dict[str, Any]:
+        logger.error("批量评估单项失败，使用fallback建议", extra={"session_id": session_ids[index], "error": str(error)})
+        return container.ai_service.fallback_advice(_property_dict(items[index]), items[index].user_budget, items[index].urgency)
+    
+    async def run_single(index: int) -> List[Tuple[int, NegotiationAdvice]]:
+        request = items[index]
+        async with container.batch_policy.slot():
+            try:
+                advice_data = await container.ai_service.get_negotiation_advice(
+                    _property_dict(request),
+                    request.user_budget,
+                    request.urgency,
+                    request.additional_info,
+                    request.model_name,
+                    use_cache=not request.bypass_cache,
+                    prompt_mode=request.prompt_mode
+                )
+            except Exception as e:
+                advice_data = fallback(index, e)
+        return [await finish(index, advice_data)]
+    
+    async def run_pack(model_name: str, use_cache: bool, indexes: List[int]) -> List[Tuple[int, NegotiationAdvice]]:
+        cases = [
+            (_property_dict(items[index]), items[index].user_budget, items[index].urgency, items[index].additional_info)
+            for index in indexes
+        ]
+        async with container.batch_policy.slot():
+            try:
+                advices = await container.ai_service.get_packed_advice(cases, model_name, use_cache=use_cache)
+            except Exception as e:
+                advices = [fallback(index, e) for index in indexes]
+        return [await finish(index, advice_data) for index, advice_data in zip(indexes, advices)]
+    
+    if batch.pack:
+        groups = group_by([(item.model_name, not item.bypass_cache) for item in items])
+        coroutines = [run_pack(model_name, use_cache, indexes) for (model_name, use_cache), indexes in container.batch_policy.packs(groups)]
+    else:
+        coroutines = [run_single(index) for index in range(len(items))]
+    
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            for result in await completed:
+                yield result
+    finally:
+        # 客户端断开时取消尚未完成的评估
+        for task in tasks:
+            task.cancel()
+
+@app.post("/negotiate/batch", response_model=BatchNegotiationResponse)
+async def batch_negotiation_advice(batch: BatchNegotiationRequest):
+    """
+    批量获取多套房源的谈判建议，结果与请求顺序一致，每套房源对应一个会话
+    """
+    _validate_batch(batch)
+    try:
+        session_ids = [await _create_session(item) for item in batch.items]
+        results: List[Optional[NegotiationAdvice]] = [None] * len(batch.items)
+        async for index, advice in _batch_advice(batch, session_ids):
+            results[index] = advice
+        return BatchNegotiationResponse(results=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量生成谈判建议失败: {str(e)}")
+
+@app.post("/negotiate/batch/stream")
+async def stream_batch_negotiation_advice(batch: BatchNegotiationRequest):
+    """
+    以Server-Sent Events流式返回批量谈判建议
+    
+    事件顺序：sessions（各房源的会话ID）→ result（每套房源完成时，带index）→ done
+    """
+    _validate_batch(batch)
+    try:
+        session_ids = [await _create_session(item) for item in batch.items]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量生成谈判建议失败: {str(e)}")
+    
+    async def event_stream():
+        yield _sse("sessions", {"session_ids": session_ids})
+        try:
+            async for index, advice in _batch_advice(batch, session_ids):
+                yield _sse("result", {"index": index, **advice.model_dump()})
+            yield _sse("done", {"count": len(session_ids)})
+        except Exception as e:
+            yield _sse("error", {"detail": f"批量生成谈判建议失败: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/feedback")
-async def submit_feedback(feedback: FeedbackRequest, db: Session = Depends(get_db)):
+async def submit_feedback(feedback: FeedbackRequest, db: AsyncSession = Depends(get_db)):
     """
     提交用户反馈
     """
@@ -159,42 +452,131 @@ async def submit_feedback(feedback: FeedbackRequest, db: Session = Depends(get_d
             rating=feedback.rating
         )
         db.add(user_feedback)
-        db.commit()
+        # 会话可能还在写入队列中
+        await container.session_writer.wait_written(feedback.session_id)
+        session = await db.get(NegotiationSession, feedback.session_id)
+        await db.run_sync(lambda sync_db: market_data.record_feedback(sync_db, session, feedback.success, feedback.actual_price))
+        await db.commit()
+        container.http_cache.versions.touch([session.location if session else None])
         
         return {"message": "反馈提交成功", "feedback_id": user_feedback.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"提交反馈失败: {str(e)}")
 
+def _check_limit(limit: int):
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit 必须在1到500之间")
+
+def _export(table: str, query, id_column, fmt: str) -> StreamingResponse:
+    """流式导出响应；同时进行的导出已满时返回429"""
+    if not container.export_limiter.try_acquire():
+        raise HTTPException(status_code=429, detail="导出任务过多，请稍后重试", headers={"Retry-After": "10"})
+    return container.export_limiter.response(
+        history.export_rows(query, id_column, fmt, container.export_limiter.chunk_size),
+        media_type=history.EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{history.export_filename(table, fmt)}"'}
+    )
+
+@app.get("/sessions")
+async def list_sessions(
+    location: Optional[str] = None,
+    start: Optional[Union[datetime, date]] = None,
+    end: Optional[Union[datetime, date]] = None,
+    model: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50,
+    include_archived: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    按ID倒序分页列出谈判会话，可按位置、时间范围 [start, end)（日期或日期时间）、模型筛选
+    
+    下一页传入上一页返回的 next_cursor，为null时已是最后一页。
+    已归档会话的正文为空，include_archived=true 时从归档文件补齐
+    """
+    _check_limit(limit)
+    try:
+        rows = (await db.execute(history.page(history.session_query(location, start, end, model), NegotiationSession.id, cursor, limit))).all()
+        result = history.page_result(rows, limit)
+        archived = [item for item in result["items"] if item["archived_at"]]
+        if include_archived and archived:
+            records = await asyncio.to_thread(
+                container.archiver.store.load, [(item["id"], datetime.fromisoformat(item["created_at"])) for item in archived]
+            )
+            for item in archived:
+                record = records.get(item["id"])
+                if record is not None:
+                    item.update({name: record[name] for name in ARCHIVED_COLUMNS})
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取会话列表失败: {str(e)}")
+
+@app.get("/sessions/export")
+async def export_sessions(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    location: Optional[str] = None,
+    start: Optional[Union[datetime, date]] = None,
+    end: Optional[Union[datetime, date]] = None,
+    model: Optional[str] = None
+):
+    """
+    以NDJSON或CSV流式导出满足条件的全部会话（按ID升序）
+    
+    已归档会话只导出数据库中保留的列，正文用 python -m services.archive cat 导出
+    """
+    return _export("sessions", history.session_query(location, start, end, model), NegotiationSession.id, format)
+
+@app.get("/feedback")
+async def list_feedback(
+    location: Optional[str] = None,
+    start: Optional[Union[datetime, date]] = None,
+    end: Optional[Union[datetime, date]] = None,
+    model: Optional[str] = None,
+    session_id: Optional[int] = None,
+    success: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    按ID倒序分页列出用户反馈（附带所属会话的位置、报价和模型），筛选与翻页方式同 /sessions
+    """
+    _check_limit(limit)
+    try:
+        query = history.feedback_query(location, start, end, model, session_id, success)
+        rows = (await db.execute(history.page(query, UserFeedback.id, cursor, limit))).all()
+        return history.page_result(rows, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取反馈列表失败: {str(e)}")
+
+@app.get("/feedback/export")
+async def export_feedback(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    location: Optional[str] = None,
+    start: Optional[Union[datetime, date]] = None,
+    end: Optional[Union[datetime, date]] = None,
+    model: Optional[str] = None,
+    success: Optional[str] = None
+):
+    """以NDJSON或CSV流式导出满足条件的全部反馈（按ID升序）"""
+    return _export("feedback", history.feedback_query(location, start, end, model, success=success), UserFeedback.id, format)
+
 @app.get("/market-analysis/{location}")
-async def get_market_analysis(location: str, db: Session = Depends(get_db)):
+async def get_market_analysis(location: str, request: Request, db: AsyncSession = Depends(get_db)):
     """
     获取区域市场行情分析
+    
+    按省/市/区层级读取增量维护的MarketData；位置无法解析时按区名索引或全文索引统计。
+    ETag按该地区的数据版本生成，版本未变时不查询数据库
     """
-    try:
-        # 查询该区域的历史数据
-        sessions = db.query(NegotiationSession).filter(
-            NegotiationSession.location.contains(location)
-        ).all()
-        
-        if sessions:
-            prices = [s.current_price for s in sessions if s.current_price]
-            suggested_prices = [s.suggested_price for s in sessions if s.suggested_price]
-            
-            if prices:
-                avg_price = sum(prices) // len(prices)
-                if suggested_prices:
-                    avg_discount = sum((p - sp) for p, sp in zip(prices, suggested_prices) if sp) // len(suggested_prices)
-                    discount_percent = (avg_discount / avg_price * 100) if avg_price > 0 else 0
-                else:
-                    discount_percent = 5  # 默认值
-                    
-                return {
-                    "location": location,
-                    "average_price": avg_price,
-                    "sample_size": len(sessions),
-                    "average_discount": f"{discount_percent:.1f}%",
-                    "analysis": f"{location}地区平均租金{avg_price}元，建议砍价幅度{discount_percent:.1f}%"
-                }
+    async def build():
+        summary = await db.run_sync(market_data.analyze, location)
+        if summary is not None:
+            return {
+                "location": location,
+                **summary,
+                "analysis": f"{location}地区平均租金{summary['average_price']}元，建议砍价幅度{summary['average_discount']}"
+            }
         
         # 没有历史数据时返回默认分析
         return {
@@ -204,29 +586,97 @@ async def get_market_analysis(location: str, db: Session = Depends(get_db)):
             "average_discount": "5-10%",
             "analysis": f"{location}地区暂无足够数据，建议砍价幅度5-10%"
         }
+    
+    try:
+        return await container.http_cache.respond(
+            request, f"market:{location}", CACHE_CONTROL["market"], build, versions=[market_version_name(location)]
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取市场分析失败: {str(e)}")
 
+@app.get("/comparables")
+async def get_comparables(location: str, property_type: str, current_price: int, area: Optional[int] = None, k: int = 5):
+    """
+    同地区同房型中面积和报价最接近的历史房源
+    
+    所在地区的同类房源不足k套时退到上一级地区，scope为实际使用的地区
+    """
+    if not 1 <= k <= 50:
+        raise HTTPException(status_code=400, detail="k 必须在1到50之间")
+    try:
+        scope, comparables = container.ai_service.comparables.search(location, property_type, area, current_price, k)
+        return {
+            "location": location,
+            "scope": scope,
+            "ready": container.ai_service.comparables.ready,
+            "comparables": comparables
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取同类房源失败: {str(e)}")
+
 @app.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
+async def get_stats(request: Request, db: AsyncSession = Depends(get_db)):
     """
     获取平台统计数据
+    
+    数据库统计按全局写入版本缓存，会话和反馈写入后才重新查询；缓存计数在内存中、随时变化，
+    每次请求读取后合并，ETag同时包含数据版本和计数，两者都未变化时直接返回304
     """
-    try:
-        total_sessions = db.query(NegotiationSession).count()
-        total_feedback = db.query(UserFeedback).count()
-        successful_negotiations = db.query(UserFeedback).filter(
-            UserFeedback.success == "success"
-        ).count()
+    async def build():
+        total_sessions = await db.scalar(select(func.count()).select_from(NegotiationSession))
+        total_feedback = await db.scalar(select(func.count()).select_from(UserFeedback))
+        successful_negotiations = await db.scalar(
+            select(func.count()).select_from(UserFeedback).where(UserFeedback.success == "success")
+        )
         
         success_rate = (successful_negotiations / total_feedback * 100) if total_feedback > 0 else 0
         
+        # 按模型和提示词模式统计实际调用的平均token数与耗时
+        usage_rows = (await db.execute(
+            select(
+                NegotiationSession.model_used,
+                NegotiationSession.prompt_mode,
+                func.count(NegotiationSession.id),
+                func.avg(NegotiationSession.prompt_tokens),
+                func.avg(NegotiationSession.response_tokens),
+                func.avg(NegotiationSession.latency_ms)
+            ).where(
+                NegotiationSession.latency_ms.isnot(None)
+            ).group_by(NegotiationSession.model_used, NegotiationSession.prompt_mode)
+        )).all()
+        
         return {
             "total_sessions": total_sessions,
             "total_feedback": total_feedback,
             "success_rate": f"{success_rate:.1f}%",
-            "successful_negotiations": successful_negotiations
+            "successful_negotiations": successful_negotiations,
+            "token_usage": [
+                {
+                    "model": model,
+                    "prompt_mode": mode,
+                    "calls": calls,
+                    "avg_prompt_tokens": round(prompt_tokens) if prompt_tokens is not None else None,
+                    "avg_response_tokens": round(response_tokens) if response_tokens is not None else None,
+                    "avg_latency_ms": round(latency_ms) if latency_ms is not None else None
+                }
+                for model, mode, calls, prompt_tokens, response_tokens, latency_ms in usage_rows
+            ]
         }
+    
+    def live():
+        # 其他worker的上报和语义缓存加载都会改变计数，但不递增数据版本
+        return {
+            "advice_cache": container.ai_service.cache.stats(
+                container.shared_state.combined("advice_cache", container.ai_service.cache.counters)
+            ),
+            "semantic_cache": container.ai_service.semantic_cache.stats(
+                container.shared_state.combined("semantic_cache", container.ai_service.semantic_cache.counters)
+            ),
+        }
+    
+    try:
+        return await container.http_cache.respond(request, "stats", CACHE_CONTROL["stats"], build,
+                                                  versions=[SESSIONS], live=live)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计数据失败: {str(e)}")
 
@@ -2,7 +2,7 @@
 数据库模型定义
 """
 
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, JSON
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, JSON, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -16,6 +16,10 @@ class NegotiationSession(Base):
     
     # 房屋信息
     location = Column(String, nullable=False)
+    # 由location解析出的省/市/区（见 services/location.py），解析不出时为空
+    province = Column(String, nullable=True, index=True)
+    city = Column(String, nullable=True, index=True)
+    district = Column(String, nullable=True, index=True)
     current_price = Column(Integer, nullable=False)
     property_type = Column(String, nullable=False)
     area = Column(Integer, nullable=True)
@@ -34,10 +38,24 @@ class NegotiationSession(Base):
     risk_assessment = Column(Text, nullable=True)
     success_probability = Column(Float, nullable=True)
     market_insights = Column(Text, nullable=True)
+    model_used = Column(String, nullable=True)  # 实际给出建议的模型，"fallback"表示兜底建议
+    
+    # 模型调用用量（缓存命中或兜底建议时为空）
+    prompt_mode = Column(String, nullable=True)  # "full" / "compact"
+    prompt_tokens = Column(Integer, nullable=True)
+    response_tokens = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
     
     # 元数据
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    # 正文已移入归档文件的时间（见 services/archive.py），未归档为空
+    archived_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # 归档任务按写入时间顺序查找未归档的会话
+        Index("ix_negotiation_sessions_archive", "archived_at", "created_at"),
+    )
 
 class UserFeedback(Base):
     """
@@ -64,6 +82,7 @@ class MarketData(Base):
     __tablename__ = "market_data"
 
     id = Column(Integer, primary_key=True, index=True)
+    # 层级键，如 "北京"、"北京/朝阳"、"广东/深圳/南山"；无法解析的位置使用原文
     location = Column(String, nullable=False, unique=True)
     
     # 市场数据
@@ -72,6 +91,40 @@ class MarketData(Base):
     market_heat = Column(String, nullable=True)  # "hot", "moderate", "cold"
     sample_size = Column(Integer, default=0)  # 数据样本数量
     
+    # 增量维护的累计值（写入会话/反馈时原子累加，见 services/market_data.py）
+    price_sum = Column(Integer, default=0)  # 报价总和
+    price_ewma = Column(Float, nullable=True)  # 报价的快速指数移动平均
+    price_ewma_slow = Column(Float, nullable=True)  # 报价的慢速指数移动平均，与快速均线比较判断趋势
+    suggested_count = Column(Integer, default=0)  # 有建议价格的会话数
+    discount_sum = Column(Integer, default=0)  # 报价与建议价格之差的总和
+    feedback_count = Column(Integer, default=0)  # 反馈数
+    success_count = Column(Integer, default=0)  # 谈判成功的反馈数
+    deal_count = Column(Integer, default=0)  # 填写了实际成交价的反馈数
+    deal_discount_sum = Column(Integer, default=0)  # 报价与实际成交价之差的总和
+    
     # 元数据
     last_updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
-    created_at = Column(DateTime, server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, server_default=func.now())
+
+class AdviceCacheEntry(Base):
+    """
+    谈判建议缓存（持久层）
+    """
+    __tablename__ = "advice_cache"
+
+    key = Column(String, primary_key=True)  # 标准化请求内容的SHA-256
+    model_name = Column(String, nullable=True)
+    advice = Column(JSON, nullable=False)
+
+    # 过期时间
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+
+class IdSequence(Base):
+    """
+    按段预留的ID序列（会话ID在写入数据库之前就需要分配）
+    """
+    __tablename__ = "id_sequences"
+
+    name = Column(String, primary_key=True)  # 序列名，通常为表名
+    next_value = Column(Integer, nullable=False)  # 下一个尚未预留的ID
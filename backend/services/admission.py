@@ -0,0 +1,281 @@
+"""
+模型调用准入：按模型的令牌桶限速，按紧急程度排队，队列满或等待超时时削减负载
+
+令牌按Gemini配额（每分钟请求数）匀速补充。没有令牌时请求进入该模型的优先级队列：
+urgent 排在最前、等待上限最短，flexible 排在最后、可以等待更久。队列已满时，
+新到的高优先级请求会挤掉队尾优先级更低的请求；被削减的请求按配置返回兜底建议或429。
+多进程部署时令牌从共享状态中的同一个桶取，所有worker合计不超过配额；排队仍在各worker内进行。
+共享的桶暂时不可用（如文件被其他worker锁住超过 SHARED_STATE_BUSY_TIMEOUT_MS）时这次改用进程内的桶。
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+from typing import Dict, Iterable, List, Optional
+
+from services.concurrency import parse_model_overrides
+from services.hedging import LatencyTracker
+from services.shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {"urgent": 0, "normal": 1, "flexible": 2}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+SHED_FALLBACK = "fallback"
+SHED_REJECT = "reject"
+
+
+def priority_of(urgency: Optional[str]) -> int:
+    """紧急程度对应的优先级（数值越小越优先），未知取值按normal处理"""
+    return PRIORITIES.get((urgency or "normal").strip().lower(), PRIORITIES["normal"])
+
+
+def _parse_waits(raw: Optional[str]) -> Dict[int, float]:
+    """解析 "urgent=5,normal=15,flexible=60" 形式的各优先级最长等待秒数"""
+    waits = {PRIORITIES["urgent"]: 5.0, PRIORITIES["normal"]: 15.0, PRIORITIES["flexible"]: 60.0}
+    for item in (raw or "").split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        if name.strip().lower() in PRIORITIES:
+            waits[PRIORITIES[name.strip().lower()]] = max(0.0, float(value))
+    return waits
+
+
+class AdmissionRejected(Exception):
+    """请求被削减；retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, model_name: str, reason: str, retry_after: float):
+        super().__init__(f"模型 {model_name} 繁忙（{reason}），请{math.ceil(retry_after)}秒后重试")
+        self.model_name = model_name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    """单个模型的令牌桶与等待队列；shared 不为None时令牌取自各worker共用的桶"""
+
+    def __init__(self, model_name: str, rpm: int, burst: int, shared: Optional[SharedState] = None):
+        self.model_name = model_name
+        self.rate = rpm / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = asyncio.get_running_loop().time()
+        self.shared = shared
+        # 最近一次没取到令牌时，距下一个令牌的秒数
+        self.next_in = 0.0
+        # (优先级, 序号, future)，被挤掉或超时的等待者留在堆中，出队时跳过
+        self.waiters: List[tuple] = []
+        self.queued = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 正在进行的 pump，同一时间只有一个
+        self._pumping: Optional[asyncio.Task] = None
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self) -> bool:
+        """取一个令牌；共享的桶不可用时退回进程内的桶"""
+        if self.shared is not None:
+            try:
+                taken, self.tokens, self.next_in = await self.shared.take_token(self.model_name, self.rate, self.capacity)
+                return taken
+            except Exception as e:
+                logger.warning("共享令牌桶不可用，改用进程内令牌桶", extra={"model": self.model_name, "error": str(e)})
+        self.refill(asyncio.get_running_loop().time())
+        if self.tokens < 1:
+            self.next_in = (1 - self.tokens) / self.rate
+            return False
+        self.tokens -= 1
+        return True
+
+    async def give_back(self):
+        if self.shared is not None:
+            try:
+                self.tokens = await self.shared.give_back(self.model_name, self.capacity)
+                return
+            except Exception as e:
+                logger.warning("共享令牌桶不可用，改用进程内令牌桶", extra={"model": self.model_name, "error": str(e)})
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def retry_after(self) -> float:
+        """按当前排队长度估算的重试等待时间"""
+        return max(0.0, (self.queued + 1 - self.tokens) / self.rate)
+
+    def wake(self):
+        """没有已安排的检查时立即开始一次 pump"""
+        if self._timer is None and self._pumping is None:
+            self._pumping = asyncio.ensure_future(self.pump())
+
+    def _on_timer(self):
+        self._timer = None
+        self.wake()
+
+    async def pump(self):
+        """有令牌时按优先级唤醒等待者，否则在下一个令牌到来时再检查"""
+        try:
+            self._drop_done()
+            while self.waiters and await self.take():
+                # 取令牌期间等待者可能已超时或被取消
+                self._drop_done()
+                if not self.waiters:
+                    await self.give_back()
+                    break
+                _, _, waiter = heapq.heappop(self.waiters)
+                self.queued -= 1
+                waiter.set_result(None)
+                self._drop_done()
+        finally:
+            self._pumping = None
+        if self.waiters and self._timer is None:
+            # 共享的桶可能被其他worker先取走，到时没取到就再等下一个
+            self._timer = asyncio.get_running_loop().call_later(max(self.next_in, 0.001), self._on_timer)
+
+    def _drop_done(self):
+        """丢掉堆顶已失效（被挤掉、超时或取消）的等待者"""
+        while self.waiters and self.waiters[0][2].done():
+            heapq.heappop(self.waiters)
+
+
+class AdmissionScheduler:
+    """
+    按模型的准入调度
+
+    - default_rpm / overrides：每个模型每分钟的请求数上限，0表示不限速
+    - burst：令牌桶容量，允许的瞬时突发请求数
+    - max_queue：每个模型等待队列的长度上限
+    - max_waits：各优先级的最长等待秒数，超时即削减
+    - shed_mode：fallback（返回兜底建议）或 reject（返回429和Retry-After）
+    - models：给出时只为其中的模型创建令牌桶，其他名称直接报错
+    """
+
+    def __init__(self, default_rpm: int = 0, overrides: Optional[Dict[str, int]] = None, burst: int = 5,
+                 max_queue: int = 100, max_waits: Optional[Dict[int, float]] = None,
+                 shed_mode: str = SHED_FALLBACK, models: Optional[Iterable[str]] = None):
+        self.default_rpm = max(0, default_rpm)
+        self.overrides = overrides or {}
+        self.burst = burst
+        self.max_queue = max(1, max_queue)
+        self.max_waits = max_waits or _parse_waits(None)
+        self.shed_mode = shed_mode if shed_mode in (SHED_FALLBACK, SHED_REJECT) else SHED_FALLBACK
+        self.models = frozenset(models) if models is not None else None
+        # 多进程部署时由服务容器设置
+        self.shared: Optional[SharedState] = None
+        self._buckets: Dict[str, _Bucket] = {}
+        self._sequence = itertools.count()
+        self.waits = LatencyTracker()
+        self.counters = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_timeout": 0}
+
+    @classmethod
+    def from_env(cls, models: Optional[Iterable[str]] = None) -> "AdmissionScheduler":
+        return cls(
+            default_rpm=int(os.getenv("GEMINI_RATE_LIMIT_RPM", "0")),
+            overrides=parse_model_overrides(os.getenv("GEMINI_MODEL_RATE_LIMITS")),
+            burst=int(os.getenv("GEMINI_RATE_BURST", "5")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "100")),
+            max_waits=_parse_waits(os.getenv("ADMISSION_MAX_WAIT")),
+            shed_mode=os.getenv("ADMISSION_SHED_MODE", SHED_FALLBACK).lower(),
+            models=models,
+        )
+
+    def rpm_for(self, model_name: str) -> int:
+        return self.overrides.get(model_name, self.default_rpm)
+
+    def _bucket(self, model_name: str) -> Optional[_Bucket]:
+        rpm = self.rpm_for(model_name)
+        if rpm <= 0:
+            return None
+        bucket = self._buckets.get(model_name)
+        if bucket is None:
+            if self.models is not None and model_name not in self.models:
+                raise ValueError(f"不支持的模型: {model_name}")
+            bucket = self._buckets[model_name] = _Bucket(model_name, rpm, self.burst, self.shared)
+        return bucket
+
+    async def admit(self, model_name: str, urgency: Optional[str] = None):
+        """
+        取得一次模型调用的令牌，必要时按优先级排队等待
+
+        队列已满且没有更低优先级的请求可挤掉、或等待超过该优先级上限时抛出 AdmissionRejected
+        """
+        bucket = self._bucket(model_name)
+        if bucket is None:
+            self.counters["admitted"] += 1
+            return
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if not bucket.queued and await bucket.take():
+            self.counters["admitted"] += 1
+            self.waits.record(model_name, 0.0)
+            return
+
+        priority = priority_of(urgency)
+        if bucket.queued >= self.max_queue:
+            self._evict_lower(bucket, priority)
+
+        waiter = loop.create_future()
+        heapq.heappush(bucket.waiters, (priority, next(self._sequence), waiter))
+        bucket.queued += 1
+        self.counters["queued"] += 1
+        bucket.wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_waits[priority])
+        except asyncio.TimeoutError:
+            await self._abandon(bucket, waiter)
+            self.counters["shed_timeout"] += 1
+            raise AdmissionRejected(model_name, "等待超时", bucket.retry_after())
+        except asyncio.CancelledError:
+            await self._abandon(bucket, waiter)
+            raise
+        self.counters["admitted"] += 1
+        self.waits.record(model_name, loop.time() - started)
+
+    async def try_acquire(self, model_name: str) -> bool:
+        """不排队，有令牌（或不限速）时立即取得；用于对冲这类可有可无的调用"""
+        bucket = self._bucket(model_name)
+        if bucket is None:
+            return True
+        return not bucket.queued and await bucket.take()
+
+    def _evict_lower(self, bucket: _Bucket, priority: int):
+        """队列已满：挤掉优先级低于新请求的最后一个等待者，没有则拒绝新请求"""
+        candidates = [entry for entry in bucket.waiters if not entry[2].done() and entry[0] > priority]
+        if not candidates:
+            self.counters["shed_queue_full"] += 1
+            raise AdmissionRejected(bucket.model_name, "队列已满", bucket.retry_after())
+        _, _, waiter = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        self.counters["shed_queue_full"] += 1
+        bucket.queued -= 1
+        waiter.set_exception(AdmissionRejected(bucket.model_name, "被更高优先级的请求挤出队列", bucket.retry_after()))
+
+    async def _abandon(self, bucket: _Bucket, waiter: asyncio.Future):
+        if waiter.done():
+            if not waiter.cancelled() and waiter.exception() is None:
+                # 超时的同时已被唤醒：令牌归还
+                await bucket.give_back()
+                bucket.wake()
+            return
+        waiter.cancel()
+        bucket.queued -= 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """各模型的限速、剩余令牌、各优先级排队数与等待时间分位数"""
+        waits = self.waits.snapshot()
+        result = {}
+        for name, bucket in self._buckets.items():
+            queued = {label: 0 for label in PRIORITIES}
+            for priority, _, waiter in bucket.waiters:
+                if not waiter.done():
+                    queued[PRIORITY_NAMES[priority]] += 1
+            result[name] = {
+                "rpm": self.rpm_for(name),
+                "tokens": round(bucket.tokens, 2),
+                "queued": queued,
+                "wait": waits.get(name),
+            }
+        return {"shed_mode": self.shed_mode, "models": result, **self.counters}
@@ -0,0 +1,165 @@
+"""
+谈判建议缓存：按请求内容哈希，内存LRU + SQLite持久层
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, func, select
+
+from database import AsyncSessionLocal, dialect_insert
+from models import AdviceCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_request_text(value: Any) -> Any:
+    """去除首尾空白并合并连续空白，空字符串视为None"""
+    if not isinstance(value, str):
+        return value
+    value = " ".join(value.split())
+    return value or None
+
+
+def request_cache_key(property_info: Dict[str, Any], user_budget: int, urgency: str,
+                      additional_info: Optional[str], model_name: str, prompt_mode: str = "full") -> str:
+    """
+    对标准化后的请求内容计算稳定哈希，作为缓存键
+    """
+    payload = {
+        "property_info": {k: normalize_request_text(v) for k, v in sorted(property_info.items())},
+        "user_budget": user_budget,
+        "urgency": (urgency or "normal").strip().lower(),
+        "additional_info": normalize_request_text(additional_info),
+        "model_name": model_name,
+        "prompt_mode": prompt_mode,
+    }
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class AdviceCache:
+    """
+    两级缓存：进程内LRU命中最快，SQLite层在重启后依然有效
+    """
+
+    def __init__(self, enabled: bool = True, ttl_seconds: int = 86400, max_entries: int = 1024,
+                 persistent: bool = True, max_persistent_entries: int = 100000):
+        self.enabled = enabled
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.max_persistent_entries = max_persistent_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._writes_since_prune = 0
+        self.counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "bypassed": 0}
+
+    @classmethod
+    def from_env(cls) -> "AdviceCache":
+        return cls(
+            enabled=os.getenv("ADVICE_CACHE_ENABLED", "true").lower() == "true",
+            ttl_seconds=int(os.getenv("ADVICE_CACHE_TTL_SECONDS", "86400")),
+            max_entries=int(os.getenv("ADVICE_CACHE_MAX_ENTRIES", "1024")),
+            persistent=os.getenv("ADVICE_CACHE_PERSISTENT", "true").lower() == "true",
+            max_persistent_entries=int(os.getenv("ADVICE_CACHE_MAX_PERSISTENT_ENTRIES", "100000")),
+        )
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        now = datetime.now()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, advice = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return copy.deepcopy(advice)
+            del self._memory[key]
+
+        if self.persistent:
+            advice = await self._get_persistent(key, now)
+            if advice is not None:
+                self.counters["persistent_hits"] += 1
+                return copy.deepcopy(advice)
+
+        self.counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, advice: Dict[str, Any], model_name: Optional[str] = None):
+        if not self.enabled:
+            return
+        expires_at = datetime.now() + self.ttl
+        self._remember(key, expires_at, copy.deepcopy(advice))
+        if self.persistent:
+            await self._set_persistent(key, advice, model_name, expires_at)
+
+    def record_bypass(self):
+        self.counters["bypassed"] += 1
+
+    def stats(self, counters: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """counters：多进程部署时所有worker合计的计数，默认为本进程的"""
+        counters = counters or self.counters
+        hits = counters["memory_hits"] + counters["persistent_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "hit_rate": f"{(hits / lookups * 100) if lookups else 0:.1f}%",
+            "memory_entries": len(self._memory),
+        }
+
+    def _remember(self, key: str, expires_at: datetime, advice: Dict[str, Any]):
+        self._memory[key] = (expires_at, advice)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def _get_persistent(self, key: str, now: datetime) -> Optional[Dict[str, Any]]:
+        try:
+            async with AsyncSessionLocal() as db:
+                entry = await db.get(AdviceCacheEntry, key)
+            if entry is None or entry.expires_at <= now:
+                return None
+            # 回填内存层
+            self._remember(key, entry.expires_at, copy.deepcopy(entry.advice))
+            return entry.advice
+        except Exception as e:
+            logger.warning("读取建议缓存失败", extra={"error": str(e)})
+            return None
+
+    async def _set_persistent(self, key: str, advice: Dict[str, Any], model_name: Optional[str], expires_at: datetime):
+        async with AsyncSessionLocal() as db:
+            try:
+                # 单条UPSERT而不是merge（先读后写）：WAL下读事务升级为写事务时，
+                # 若期间已有其他连接提交，SQLite直接报 database is locked，busy_timeout不起作用
+                insert = dialect_insert(db)
+                stmt = insert(AdviceCacheEntry).values(key=key, model_name=model_name, advice=advice, expires_at=expires_at)
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=[AdviceCacheEntry.key],
+                    set_={"model_name": stmt.excluded.model_name, "advice": stmt.excluded.advice, "expires_at": stmt.excluded.expires_at}
+                ))
+                await db.commit()
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= 100:
+                    self._writes_since_prune = 0
+                    await self._prune(db)
+            except Exception as e:
+                await db.rollback()
+                logger.warning("写入建议缓存失败", extra={"error": str(e)})
+
+    async def _prune(self, db):
+        """清理过期条目，并把持久层裁剪到容量上限（先淘汰最早写入的）"""
+        await db.execute(delete(AdviceCacheEntry).where(AdviceCacheEntry.expires_at <= datetime.now()))
+        overflow = await db.scalar(select(func.count()).select_from(AdviceCacheEntry)) - self.max_persistent_entries
+        if overflow > 0:
+            oldest = select(AdviceCacheEntry.key).order_by(AdviceCacheEntry.created_at).limit(overflow)
+            await db.execute(delete(AdviceCacheEntry).where(AdviceCacheEntry.key.in_(oldest)).execution_options(synchronize_session=False))
+        await db.commit()
@@ -1,13 +1,48 @@
-import google.generativeai as genai
-import json
+import asyncio
 import re
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, Optional, AsyncIterator, List, Tuple, Union
 import os
+import logging
+from services.concurrency import ModelConcurrencyLimiter
+from services.advice_cache import AdviceCache, request_cache_key
+from services.stream_parser import IncrementalAdviceParser, advice_events
+from services.hedging import HedgePolicy, LatencyTracker
+from services.single_flight import SingleFlight
+from services.admission import AdmissionScheduler, AdmissionRejected, SHED_REJECT, priority_of
+from services.json_extractor import extract_json
+from services.prompts import PROMPT_MODE_COMPACT, PROMPT_MODE_PACKED, build_compact_contents, build_packed_contents, default_prompt_mode, parse_additional_info
+from services.log import log_payload
+from services.metrics import stage, LLM_CALL_SECONDS, LLM_ERRORS, PARSE_RESULTS, PARSE_REPAIRS, FALLBACK_ADVICE, PRICE_BOUNDED
+from services.pricing import PricingEngine
+from services.comparables import ComparablesIndex
+from services.semantic_cache import SemanticCache
+
+logger = logging.getLogger(__name__)
+
+_genai = None
+
+def gemini_sdk():
+    """
+    首次使用时导入并配置Gemini SDK
+    
+    SDK连同gRPC和protobuf类型导入约需1秒，不在模块加载时导入；启动预热在线程中调用，不阻塞事件循环
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        # GEMINI_API_ENDPOINT 指向本地替身（benchmarks/fake_gemini.py）时用于压测
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"), client_options={"api_endpoint": endpoint} if endpoint else None)
+        _genai = genai
+    return _genai
 
 class GeminiNegotiationService:
     def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = None  # 不在初始化时创建模型
+        # 模型句柄池：按名称复用已创建的GenerativeModel
+        self._models: Dict[str, Any] = {}
+        # 预热状态："ready" 或失败原因
+        self.model_status: Dict[str, str] = {}
         
         # 可用模型列表
         self.available_models = [
@@ -18,94 +53,534 @@ class GeminiNegotiationService:
             'gemini-1.5-flash',
             'gemini-pro'
         ]
+        
+        # 按模型限制并发，超出上限的请求在事件循环上排队
+        self.limiter = ModelConcurrencyLimiter.from_env(self.available_models)
+        
+        # 相同请求的建议缓存（内存LRU + SQLite）
+        self.cache = AdviceCache.from_env()
+        
+        # 延迟预算与对冲请求
+        self.hedge = HedgePolicy.from_env()
+        self.latency = LatencyTracker()
+        
+        # 提示词模式（full/compact），请求可单独指定
+        self.prompt_mode = default_prompt_mode()
+        # SDK响应中没有用量信息时，是否额外调用count_tokens统计token数
+        self.count_tokens_fallback = os.getenv("GEMINI_COUNT_TOKENS_FALLBACK", "false").lower() == "true"
+        
+        # 按模型令牌桶限速，按紧急程度排队，过载时削减
+        self.scheduler = AdmissionScheduler.from_env(self.available_models)
+        
+        # 相同请求（按缓存键）并发到达时只调用一次模型
+        self.in_flight = SingleFlight.from_env()
+        
+        # 基于成交反馈的本地定价模型：兜底建议、流式即时预估、模型建议价校验
+        self.pricing = PricingEngine.from_env()
+        
+        # 历史会话的同类房源索引：用户未提供对比数据时注入提示词
+        self.comparables = ComparablesIndex.from_env()
+        
+        # 相似请求复用历史建议（精确缓存未命中时查找）
+        self.semantic_cache = SemanticCache.from_env()
+    
+    def is_available(self, model_name: str) -> bool:
+        return model_name in self.available_models
+    
+    def _require_model(self, model_name: str):
+        """
+        入口处校验模型名：缓存键、限速/并发状态和指标标签都按模型名区分，
+        只接受 available_models 中的模型，这些状态和指标序列的数量才有上限
+        """
+        if not self.is_available(model_name):
+            raise ValueError(f"不支持的模型: {model_name}")
     
     def get_model(self, model_name: str):
-        """动态创建指定的模型"""
-        try:
-            model = genai.GenerativeModel(model_name)
-            print(f"✅ 成功创建模型: {model_name}")
+        """从句柄池获取模型，首次使用时创建；只接受 available_models 中的模型，句柄池不会随任意模型名增长"""
+        model = self._models.get(model_name)
+        if model is not None:
             return model
+        if not self.is_available(model_name):
+            raise ValueError(f"不支持的模型: {model_name}")
+        
+        status = self.model_status.get(model_name)
+        if status is not None and status != "ready":
+            # 启动探测已失败的模型直接报错，交由fallback处理，不再发起网络请求
+            raise ValueError(f"模型 {model_name} 不可用: {status}")
+        
+        try:
+            model = gemini_sdk().GenerativeModel(model_name)
         except Exception as e:
-            print(f"❌ 模型 {model_name} 创建失败: {str(e)}")
+            logger.error("模型创建失败", extra={"model": model_name, "error": str(e)})
             raise e
+        self._models[model_name] = model
+        return model
     
-    async def get_negotiation_advice(self, property_info: Dict[str, Any], user_budget: int, urgency: str = "normal", additional_info: Optional[str] = None, model_name: str = "gemini-1.5-pro") -> Dict[str, Any]:
+    async def warm_up(self, probe: bool = False, timeout: float = 10.0, strict: bool = False):
+        """
+        启动时为所有可用模型创建句柄
+        
+        probe=True 时对每个模型做一次count_tokens探测，确认模型名有效且可访问；
+        strict=True 时任一模型失败都会抛出异常，让服务在启动阶段就失败
+        """
+        await asyncio.to_thread(gemini_sdk)
+        
+        async def warm(model_name: str):
+            try:
+                model = self.get_model(model_name)
+                if probe:
+                    await asyncio.wait_for(model.count_tokens_async("ping"), timeout)
+                self.model_status[model_name] = "ready"
+            except Exception as e:
+                self._models.pop(model_name, None)
+                self.model_status[model_name] = f"{type(e).__name__}: {str(e)}"
+        
+        await asyncio.gather(*(warm(name) for name in self.available_models))
+        
+        ready = self.ready_models()
+        logger.info("模型预热完成", extra={"ready": len(ready), "total": len(self.available_models)})
+        failed = {name: status for name, status in self.model_status.items() if status != "ready"}
+        for name, status in failed.items():
+            logger.error("模型预热失败", extra={"model": name, "error": status})
+        if strict and failed:
+            raise RuntimeError(f"模型预热失败: {', '.join(failed)}")
+    
+    def ready_models(self) -> List[str]:
+        return [name for name in self.available_models if self.model_status.get(name) == "ready"]
+    
+    async def get_negotiation_advice(self, property_info: Dict[str, Any], user_budget: int, urgency: str = "normal", additional_info: Optional[str] = None, model_name: str = "gemini-1.5-pro", use_cache: bool = True, prompt_mode: Optional[str] = None) -> Dict[str, Any]:
         """
         获取租房谈判建议
+        
+        use_cache=False 时跳过缓存读取，但新结果仍会写入缓存；进行中的相同请求无论是否跳过缓存都会合并。
+        精确缓存未命中时查找语义缓存，命中相似请求时返回按本次报价和预算调整后的历史建议。
+        实际调用模型时结果中带有 usage（提示词模式、token数、耗时），缓存命中或合并得到的结果没有
         """
-        prompt = self._build_negotiation_prompt(property_info, user_budget, urgency, additional_info)
+        self._require_model(model_name)
+        prompt_mode = prompt_mode or self.prompt_mode
+        cache_key = request_cache_key(property_info, user_budget, urgency, additional_info, model_name, prompt_mode)
+        if use_cache:
+            with stage("cache_lookup"):
+                cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("命中建议缓存", extra={"model": model_name})
+                return cached
+            similar = self._semantic_lookup(property_info, user_budget, urgency, additional_info, model_name)
+            if similar is not None:
+                return similar
+        else:
+            self.cache.record_bypass()
+        
+        try:
+            # 相同请求同时只调用一次模型，重复请求等待并共享结果
+            result, coalesced = await self.in_flight.do(
+                cache_key,
+                lambda: self._generate_advice(cache_key, prompt_mode, property_info, user_budget, urgency, additional_info, model_name)
+            )
+            if coalesced:
+                # 模型用量只记在发起调用的会话上
+                result.pop("usage", None)
+                logger.info("合并相同的进行中请求", extra={"model": model_name})
+            return result
+        except AdmissionRejected as e:
+            if self.scheduler.shed_mode == SHED_REJECT:
+                raise
+            logger.warning("模型调用被削减，使用fallback建议", extra={"model": model_name, "urgency": urgency, "reason": e.reason})
+            return self.fallback_advice(property_info, user_budget, urgency, reason="shed")
+        except Exception as e:
+            logger.error("AI服务失败，使用fallback建议", extra={"model": model_name, "error": str(e)})
+            # 如果AI解析失败或超出延迟预算，返回基础建议
+            return self.fallback_advice(property_info, user_budget, urgency)
+    
+    async def _generate_advice(self, cache_key: str, prompt_mode: str, property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str], model_name: str) -> Dict[str, Any]:
+        """构建prompt、调用模型并写入缓存；失败时抛出异常"""
+        with stage("prompt_build"):
+            prompt = self._build_contents(prompt_mode, property_info, user_budget, urgency, additional_info)
+        
+        log_payload(logger, "发送给Gemini的prompt", prompt if isinstance(prompt, str) else prompt[-1], prompt_mode=prompt_mode)
         
-        print("🤖 发送给Gemini的prompt:")
-        print("=" * 50)
-        print(prompt)
-        print("=" * 50)
+        # 按紧急程度排队取得调用令牌，被削减时抛出AdmissionRejected
+        with stage("admission_wait"):
+            await self.scheduler.admit(model_name, urgency)
+        parsed_result = await self._hedged_call(model_name, prompt)
+        self._bound_price(parsed_result, property_info, user_budget, urgency)
+        usage = parsed_result.pop("usage")
+        usage["prompt_mode"] = prompt_mode
+        # 只缓存模型生成的建议，fallback结果不缓存；用量只属于本次调用，不写入缓存
+        with stage("cache_store"):
+            await self.cache.set(cache_key, parsed_result, model_name)
+        self.semantic_cache.add(property_info, user_budget, urgency, additional_info, model_name, parsed_result)
+        parsed_result["usage"] = usage
+        return parsed_result
+    
+    async def get_packed_advice(self, cases: List[Tuple[Dict[str, Any], int, str, Optional[str]]], model_name: str = "gemini-1.5-pro", use_cache: bool = True) -> List[Dict[str, Any]]:
+        """
+        一次模型调用评估多套房源，按输入顺序返回每套房源的建议
         
+        cases 中每项为 (property_info, user_budget, urgency, additional_info)。
+        缓存命中的房源不进入提示词；模型未给出有效建议的房源单独使用fallback建议
+        """
+        self._require_model(model_name)
+        cache_keys = [request_cache_key(*case, model_name, PROMPT_MODE_PACKED) for case in cases]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(cases)
+        if use_cache:
+            for index, cache_key in enumerate(cache_keys):
+                results[index] = await self.cache.get(cache_key)
+                if results[index] is None:
+                    results[index] = self._semantic_lookup(*cases[index], model_name)
+        else:
+            for _ in cases:
+                self.cache.record_bypass()
+        
+        missing = [index for index, result in enumerate(results) if result is None]
+        if not missing:
+            logger.info("打包请求全部命中建议缓存", extra={"model": model_name, "cases": len(cases)})
+            return results
+        
+        with stage("prompt_build"):
+            prompt = build_packed_contents(
+                [cases[index] for index in missing],
+                [self._comparables_for(cases[index][0], cases[index][3]) for index in missing]
+            )
+        log_payload(logger, "发送给Gemini的prompt", prompt[-1], prompt_mode=PROMPT_MODE_PACKED)
         try:
-            # 动态创建指定模型
-            model = self.get_model(model_name)
-            response = model.generate_content(prompt)
-            print("✅ Gemini响应结构:")
-            print(f"Candidates数量: {len(response.candidates)}")
-            
-            # 正确获取响应文本
-            if response.candidates and response.candidates[0].content.parts:
-                response_text = ""
-                for part in response.candidates[0].content.parts:
-                    if hasattr(part, 'text'):
-                        response_text += part.text
-                
-                print("✅ Gemini原始响应:")
-                print(response_text)
-                print("=" * 50)
+            # 打包调用按其中最紧急的房源排队
+            with stage("admission_wait"):
+                await self.scheduler.admit(model_name, min((case[2] for case in cases), key=priority_of))
+            advices = await asyncio.wait_for(self._call_packed(model_name, prompt, len(missing)), self.hedge.latency_budget)
+        except Exception as e:
+            logger.error("AI打包调用失败，使用fallback建议", extra={"model": model_name, "cases": len(missing), "error": str(e)})
+            advices = [None] * len(missing)
+        
+        for index, advice in zip(missing, advices):
+            if advice is None:
+                results[index] = self.fallback_advice(cases[index][0], cases[index][1], cases[index][2], reason="packed")
+                continue
+            self._bound_price(advice, cases[index][0], cases[index][1], cases[index][2])
+            usage = advice.pop("usage")
+            await self.cache.set(cache_keys[index], advice, model_name)
+            self.semantic_cache.add(*cases[index], model_name, advice)
+            advice["usage"] = usage
+            results[index] = advice
+        return results
+    
+    async def _call_packed(self, model_name: str, prompt: List[str], count: int) -> List[Optional[Dict[str, Any]]]:
+        """调用模型评估count个案例，返回按案例顺序的建议；缺失或无效的位置为None"""
+        started = time.perf_counter()
+        try:
+            with stage("model_init"):
+                model = self.get_model(model_name)
+            with stage("model_call"):
+                async with self.limiter.slot(model_name):
+                    response = await model.generate_content_async(prompt)
+        except Exception as e:
+            LLM_ERRORS.inc(model=model_name, error=type(e).__name__)
+            raise
+        
+        response_text = self._response_text(response)
+        if not response_text:
+            LLM_ERRORS.inc(model=model_name, error="EmptyResponse")
+            raise ValueError("响应中没有文本内容")
+        log_payload(logger, "Gemini原始响应", response_text, model=model_name, prompt_mode=PROMPT_MODE_PACKED)
+        
+        with stage("parse"):
+            parsed, repairs = extract_json(response_text, want='[')
+        if not isinstance(parsed, list):
+            PARSE_RESULTS.inc(outcome="invalid")
+            raise ValueError(f"{model_name} 未返回建议数组")
+        self._record_parse(repairs)
+        if repairs:
+            logger.info("JSON解析时进行了修复", extra={"repairs": repairs})
+        
+        # 优先按index对应，没有index时按位置对应
+        advices: List[Optional[Dict[str, Any]]] = [None] * count
+        for position, item in enumerate(parsed):
+            if not isinstance(item, dict):
+                continue
+            index = item.pop("index", position)
+            if not isinstance(index, int) or not 0 <= index < count or advices[index] is not None:
+                continue
+            if not isinstance(item.get('suggested_price'), (int, float)) or item['suggested_price'] <= 0:
+                continue
+            advices[index] = self._process_parsed_data(item)
+        
+        valid = sum(advice is not None for advice in advices)
+        if not valid:
+            LLM_ERRORS.inc(model=model_name, error="InvalidAdvice")
+            raise ValueError(f"{model_name} 未返回有效的建议价格")
+        
+        prompt_tokens, response_tokens = await self._token_counts(model, response, prompt, response_text)
+        elapsed = time.perf_counter() - started
+        LLM_CALL_SECONDS.observe(elapsed, model=model_name, mode=PROMPT_MODE_PACKED)
+        for advice in advices:
+            if advice is None:
+                continue
+            advice['model_used'] = model_name
+            # 一次调用的token数按有效案例平摊
+            advice['usage'] = {
+                "prompt_mode": PROMPT_MODE_PACKED,
+                "prompt_tokens": round(prompt_tokens / valid) if prompt_tokens is not None else None,
+                "response_tokens": round(response_tokens / valid) if response_tokens is not None else None,
+                "latency_ms": int(elapsed * 1000)
+            }
+        return advices
+    
+    async def _call_model(self, model_name: str, prompt: Union[str, List[str]]) -> Dict[str, Any]:
+        """调用单个模型并解析结果；结果无效时抛出异常"""
+        started = time.perf_counter()
+        try:
+            # 从句柄池获取模型
+            with stage("model_init"):
+                model = self.get_model(model_name)
+            # 使用SDK的异步接口，避免阻塞事件循环
+            with stage("model_call"):
+                async with self.limiter.slot(model_name):
+                    response = await model.generate_content_async(prompt)
+        except Exception as e:
+            LLM_ERRORS.inc(model=model_name, error=type(e).__name__)
+            raise
+        logger.debug("Gemini响应", extra={"model": model_name, "candidates": len(response.candidates)})
+        
+        # 正确获取响应文本
+        response_text = self._response_text(response)
+        if not response_text:
+            LLM_ERRORS.inc(model=model_name, error="EmptyResponse")
+            raise ValueError("响应中没有文本内容")
+        
+        log_payload(logger, "Gemini原始响应", response_text, model=model_name)
+        
+        with stage("parse"):
+            parsed_result = self._parse_response(response_text)
+        log_payload(logger, "解析后结果", parsed_result, model=model_name)
+        
+        if not isinstance(parsed_result.get('suggested_price'), (int, float)) or parsed_result['suggested_price'] <= 0:
+            LLM_ERRORS.inc(model=model_name, error="InvalidAdvice")
+            raise ValueError(f"{model_name} 未返回有效的建议价格")
+        
+        prompt_tokens, response_tokens = await self._token_counts(model, response, prompt, response_text)
+        elapsed = time.perf_counter() - started
+        self.latency.record(model_name, elapsed)
+        LLM_CALL_SECONDS.observe(elapsed, model=model_name, mode="single")
+        parsed_result['model_used'] = model_name
+        parsed_result['usage'] = {
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "latency_ms": int(elapsed * 1000)
+        }
+        return parsed_result
+    
+    async def _hedged_call(self, model_name: str, prompt: Union[str, List[str]]) -> Dict[str, Any]:
+        """
+        在延迟预算内获取建议
+        
+        主模型超过其历史延迟分位数仍未返回（或已失败）时，并行调用对冲模型；
+        先得到有效结果的一方胜出，另一方被取消。预算耗尽时抛出TimeoutError。
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.hedge.latency_budget
+        hedge_model = self.hedge.hedge_model_for(model_name)
+        if hedge_model is not None and not self.is_available(hedge_model):
+            # HEDGE_MODEL 配置了不在可用列表中的模型时不对冲
+            hedge_model = None
+        hedge_at = started + self.hedge.hedge_delay(self.latency, model_name)
+        
+        tasks = {asyncio.ensure_future(self._call_model(model_name, prompt))}
+        hedged = False
+        errors = []
+        try:
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    raise asyncio.TimeoutError(f"超出延迟预算 {self.hedge.latency_budget}s")
                 
-                parsed_result = self._parse_response(response_text)
-                print("✅ 解析后结果:")
-                print(parsed_result)
-                print("=" * 50)
+                wake_at = deadline if (hedged or hedge_model is None) else min(deadline, hedge_at)
+                done, tasks = await asyncio.wait(tasks, timeout=max(0.0, wake_at - now), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(str(task.exception()))
+                    logger.warning("模型调用失败", extra={"error": str(task.exception())})
                 
-                return parsed_result
-            else:
+                now = loop.time()
+                should_hedge = (not tasks or now >= hedge_at) and now < deadline
+                if hedge_model is not None and not hedged and should_hedge:
+                    hedged = True
+                    # 对冲不排队：对冲模型没有可用令牌时放弃对冲
+                    if await self.scheduler.try_acquire(hedge_model):
+                        logger.info("触发对冲请求", extra={"model": model_name, "hedge_model": hedge_model})
+                        tasks.add(asyncio.ensure_future(self._call_model(hedge_model, prompt)))
+                    else:
+                        logger.info("对冲模型限速中，跳过对冲", extra={"model": model_name, "hedge_model": hedge_model})
+                if not tasks:
+                    raise ValueError("; ".join(errors) or "模型调用失败")
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def stream_negotiation_advice(self, property_info: Dict[str, Any], user_budget: int, urgency: str = "normal", additional_info: Optional[str] = None, model_name: str = "gemini-1.5-pro", use_cache: bool = True, prompt_mode: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式获取谈判建议
+        
+        先逐个产出已完整的字段事件 {"field", "value"[, "index"]}，
+        最后产出 {"advice": 完整建议}，其内容与 get_negotiation_advice 一致。
+        定价模型就绪时，调用模型前先产出一次 {"preview": 即时预估}
+        """
+        self._require_model(model_name)
+        prompt_mode = prompt_mode or self.prompt_mode
+        cache_key = request_cache_key(property_info, user_budget, urgency, additional_info, model_name, prompt_mode)
+        if use_cache:
+            with stage("cache_lookup"):
+                cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("命中建议缓存", extra={"model": model_name, "stream": True})
+                for event in advice_events(cached):
+                    yield event
+                yield {"advice": cached}
+                return
+            similar = self._semantic_lookup(property_info, user_budget, urgency, additional_info, model_name)
+            if similar is not None:
+                for event in advice_events(similar):
+                    yield event
+                yield {"advice": similar}
+                return
+        else:
+            self.cache.record_bypass()
+        
+        preview = self.preview(property_info, user_budget, urgency)
+        if preview is not None:
+            yield {"preview": preview}
+        
+        with stage("prompt_build"):
+            prompt = self._build_contents(prompt_mode, property_info, user_budget, urgency, additional_info)
+        log_payload(logger, "发送给Gemini的prompt", prompt if isinstance(prompt, str) else prompt[-1], prompt_mode=prompt_mode, stream=True)
+        parser = IncrementalAdviceParser()
+        response_text = ""
+        last_chunk = None
+        
+        try:
+            with stage("admission_wait"):
+                await self.scheduler.admit(model_name, urgency)
+            started = time.perf_counter()
+            try:
+                with stage("model_init"):
+                    model = self.get_model(model_name)
+                # 流式调用的耗时包含逐块产出事件的时间
+                with stage("model_call"):
+                    async with self.limiter.slot(model_name):
+                        response = await model.generate_content_async(prompt, stream=True)
+                        async for chunk in response:
+                            last_chunk = chunk
+                            text = self._response_text(chunk)
+                            response_text += text
+                            for event in parser.feed(text):
+                                yield event
+            except Exception as e:
+                LLM_ERRORS.inc(model=model_name, error=type(e).__name__)
+                raise
+            
+            if not response_text:
+                LLM_ERRORS.inc(model=model_name, error="EmptyResponse")
                 raise ValueError("响应中没有文本内容")
+            log_payload(logger, "Gemini原始响应", response_text, model=model_name, stream=True)
+            with stage("parse"):
+                advice = self._parse_response(response_text)
+            self._bound_price(advice, property_info, user_budget, urgency)
+            advice['model_used'] = model_name
+            with stage("cache_store"):
+                await self.cache.set(cache_key, advice, model_name)
+            self.semantic_cache.add(property_info, user_budget, urgency, additional_info, model_name, advice)
+            # 流式响应的用量信息在最后一个分块上
+            prompt_tokens, response_tokens = await self._token_counts(model, last_chunk, prompt, response_text)
+            elapsed = time.perf_counter() - started
+            LLM_CALL_SECONDS.observe(elapsed, model=model_name, mode="stream")
+            advice['usage'] = {
+                "prompt_mode": prompt_mode,
+                "prompt_tokens": prompt_tokens,
+                "response_tokens": response_tokens,
+                "latency_ms": int(elapsed * 1000)
+            }
+        except AdmissionRejected as e:
+            if self.scheduler.shed_mode == SHED_REJECT:
+                raise
+            logger.warning("模型调用被削减，使用fallback建议", extra={"model": model_name, "urgency": urgency, "reason": e.reason, "stream": True})
+            advice = self.fallback_advice(property_info, user_budget, urgency, reason="shed")
         except Exception as e:
-            print(f"❌ AI服务失败: {str(e)}")
-            print("🔄 使用fallback建议")
-            # 如果AI解析失败，返回基础建议
-            return self._get_fallback_advice(property_info, user_budget)
+            logger.error("AI流式服务失败，使用fallback建议", extra={"model": model_name, "error": str(e)})
+            advice = self.fallback_advice(property_info, user_budget, urgency)
+        
+        yield {"advice": advice}
+    
+    def _semantic_lookup(self, property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str], model_name: str) -> Optional[Dict[str, Any]]:
+        """相似请求的历史建议，已调整到本次请求并经过建议价区间校验；未命中时返回None"""
+        with stage("semantic_lookup"):
+            advice = self.semantic_cache.lookup(property_info, user_budget, urgency, additional_info, model_name)
+        if advice is not None:
+            self._bound_price(advice, property_info, user_budget, urgency)
+        return advice
+    
+    def _response_text(self, response) -> str:
+        """拼接响应（或流式分块）中第一个候选的全部文本"""
+        if not response.candidates or not response.candidates[0].content.parts:
+            return ""
+        response_text = ""
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, 'text'):
+                response_text += part.text
+        return response_text
+    
+    async def _token_counts(self, model, response, prompt: Union[str, List[str]], response_text: str) -> Tuple[Optional[int], Optional[int]]:
+        """
+        读取SDK返回的输入/输出token数
+        
+        旧版SDK的响应中没有usage_metadata，此时按配置调用count_tokens统计，否则返回None
+        """
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+        if not self.count_tokens_fallback:
+            return None, None
+        try:
+            with stage("token_count"):
+                prompt_count, response_count = await asyncio.gather(
+                    model.count_tokens_async(prompt),
+                    model.count_tokens_async(response_text)
+                )
+            return prompt_count.total_tokens, response_count.total_tokens
+        except Exception as e:
+            logger.warning("token统计失败", extra={"error": str(e)})
+            return None, None
+    
+    def _build_contents(self, prompt_mode: str, property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str]) -> Union[str, List[str]]:
+        """按提示词模式构建请求内容：完整模式为单个字符串，精简模式为 [系统指令, 请求数据]"""
+        comparables = self._comparables_for(property_info, additional_info)
+        if prompt_mode == PROMPT_MODE_COMPACT:
+            return build_compact_contents(property_info, user_budget, urgency, additional_info, comparables)
+        return self._build_negotiation_prompt(property_info, user_budget, urgency, additional_info, comparables)
     
-    def _build_negotiation_prompt(self, property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str]) -> str:
+    def _comparables_for(self, property_info: Dict[str, Any], additional_info: Optional[str]) -> Optional[str]:
+        """用户已在additional_info中给出同类房源价格时不检索"""
+        if parse_additional_info(additional_info)["similar_properties"]:
+            return None
+        with stage("comparables"):
+            return self.comparables.describe(property_info)
+    
+    def _build_negotiation_prompt(self, property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str], comparables: Optional[str] = None) -> str:
         current_price = property_info.get('current_price', 0)
         price_gap = current_price - user_budget
         price_gap_percent = (price_gap/current_price*100) if current_price > 0 else 0
         landlord_type = property_info.get('landlord_type', '未知')
         
         # 解析additional_info中的关键信息
-        city = ""
-        similar_properties = ""
-        property_advantages = ""
-        property_disadvantages = ""
-        tenant_status = ""
-        rental_history = ""
-        personal_advantages = ""
-        communication_preference = ""
-        
-        if additional_info:
-            for info in additional_info.split('；'):
-                if '位置：' in info:
-                    city = info.replace('位置：', '').strip()
-                elif '同类房源价格：' in info:
-                    similar_properties = info.replace('同类房源价格：', '').strip()
-                elif '房屋优势：' in info:
-                    property_advantages = info.replace('房屋优势：', '').strip()
-                elif '房屋劣势：' in info:
-                    property_disadvantages = info.replace('房屋劣势：', '').strip()
-                elif '租客身份：' in info:
-                    tenant_status = info.replace('租客身份：', '').strip()
-                elif '租住历史：' in info:
-                    rental_history = info.replace('租住历史：', '').strip()
-                elif '个人优势：' in info:
-                    personal_advantages = info.replace('个人优势：', '').strip()
-                elif '沟通方式：' in info:
-                    communication_preference = info.replace('沟通方式：', '').strip()
+        fields = parse_additional_info(additional_info)
+        city = fields["city"]
+        similar_properties = fields["similar_properties"] or comparables or ""
+        property_advantages = fields["property_advantages"]
+        property_disadvantages = fields["property_disadvantages"]
+        tenant_status = fields["tenant_status"]
+        rental_history = fields["rental_history"]
+        personal_advantages = fields["personal_advantages"]
+        communication_preference = fields["communication_preference"]
         
         return f"""
         你是中国顶级的租房谈判专家，有15年实战经验。基于租房谈判4大核心要素框架，对每个案例进行系统化分析。
@@ -177,71 +652,29 @@ class GeminiNegotiationService:
     
     def _parse_response(self, response_text: str) -> Dict[str, Any]:
         """
-        解析AI响应，提取JSON数据 - 多层降级兼容方案
-        """
-        print("🔍 开始解析AI响应...")
-        
-        # 方案1: 尝试直接JSON解析
-        try:
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                parsed_data = json.loads(json_str)
-                print("✅ 方案1成功: 直接JSON解析")
-                return self._process_parsed_data(parsed_data)
-        except Exception as e:
-            print(f"⚠️ 方案1失败: {str(e)}")
-        
-        # 方案2: 清理控制字符后再解析
-        try:
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                # 清理各种控制字符
-                json_str = self._clean_json_string(json_str)
-                parsed_data = json.loads(json_str)
-                print("✅ 方案2成功: 清理控制字符后解析")
-                return self._process_parsed_data(parsed_data)
-        except Exception as e:
-            print(f"⚠️ 方案2失败: {str(e)}")
+        解析AI响应，提取JSON数据
         
-        # 方案3: 从代码块中提取JSON
-        try:
-            code_block_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', response_text, re.DOTALL)
-            if code_block_match:
-                json_str = code_block_match.group(1)
-                json_str = self._clean_json_string(json_str)
-                parsed_data = json.loads(json_str)
-                print("✅ 方案3成功: 从代码块提取JSON")
-                return self._process_parsed_data(parsed_data)
-        except Exception as e:
-            print(f"⚠️ 方案3失败: {str(e)}")
-        
-        # 方案4: 结构化文本提取
-        try:
-            structured_data = self._extract_structured_info(response_text)
-            print("✅ 方案4成功: 结构化文本提取")
-            return structured_data
-        except Exception as e:
-            print(f"⚠️ 方案4失败: {str(e)}")
+        单遍容错提取JSON对象（自动修复未转义换行/引号、尾随逗号、截断输出）；
+        响应中完全没有JSON对象时降级为结构化文本提取
+        """
+        parsed_data, repairs = extract_json(response_text)
+        if parsed_data is not None:
+            self._record_parse(repairs)
+            if repairs:
+                logger.info("JSON解析时进行了修复", extra={"repairs": repairs})
+            else:
+                logger.debug("JSON解析成功")
+            return self._process_parsed_data(parsed_data)
         
-        # 方案5: 基础文本提取（最后的降级方案）
-        print("🔄 使用最终降级方案: 基础文本提取")
-        return self._extract_info_from_text(response_text)
+        PARSE_RESULTS.inc(outcome="text")
+        logger.warning("未找到JSON对象，使用结构化文本提取")
+        return self._extract_structured_info(response_text)
     
-    def _clean_json_string(self, json_str: str) -> str:
-        """清理JSON字符串中的问题字符"""
-        # 处理换行符
-        json_str = json_str.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
-        
-        # 移除控制字符 (保留基本的转义字符)
-        json_str = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', json_str)
-        
-        # 修复常见的JSON格式问题
-        json_str = json_str.replace('\\\\n', '\\n')  # 防止双重转义
-        json_str = json_str.replace('\\"', '"')      # 修复引号转义
-        
-        return json_str
+    def _record_parse(self, repairs: List[str]):
+        """按是否经过修复记录解析结果，并按类型记录修复次数"""
+        PARSE_RESULTS.inc(outcome="repaired" if repairs else "clean")
+        for repair in repairs:
+            PARSE_REPAIRS.inc(repair=repair)
     
     def _process_parsed_data(self, parsed_data: Dict[str, Any]) -> Dict[str, Any]:
         """处理解析后的数据，标准化格式"""
@@ -274,7 +707,7 @@ class GeminiNegotiationService:
             if field not in parsed_data or parsed_data[field] is None:
                 parsed_data[field] = default_value
         
-        print(f"🔧 标准化后的数据: success_probability={parsed_data.get('success_probability')}")
+        logger.debug("标准化后的数据", extra={"success_probability": parsed_data.get('success_probability')})
         return parsed_data
     
     def _extract_structured_info(self, text: str) -> Dict[str, Any]:
@@ -346,37 +779,57 @@ class GeminiNegotiationService:
         
         return result
     
-    def _extract_info_from_text(self, text: str) -> Dict[str, Any]:
-        """
-        从文本中提取关键信息（作为JSON解析失败的备选方案）
-        """
-        # 简单的正则提取（实际项目中可以更复杂）
-        suggested_price_match = re.search(r'建议.*?(\d+)', text)
-        success_prob_match = re.search(r'成功.*?(\d+\.?\d*)%', text)
-        
+    def preview(self, property_info: Dict[str, Any], user_budget: int, urgency: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """定价模型的即时预估（建议价、成功率、预计可砍幅度），模型未就绪时返回None"""
+        with stage("pricing"):
+            estimate = self.pricing.estimate(property_info, user_budget, urgency)
+        if estimate is None:
+            return None
         return {
-            "suggested_price": int(suggested_price_match.group(1)) if suggested_price_match else 0,
-            "negotiation_strategy": "基于房屋条件和市场行情制定合理的谈判策略",
-            "talking_points": [
-                "您好，我很喜欢这套房子，价格能否商量一下？",
-                "我可以长期租住，签一年合同",
-                "现在就能决定，价格合适的话马上签约",
-                "我是稳定租客，会爱护房屋",
-                "如果价格不合适，我再看看其他房源"
-            ],
-            "risk_assessment": "需要根据房东反应调整策略，避免过度强硬",
-            "success_probability": float(success_prob_match.group(1))/100 if success_prob_match else 0.6,
-            "market_insights": "市场行情分析需要更多数据支撑"
+            "suggested_price": estimate.suggested_price,
+            "success_probability": estimate.success_probability,
+            "expected_discount": estimate.discount,
         }
     
-    def _get_fallback_advice(self, property_info: Dict[str, Any], user_budget: int) -> Dict[str, Any]:
+    def _bound_price(self, advice: Dict[str, Any], property_info: Dict[str, Any], user_budget: int, urgency: Optional[str]):
+        """
+        模型建议价的合理性校验：高于报价时改为报价；
+        低于定价模型给出的下限（且低于用户自己的目标价）时改为下限
+        """
+        current_price = property_info.get('current_price')
+        price = advice.get('suggested_price')
+        if not current_price or not isinstance(price, (int, float)):
+            return
+        bounded = None
+        if price > current_price:
+            bounded, direction = current_price, "above_asking"
+        else:
+            estimate = self.pricing.estimate(property_info, user_budget, urgency)
+            if estimate is not None:
+                floor = min(estimate.floor, user_budget)
+                if price < floor:
+                    bounded, direction = floor, "below_floor"
+        if bounded is not None:
+            PRICE_BOUNDED.inc(direction=direction)
+            logger.warning("模型建议价超出合理区间，已修正", extra={"suggested_price": price, "bounded_price": bounded, "direction": direction})
+            advice['suggested_price'] = int(bounded)
+    
+    def fallback_advice(self, property_info: Dict[str, Any], user_budget: int, urgency: Optional[str] = None, reason: str = "error") -> Dict[str, Any]:
         """
         当AI服务不可用时的后备建议
+        
+        定价模型就绪时按历史成交估算建议价和成功率，否则按价差分档；
+        reason 计入兜底建议指标：error（调用或解析失败）、shed（被准入削减）、packed（打包调用中缺失）
         """
+        FALLBACK_ADVICE.inc(reason=reason)
         current_price = property_info.get('current_price', 5000)
         price_gap = current_price - user_budget
         
-        if price_gap <= 0:
+        estimate = self.pricing.estimate(property_info, user_budget, urgency)
+        if estimate is not None:
+            suggested_price = estimate.suggested_price
+            success_prob = estimate.success_probability
+        elif price_gap <= 0:
             suggested_price = user_budget
             success_prob = 0.9
         elif price_gap <= 500:
@@ -386,6 +839,10 @@ class GeminiNegotiationService:
             suggested_price = current_price - min(price_gap // 2, 1000)
             success_prob = 0.5
         
+        market_insights = "建议多了解周边同类房源价格"
+        if estimate is not None:
+            market_insights = f"根据历史成交反馈，同类房源平均可砍约{estimate.discount * 100:.1f}%。" + market_insights
+        
         return {
             "suggested_price": suggested_price,
             "negotiation_strategy": f"当前报价{current_price}元，您的预算{user_budget}元，建议从{suggested_price}元开始谈判",
@@ -398,5 +855,6 @@ class GeminiNegotiationService:
             ],
             "risk_assessment": "注意观察房东态度，适时调整策略",
             "success_probability": success_prob,
-            "market_insights": "建议多了解周边同类房源价格"
+            "market_insights": market_insights,
+            "model_used": "fallback"
         }
\ No newline at end of file
@@ -0,0 +1,310 @@
+"""
+会话冷热分离：把超过一定时间的会话正文归档到按日期分区的压缩NDJSON文件
+
+negotiation_sessions 中每行的建议正文（谈判策略、话术、风险评估、市场洞察）和用户填写的描述有数KB，
+从不清理。归档任务按写入时间从早到晚处理超过 after_days 的会话：整行追加到
+{dir}/YYYY/MM/YYYY-MM-DD.ndjson.gz（或 .zst），写入并fsync后，把数据库中这几列置空并记录 archived_at。
+位置、房型、报价、预算、建议价、成功率、用量等数值和短字段仍留在表中，
+统计、区域市场数据、定价模型、同类房源索引等分析路径不受影响；完整记录通过本模块读取。
+
+每批追加为文件中一个独立的压缩帧（gzip member / zstd frame），标准工具可直接解压整个文件。
+写文件后、更新数据库前中断时，下次运行会重复追加同一会话，读取时按会话ID去重。
+置空的页面由SQLite复用，文件本身不会变小；需要回收磁盘空间时用 --vacuum。
+
+    python -m services.archive run --after-days 90 [--vacuum]
+    python -m services.archive cat --start 2024-01-01 --end 2024-01-31 > sessions.ndjson
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, text, update
+
+from database import SessionLocal, engine, init_db
+from models import NegotiationSession
+
+logger = logging.getLogger(__name__)
+
+# 归档后在数据库中置空的列
+ARCHIVED_COLUMNS = ("description", "additional_info", "negotiation_strategy", "talking_points",
+                    "risk_assessment", "market_insights")
+
+_EXTENSIONS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd压缩需要安装 zstandard（pip install zstandard）")
+    return zstandard
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        return _zstd().ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        if path.endswith(".zst"):
+            return _zstd().ZstdDecompressor().stream_reader(f, read_across_frames=True).read()
+        return gzip.GzipFile(fileobj=f).read()
+
+
+def _row_dict(mapping) -> Dict[str, Any]:
+    row = dict(mapping)
+    for name in ("created_at", "updated_at", "archived_at"):
+        if row[name] is not None:
+            row[name] = row[name].isoformat()
+    return row
+
+
+class ArchiveStore:
+    """按日期分区的归档文件：追加写入与读取"""
+
+    def __init__(self, directory: str, compression: str = "gzip"):
+        if compression not in _EXTENSIONS:
+            raise ValueError(f"不支持的压缩格式: {compression}")
+        self.directory = directory
+        self.compression = compression
+
+    def partition_path(self, day: date, compression: Optional[str] = None) -> str:
+        return os.path.join(self.directory, f"{day:%Y}", f"{day:%m}",
+                            f"{day.isoformat()}{_EXTENSIONS[compression or self.compression]}")
+
+    def append(self, day: date, rows: List[Dict[str, Any]]):
+        """把一批会话作为一个压缩帧追加到当天的分区文件，并fsync"""
+        path = self.partition_path(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = "".join(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows)
+        with open(path, "ab") as f:
+            f.write(_compress(payload.encode("utf-8"), self.compression))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def days(self) -> List[date]:
+        """已有分区的日期，升序"""
+        found = set()
+        if not os.path.isdir(self.directory):
+            return []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                for extension in _EXTENSIONS.values():
+                    if name.endswith(extension):
+                        try:
+                            found.add(date.fromisoformat(name[:-len(extension)]))
+                        except ValueError:
+                            pass
+        return sorted(found)
+
+    def read_day(self, day: date) -> List[Dict[str, Any]]:
+        """某一天归档的会话，按会话ID升序；重复追加的同一会话只保留最后一次"""
+        rows: Dict[int, Dict[str, Any]] = {}
+        for compression in _EXTENSIONS:
+            path = self.partition_path(day, compression)
+            if not os.path.exists(path):
+                continue
+            for line in _read_file(path).decode("utf-8").splitlines():
+                if line:
+                    row = json.loads(line)
+                    rows[row["id"]] = row
+        return [rows[session_id] for session_id in sorted(rows)]
+
+    def iter_sessions(self, start: Optional[date] = None, end: Optional[date] = None) -> Iterator[Dict[str, Any]]:
+        """按日期顺序逐个产出 [start, end] 内归档的会话（两端为None表示不限）"""
+        for day in self.days():
+            if (start is None or day >= start) and (end is None or day <= end):
+                yield from self.read_day(day)
+
+    def load(self, sessions: Iterable[Tuple[int, datetime]]) -> Dict[int, Dict[str, Any]]:
+        """读取一组已归档会话 [(会话ID, 写入时间)] 的完整记录（按写入日期定位分区），返回 {会话ID: 记录}"""
+        wanted: Dict[date, set] = {}
+        for session_id, created_at in sessions:
+            wanted.setdefault(created_at.date(), set()).add(session_id)
+        found = {}
+        for day, ids in wanted.items():
+            for row in self.read_day(day):
+                if row["id"] in ids:
+                    found[row["id"]] = row
+        return found
+
+
+class SessionArchiver:
+    """
+    定期归档旧会话
+
+    - after_days：写入超过该天数的会话被归档
+    - batch_size：每批读取、写入文件和更新数据库的会话数
+    - interval_seconds：后台任务的运行间隔
+    """
+
+    def __init__(self, enabled: bool = False, after_days: int = 90, directory: str = "./archive",
+                 compression: str = "gzip", batch_size: int = 2000, interval_seconds: float = 86400):
+        self.enabled = enabled
+        self.after_days = after_days
+        self.store = ArchiveStore(directory, compression)
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self.archived_total = 0
+        self._task: Optional[asyncio.Task] = None
+        # 停止时在批次之间退出线程中的归档
+        self._stopping = threading.Event()
+
+    @classmethod
+    def from_env(cls) -> "SessionArchiver":
+        return cls(
+            enabled=os.getenv("ARCHIVE_ENABLED", "false").lower() == "true",
+            after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "90")),
+            directory=os.getenv("ARCHIVE_DIR", "./archive"),
+            compression=os.getenv("ARCHIVE_COMPRESSION", "gzip"),
+            batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "2000")),
+            interval_seconds=float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "86400")),
+        )
+
+    def archive(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        归档所有超期会话（同步，在后台线程或命令行中调用），返回本次统计
+
+        读取与更新分属两个事务：WAL下读事务升级为写事务时若有其他连接已提交会直接失败
+        """
+        started = time.perf_counter()
+        cutoff = (now or datetime.now()) - timedelta(days=self.after_days)
+        archived = 0
+        days = set()
+        while not self._stopping.is_set():
+            with SessionLocal() as db:
+                sessions = db.execute(
+                    select(NegotiationSession.__table__)
+                    .where(NegotiationSession.archived_at.is_(None), NegotiationSession.created_at < cutoff)
+                    .order_by(NegotiationSession.created_at, NegotiationSession.id)
+                    .limit(self.batch_size)
+                ).mappings().all()
+                db.rollback()
+                if not sessions:
+                    break
+
+                archived_at = datetime.now()
+                by_day: Dict[date, List[Dict[str, Any]]] = {}
+                for session in sessions:
+                    row = _row_dict(session)
+                    row["archived_at"] = archived_at.isoformat()
+                    by_day.setdefault(session["created_at"].date(), []).append(row)
+                for day, rows in by_day.items():
+                    self.store.append(day, rows)
+                days.update(by_day)
+
+                db.execute(
+                    update(NegotiationSession)
+                    .where(NegotiationSession.id.in_([session["id"] for session in sessions]), NegotiationSession.archived_at.is_(None))
+                    .values(archived_at=archived_at, **{name: None for name in ARCHIVED_COLUMNS})
+                    .execution_options(synchronize_session=False)
+                )
+                db.commit()
+            archived += len(sessions)
+
+        self.archived_total += archived
+        result = {
+            "archived": archived,
+            "partitions": len(days),
+            "cutoff": cutoff.isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - started, 2),
+        }
+        self.last_run = {**result, "finished_at": datetime.now().isoformat(timespec="seconds")}
+        return result
+
+    async def run_once(self) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        try:
+            result = await asyncio.to_thread(self.archive)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error("会话归档失败", extra={"error": str(e)})
+            return None
+        self.last_error = None
+        if result["archived"]:
+            logger.info("会话已归档", extra=result)
+        return result
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "after_days": self.after_days,
+            "directory": self.store.directory,
+            "compression": self.store.compression,
+            "archived_total": self.archived_total,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+def vacuum():
+    """重写数据库文件回收归档释放的页面（期间独占数据库）"""
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="会话归档")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="归档超期会话")
+    run.add_argument("--after-days", type=int, default=int(os.getenv("ARCHIVE_AFTER_DAYS", "90")))
+    run.add_argument("--vacuum", action="store_true", help="归档后执行VACUUM回收磁盘空间")
+    cat = commands.add_parser("cat", help="以NDJSON输出归档的会话")
+    cat.add_argument("--start", type=date.fromisoformat)
+    cat.add_argument("--end", type=date.fromisoformat)
+    args = arg_parser.parse_args()
+
+    archiver = SessionArchiver.from_env()
+    if args.command == "cat":
+        for row in archiver.store.iter_sessions(args.start, args.end):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return
+
+    init_db()
+    archiver.after_days = args.after_days
+    result = archiver.archive()
+    print(f"已归档 {result['archived']} 个会话到 {result['partitions']} 个分区（{archiver.store.directory}），"
+          f"截止 {result['cutoff']}，耗时 {result['seconds']}s")
+    if args.vacuum:
+        started = time.perf_counter()
+        vacuum()
+        print(f"VACUUM 完成，耗时 {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
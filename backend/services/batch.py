@@ -0,0 +1,62 @@
+"""
+批量评估多套房源：共享并发上限下并发执行，可选把若干房源打包进一次模型调用
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Sequence, Tuple
+
+
+class BatchPolicy:
+    """
+    批量请求的限制
+
+    - max_items：单次批量请求最多包含的房源数
+    - max_concurrency：所有批量请求共享的并发上限，避免一个大批量占满模型名额
+    - pack_size：打包模式下每次模型调用最多包含的房源数
+    """
+
+    def __init__(self, max_items: int = 20, max_concurrency: int = 8, pack_size: int = 5):
+        self.max_items = max(1, max_items)
+        self.max_concurrency = max(1, max_concurrency)
+        self.pack_size = max(1, pack_size)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._in_flight = 0
+
+    @classmethod
+    def from_env(cls) -> "BatchPolicy":
+        return cls(
+            max_items=int(os.getenv("BATCH_MAX_ITEMS", "20")),
+            max_concurrency=int(os.getenv("BATCH_MAX_CONCURRENCY", "8")),
+            pack_size=int(os.getenv("BATCH_PACK_SIZE", "5")),
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个批量并发名额"""
+        async with self._semaphore:
+            self._in_flight += 1
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+
+    def packs(self, groups: Dict[Tuple, List[int]]) -> List[Tuple[Tuple, List[int]]]:
+        """把同组（同模型、同缓存设置）的房源序号按pack_size切分成若干次调用"""
+        return [
+            (group, indexes[start:start + self.pack_size])
+            for group, indexes in groups.items()
+            for start in range(0, len(indexes), self.pack_size)
+        ]
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"limit": self.max_concurrency, "in_flight": self._in_flight}
+
+
+def group_by(keys: Sequence[Tuple]) -> Dict[Tuple, List[int]]:
+    """按键分组，保留每组内的原始顺序"""
+    groups: Dict[Tuple, List[int]] = {}
+    for index, key in enumerate(keys):
+        groups.setdefault(key, []).append(index)
+    return groups
@@ -0,0 +1,268 @@
+"""
+同类房源检索：历史会话的内存近邻索引，为提示词的"同类房源价格"提供对比数据
+
+会话按 (地区层级键, 房型) 分桶，同一会话计入省/市/区各级的桶。查询时从最细的地区开始，
+取第一个候选数不少于k的桶，在桶内最近写入的至多max_scan个会话中按面积和报价的对数距离
+向量化计算，取最近的k个。每次查询的计算量有上限，与总会话数无关，百万级会话时仍在亚毫秒级；
+只看近期会话也让对比数据反映当前行情。
+
+启动时在后台线程从数据库读取全部会话建立索引，之后由会话写入队列在每批提交后增量追加。
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import NegotiationSession
+from services.location import parse_location, region_keys
+
+logger = logging.getLogger(__name__)
+
+# 距离 = (面积对数差 / AREA_SCALE)^2 + (报价对数差 / PRICE_SCALE)^2；面积缺失时该项按MISSING_AREA_PENALTY计
+# 报价权重较低：对比数据要反映同类房源的行情，而不是只找报价相同的房源
+AREA_SCALE = 0.25
+PRICE_SCALE = 1.0
+MISSING_AREA_PENALTY = 1.0
+
+
+def _log(value: Optional[float]) -> float:
+    return math.log(value) if value and value > 0 else math.nan
+
+
+class _Bucket:
+    """同一地区同一房型的会话，按列存放，容量不足时倍增"""
+
+    __slots__ = ("ids", "log_area", "log_price", "prices", "areas", "locations", "size")
+
+    def __init__(self, capacity: int = 16):
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.log_area = np.empty(capacity, dtype=np.float32)
+        self.log_price = np.empty(capacity, dtype=np.float32)
+        self.prices = np.empty(capacity, dtype=np.int32)
+        self.areas = np.empty(capacity, dtype=np.int32)
+        self.locations: List[str] = []
+        self.size = 0
+
+    @classmethod
+    def from_columns(cls, ids, areas, prices, locations) -> "_Bucket":
+        bucket = cls(max(16, len(ids)))
+        n = len(ids)
+        bucket.ids[:n] = ids
+        bucket.areas[:n] = [area or 0 for area in areas]
+        bucket.prices[:n] = prices
+        bucket.log_area[:n] = np.log(np.where(bucket.areas[:n] > 0, bucket.areas[:n], np.nan))
+        bucket.log_price[:n] = np.log(np.maximum(bucket.prices[:n], 1))
+        bucket.locations = list(locations)
+        bucket.size = n
+        return bucket
+
+    def append(self, session_id: int, area: Optional[int], price: int, location: str):
+        if self.size == len(self.ids):
+            capacity = len(self.ids) * 2
+            for name in ("ids", "log_area", "log_price", "prices", "areas"):
+                grown = np.empty(capacity, dtype=getattr(self, name).dtype)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        i = self.size
+        self.ids[i] = session_id
+        self.areas[i] = area or 0
+        self.prices[i] = price
+        self.log_area[i] = _log(area)
+        self.log_price[i] = _log(price)
+        self.locations.append(location)
+        self.size += 1
+
+    def nearest(self, log_area: float, log_price: float, k: int, max_scan: int,
+                exclude: Tuple[str, int, int]) -> List[Tuple[int, float]]:
+        """
+        在最近写入的max_scan行中查找，返回 [(行号, 距离)]，按距离升序；
+        与查询完全相同的房源（多为同一用户重复提交）不计入
+        """
+        start = max(0, self.size - max_scan)
+        window = slice(start, self.size)
+        n = self.size - start
+        if math.isnan(log_area):
+            area_term = np.full(n, MISSING_AREA_PENALTY, dtype=np.float32)
+        else:
+            area_term = ((self.log_area[window] - log_area) / AREA_SCALE) ** 2
+            area_term = np.where(np.isnan(area_term), MISSING_AREA_PENALTY, area_term)
+        distances = area_term + ((self.log_price[window] - log_price) / PRICE_SCALE) ** 2
+        # 多取几个，排除重复提交后仍够k个
+        take = min(n, k + 4)
+        candidates = np.argpartition(distances, take - 1)[:take] if take < n else np.arange(n)
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+        location, area, price = exclude
+        result = []
+        for offset in candidates.tolist():
+            row = start + offset
+            if self.prices[row] == price and self.areas[row] == area and self.locations[row] == location:
+                continue
+            result.append((row, float(distances[offset])))
+            if len(result) == k:
+                break
+        return result
+
+
+class ComparablesIndex:
+    """
+    同类房源近邻索引
+
+    - k：注入提示词的同类房源数
+    - max_scan：每次查询在一个桶中最多比较的（最近写入的）会话数
+    - load_batch：启动加载时每次从数据库读取的行数
+    """
+
+    def __init__(self, enabled: bool = True, k: int = 5, max_scan: int = 20000, load_batch: int = 50000):
+        self.enabled = enabled
+        self.k = k
+        self.max_scan = max_scan
+        self.load_batch = load_batch
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self.rows = 0
+        self.ready = False
+        # 加载期间提交的会话，加载完成后补入
+        self._pending: Optional[List[Dict[str, Any]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "ComparablesIndex":
+        return cls(
+            enabled=os.getenv("COMPARABLES_ENABLED", "true").lower() == "true",
+            k=int(os.getenv("COMPARABLES_K", "5")),
+            max_scan=int(os.getenv("COMPARABLES_MAX_SCAN", "20000")),
+        )
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self.load())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    async def load(self):
+        """在后台线程中读取全部会话建立索引，完成后替换当前索引并补入加载期间提交的会话"""
+        started = time.perf_counter()
+        self._pending = []
+        try:
+            buckets, rows, max_id = await asyncio.to_thread(self._build)
+        except Exception as e:
+            self._pending = None
+            logger.error("同类房源索引加载失败", extra={"error": str(e)})
+            return
+        self._buckets, self.rows = buckets, rows
+        pending, self._pending = self._pending, None
+        self.add_many([values for values in pending if values["id"] > max_id])
+        self.ready = True
+        logger.info("同类房源索引已加载", extra={"rows": self.rows, "buckets": len(self._buckets),
+                                            "seconds": round(time.perf_counter() - started, 2)})
+
+    def _build(self) -> Tuple[Dict[Tuple[str, str], _Bucket], int, int]:
+        columns = (NegotiationSession.id, NegotiationSession.location, NegotiationSession.province,
+                   NegotiationSession.city, NegotiationSession.district, NegotiationSession.property_type,
+                   NegotiationSession.area, NegotiationSession.current_price)
+        # 先按桶收集列，最后一次性转换为数组
+        grouped: Dict[Tuple[str, str], Tuple[list, list, list, list]] = {}
+        rows, last_id = 0, 0
+        with SessionLocal() as db:
+            while True:
+                batch = db.execute(
+                    select(*columns).where(NegotiationSession.id > last_id).order_by(NegotiationSession.id).limit(self.load_batch)
+                ).all()
+                if not batch:
+                    break
+                for session_id, location, province, city, district, property_type, area, price in batch:
+                    if not price or price <= 0 or not property_type:
+                        continue
+                    rows += 1
+                    for key in region_keys(location, province, city, district):
+                        group = grouped.get((key, property_type))
+                        if group is None:
+                            group = grouped[(key, property_type)] = ([], [], [], [])
+                        group[0].append(session_id)
+                        group[1].append(area)
+                        group[2].append(price)
+                        group[3].append(location)
+                last_id = batch[-1][0]
+        buckets = {key: _Bucket.from_columns(*group) for key, group in grouped.items()}
+        return buckets, rows, last_id
+
+    def add_many(self, sessions: List[Dict[str, Any]]):
+        """追加已提交的会话（会话写入队列每批提交后调用）"""
+        if not self.enabled:
+            return
+        if self._pending is not None:
+            self._pending.extend(sessions)
+        for values in sessions:
+            price, property_type = values.get("current_price"), values.get("property_type")
+            if not price or price <= 0 or not property_type:
+                continue
+            location = values.get("location")
+            self.rows += 1
+            for key in region_keys(location, values.get("province"), values.get("city"), values.get("district")):
+                bucket = self._buckets.get((key, property_type))
+                if bucket is None:
+                    bucket = self._buckets[(key, property_type)] = _Bucket()
+                bucket.append(values["id"], values.get("area"), price, location)
+
+    def search(self, location: Optional[str], property_type: Optional[str], area: Optional[int],
+               current_price: Optional[int], k: Optional[int] = None) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """
+        同地区同房型中面积和报价最接近的k套房源，返回 (使用的地区键, 房源列表)
+
+        从最细的地区开始，候选不足k个时退到上一级；都不足时用候选最多的一级
+        """
+        k = k or self.k
+        if not self.enabled or not property_type or not current_price or current_price <= 0:
+            return None, []
+        parsed = parse_location(location)
+        keys = region_keys(location, parsed.province, parsed.city, parsed.district)
+        chosen = None
+        for key in reversed(keys):
+            bucket = self._buckets.get((key, property_type))
+            if bucket is None:
+                continue
+            if bucket.size >= k:
+                chosen = (key, bucket)
+                break
+            if chosen is None or bucket.size > chosen[1].size:
+                chosen = (key, bucket)
+        if chosen is None:
+            return None, []
+
+        key, bucket = chosen
+        exclude = (location, area or 0, current_price)
+        return key, [
+            {
+                "session_id": int(bucket.ids[row]),
+                "location": bucket.locations[row],
+                "property_type": property_type,
+                "area": int(bucket.areas[row]) or None,
+                "current_price": int(bucket.prices[row]),
+                "distance": round(distance, 4),
+            }
+            for row, distance in bucket.nearest(_log(area), _log(current_price), k, self.max_scan, exclude)
+        ]
+
+    def describe(self, property_info: Dict[str, Any]) -> Optional[str]:
+        """提示词中"同类房源价格"一栏的文本，没有同类房源时返回None"""
+        _, comparables = self.search(property_info.get("location"), property_info.get("property_type"),
+                                     property_info.get("area"), property_info.get("current_price"))
+        if not comparables:
+            return None
+        return "；".join(
+            f"{item['location']} {item['property_type']}" + (f" {item['area']}㎡" if item["area"] else "")
+            + f" 报价{item['current_price']}元/月"
+            for item in comparables
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "ready": self.ready, "rows": self.rows, "buckets": len(self._buckets)}
@@ -0,0 +1,90 @@
+"""
+按模型限制Gemini调用并发，并统计排队深度
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional
+
+
+def parse_model_overrides(raw: Optional[str]) -> Dict[str, int]:
+    """解析形如 "gemini-2.5-pro=4,gemini-2.5-flash=32" 的配置"""
+    overrides: Dict[str, int] = {}
+    if not raw:
+        return overrides
+    for item in raw.split(','):
+        if '=' not in item:
+            continue
+        name, value = item.split('=', 1)
+        try:
+            overrides[name.strip()] = max(1, int(value.strip()))
+        except ValueError:
+            continue
+    return overrides
+
+
+class ModelConcurrencyLimiter:
+    """
+    每个模型一个信号量：超过上限的请求在事件循环上等待，而不是占用线程
+
+    models 给出时只为其中的模型创建信号量，其他名称直接报错，按模型的状态数量有上限
+    """
+
+    def __init__(self, default_limit: int = 16, overrides: Optional[Dict[str, int]] = None,
+                 models: Optional[Iterable[str]] = None):
+        self.default_limit = max(1, default_limit)
+        self.overrides = overrides or {}
+        self.models = frozenset(models) if models is not None else None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, models: Optional[Iterable[str]] = None) -> "ModelConcurrencyLimiter":
+        return cls(
+            default_limit=int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")),
+            overrides=parse_model_overrides(os.getenv("GEMINI_MODEL_CONCURRENCY")),
+            models=models,
+        )
+
+    def limit_for(self, model_name: str) -> int:
+        return self.overrides.get(model_name, self.default_limit)
+
+    def _semaphore(self, model_name: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(model_name)
+        if semaphore is None:
+            if self.models is not None and model_name not in self.models:
+                raise ValueError(f"不支持的模型: {model_name}")
+            semaphore = asyncio.Semaphore(self.limit_for(model_name))
+            self._semaphores[model_name] = semaphore
+            self._in_flight[model_name] = 0
+            self._waiting[model_name] = 0
+        return semaphore
+
+    @asynccontextmanager
+    async def slot(self, model_name: str):
+        """占用一个模型调用名额，名额不足时排队等待"""
+        semaphore = self._semaphore(model_name)
+        self._waiting[model_name] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[model_name] -= 1
+        self._in_flight[model_name] += 1
+        try:
+            yield
+        finally:
+            self._in_flight[model_name] -= 1
+            semaphore.release()
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """各模型的并发上限、进行中和排队中的请求数"""
+        return {
+            name: {
+                "limit": self.limit_for(name),
+                "in_flight": self._in_flight[name],
+                "queued": self._waiting[name],
+            }
+            for name in self._semaphores
+        }
@@ -0,0 +1,146 @@
+"""
+服务容器：各组件在首次访问时创建，启动与关闭顺序集中在 startup()/shutdown()
+
+导入 main 时不再创建模型客户端、建表或启动后台任务，这些都在应用生命周期（lifespan）开始时进行；
+测试和工具脚本导入 main 只定义路由，用到哪个组件才创建哪个。
+"""
+
+import asyncio
+import logging
+import os
+from functools import cached_property
+from typing import Any, Dict, Optional
+
+from database import close_db, init_db
+from services import metrics
+from services.ai_service import GeminiNegotiationService
+from services.archive import SessionArchiver
+from services.batch import BatchPolicy
+from services.history import ExportLimiter
+from services.http_cache import HttpCache
+from services.session_writer import SessionWriter
+from services.shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """
+    应用级组件
+
+    - ai_service：模型调用、缓存与本地模型（Gemini SDK在首次使用或启动预热时导入）
+    - session_writer：会话后写队列，提交后的新会话增量加入同类房源索引
+    - archiver：旧会话正文归档
+    - export_limiter：流式导出并发上限
+    - batch_policy：批量评估的并发上限与打包大小
+    - shared_state：多进程部署时各worker共用的令牌桶与计数
+    - http_cache：只读接口的ETag与正文缓存，会话写入后更新数据版本
+    """
+
+    def __init__(self):
+        self._warm_up_task: Optional[asyncio.Task] = None
+
+    @cached_property
+    def shared_state(self) -> SharedState:
+        return SharedState.from_env()
+
+    @cached_property
+    def ai_service(self) -> GeminiNegotiationService:
+        service = GeminiNegotiationService()
+        if self.shared_state.enabled:
+            service.scheduler.shared = self.shared_state
+        return service
+
+    @cached_property
+    def session_writer(self) -> SessionWriter:
+        writer = SessionWriter.from_env()
+        writer.on_insert = self.ai_service.comparables.add_many
+        writer.on_commit = self.http_cache.versions.touch
+        return writer
+
+    @cached_property
+    def http_cache(self) -> HttpCache:
+        return HttpCache.from_env(self.shared_state)
+
+    @cached_property
+    def archiver(self) -> SessionArchiver:
+        return SessionArchiver.from_env()
+
+    @cached_property
+    def export_limiter(self) -> ExportLimiter:
+        return ExportLimiter.from_env()
+
+    @cached_property
+    def batch_policy(self) -> BatchPolicy:
+        return BatchPolicy.from_env()
+
+    def _created(self, name: str) -> bool:
+        return name in self.__dict__
+
+    def _init_db(self):
+        # 多个worker同时启动时逐个建表/补列，避免并发DDL冲突
+        with self.shared_state.exclusive("init_db"):
+            init_db()
+
+    def _shared_payload(self) -> Dict[str, Any]:
+        """本进程上报到共享状态的计数"""
+        return {
+            "metrics": metrics.REGISTRY.snapshot(),
+            "advice_cache": dict(self.ai_service.cache.counters),
+            "semantic_cache": dict(self.ai_service.semantic_cache.counters),
+        }
+
+    async def startup(self):
+        """建表/补列，启动后台组件，预热模型"""
+        # create_all 和补列是同步DDL，放到线程中执行
+        await asyncio.to_thread(self._init_db)
+        # 服务重启前生成的ETag全部失效（期间可能有离线维护改过数据）
+        await self.http_cache.versions.start()
+
+        self.session_writer.start()
+        ai_service = self.ai_service
+        # 首次拟合在后台进行，完成前兜底建议按价差分档
+        ai_service.pricing.start()
+        # 在后台线程中建立索引，加载完成前提示词不注入同类房源
+        ai_service.comparables.start()
+        # 在后台线程中加载最近的模型建议，加载完成前只复用本进程新生成的建议
+        ai_service.semantic_cache.start()
+        # 多进程部署时只由一个worker归档
+        archive_role = self.shared_state.acquire("archive")
+        if archive_role:
+            self.archiver.start()
+        self.shared_state.start(self._shared_payload)
+        if self.shared_state.enabled:
+            logger.info("多进程共享状态已启用", extra={"path": self.shared_state.path, "worker": self.shared_state.worker,
+                                              "archive": archive_role})
+
+        strict = os.getenv("GEMINI_WARMUP_STRICT", "false").lower() == "true"
+        warm_up = ai_service.warm_up(
+            probe=os.getenv("GEMINI_WARMUP_PROBE", "false").lower() == "true",
+            timeout=float(os.getenv("GEMINI_WARMUP_TIMEOUT", "10")),
+            strict=strict
+        )
+        if strict:
+            # 严格模式下预热失败要让启动失败，只能等待
+            await warm_up
+        else:
+            # 预热（导入SDK、可选探测）在后台进行，服务立即开始接受请求
+            self._warm_up_task = asyncio.create_task(warm_up)
+
+    async def shutdown(self):
+        """停止后台组件：先排空会话写入队列，再关闭连接池"""
+        if self._warm_up_task is not None and not self._warm_up_task.done():
+            self._warm_up_task.cancel()
+        if self._created("ai_service"):
+            await self.ai_service.pricing.stop()
+            await self.ai_service.comparables.stop()
+            await self.ai_service.semantic_cache.stop()
+        if self._created("archiver"):
+            await self.archiver.stop()
+        if self._created("session_writer"):
+            await self.session_writer.stop()
+        if self._created("http_cache"):
+            await self.http_cache.versions.stop()
+        if self._created("shared_state"):
+            await self.shared_state.stop()
+        await close_db()
@@ -0,0 +1,83 @@
+"""
+对冲请求：主模型在延迟分位点内未返回时，并行调用更快的模型
+"""
+
+import os
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class LatencyTracker:
+    """
+    记录每个模型最近若干次成功调用的耗时，用于估算延迟分位数
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, model_name: str, seconds: float):
+        samples = self._samples.get(model_name)
+        if samples is None:
+            samples = self._samples[model_name] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, model_name: str, q: float, min_samples: int = 1) -> Optional[float]:
+        samples = self._samples.get(model_name)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "samples": len(samples),
+                "p50": round(self.percentile(name, 0.5), 3),
+                "p95": round(self.percentile(name, 0.95), 3),
+            }
+            for name, samples in self._samples.items() if samples
+        }
+
+
+class HedgePolicy:
+    """
+    请求级延迟预算与对冲触发时机
+
+    - latency_budget：整次请求的总预算（秒），用尽后返回fallback建议
+    - hedge_percentile：主模型耗时超过其历史该分位数仍未返回时触发对冲
+    - default_delay：样本不足时使用的对冲触发时间
+    """
+
+    def __init__(self, enabled: bool = True, hedge_model: str = "gemini-2.5-flash",
+                 latency_budget: float = 45.0, hedge_percentile: float = 0.9,
+                 default_delay: float = 8.0, min_samples: int = 20):
+        self.enabled = enabled
+        self.hedge_model = hedge_model
+        self.latency_budget = latency_budget
+        self.hedge_percentile = hedge_percentile
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+
+    @classmethod
+    def from_env(cls) -> "HedgePolicy":
+        return cls(
+            enabled=os.getenv("HEDGE_ENABLED", "true").lower() == "true",
+            hedge_model=os.getenv("HEDGE_MODEL", "gemini-2.5-flash"),
+            latency_budget=float(os.getenv("LATENCY_BUDGET_SECONDS", "45")),
+            hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", "0.9")),
+            default_delay=float(os.getenv("HEDGE_DELAY_SECONDS", "8")),
+            min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+        )
+
+    def hedge_model_for(self, model_name: str) -> Optional[str]:
+        """主模型本身就是对冲模型时不再对冲"""
+        if not self.enabled or not self.hedge_model or self.hedge_model == model_name:
+            return None
+        return self.hedge_model
+
+    def hedge_delay(self, tracker: LatencyTracker, model_name: str) -> float:
+        observed = tracker.percentile(model_name, self.hedge_percentile, self.min_samples)
+        delay = observed if observed is not None else self.default_delay
+        return min(delay, self.latency_budget)
@@ -0,0 +1,214 @@
+"""
+会话与反馈的历史查询和导出
+
+列表按ID倒序（最新在前），用上一页最后一条的ID作为游标（WHERE id < cursor），
+翻页成本与页码无关。导出从服务端游标分块读取、逐块编码为NDJSON或CSV发送，
+内存占用与导出行数无关；每块之间让出事件循环，导出期间其他请求照常处理。
+"""
+
+import asyncio
+import csv
+import io
+import json
+import os
+from datetime import date, datetime, time
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Union
+
+from sqlalchemy import and_, or_, select
+from starlette.responses import StreamingResponse
+
+from database import async_engine
+from models import NegotiationSession, UserFeedback
+from services.location import normalize_location, parse_location
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+SESSION_COLUMNS = tuple(NegotiationSession.__table__.columns)
+# 反馈列表附带所属会话的位置和模型，便于按地区/模型分析
+FEEDBACK_COLUMNS = tuple(UserFeedback.__table__.columns) + (
+    NegotiationSession.location, NegotiationSession.current_price, NegotiationSession.model_used,
+)
+
+
+def location_condition(location: str):
+    """
+    位置筛选：能解析出省/市/区时按已解析的各级精确匹配（"北京" 包含北京所有区），
+    否则按区名或原文匹配（如 "朝阳"、"南山区"）
+    """
+    parsed = parse_location(location)
+    if any(parsed):
+        return and_(*(column == value for column, value in (
+            (NegotiationSession.province, parsed.province),
+            (NegotiationSession.city, parsed.city),
+            (NegotiationSession.district, parsed.district),
+        ) if value))
+    query = normalize_location(location) or ""
+    district = query
+    for suffix in ("新区", "区", "县"):
+        if district.endswith(suffix) and len(district) - len(suffix) >= 2:
+            district = district[:-len(suffix)]
+            break
+    return or_(NegotiationSession.district == district, NegotiationSession.location == query)
+
+
+def _as_datetime(value: Union[datetime, date, None]) -> Optional[datetime]:
+    """只给日期时按当天0点"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time.min)
+
+
+def session_query(location: Optional[str] = None, start: Union[datetime, date, None] = None,
+                  end: Union[datetime, date, None] = None, model: Optional[str] = None):
+    start, end = _as_datetime(start), _as_datetime(end)
+    query = select(*SESSION_COLUMNS)
+    if location:
+        query = query.where(location_condition(location))
+    if start is not None:
+        query = query.where(NegotiationSession.created_at >= start)
+    if end is not None:
+        query = query.where(NegotiationSession.created_at < end)
+    if model:
+        query = query.where(NegotiationSession.model_used == model)
+    return query
+
+
+def feedback_query(location: Optional[str] = None, start: Union[datetime, date, None] = None,
+                   end: Union[datetime, date, None] = None, model: Optional[str] = None,
+                   session_id: Optional[int] = None, success: Optional[str] = None):
+    start, end = _as_datetime(start), _as_datetime(end)
+    # 外连接：会话已不存在的反馈也能列出
+    query = select(*FEEDBACK_COLUMNS).outerjoin(NegotiationSession, NegotiationSession.id == UserFeedback.session_id)
+    if location:
+        query = query.where(location_condition(location))
+    if start is not None:
+        query = query.where(UserFeedback.created_at >= start)
+    if end is not None:
+        query = query.where(UserFeedback.created_at < end)
+    if model:
+        query = query.where(NegotiationSession.model_used == model)
+    if session_id is not None:
+        query = query.where(UserFeedback.session_id == session_id)
+    if success:
+        query = query.where(UserFeedback.success == success)
+    return query
+
+
+def page(query, id_column, cursor: Optional[int], limit: int):
+    """一页：ID倒序，多取一条判断是否还有下一页"""
+    if cursor is not None:
+        query = query.where(id_column < cursor)
+    return query.order_by(id_column.desc()).limit(limit + 1)
+
+
+def page_result(rows: Sequence, limit: int) -> Dict[str, Any]:
+    items = [_jsonable(row._mapping) for row in rows[:limit]]
+    return {"items": items, "next_cursor": items[-1]["id"] if len(rows) > limit else None}
+
+
+def _value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _jsonable(mapping) -> Dict[str, Any]:
+    return {key: _value(value) for key, value in mapping.items()}
+
+
+def _csv_cell(value: Any) -> Any:
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return "" if value is None else _value(value)
+
+
+async def export_rows(query, id_column, fmt: str, chunk_size: int = 1000) -> AsyncIterator[bytes]:
+    """
+    按ID升序以服务端游标分块读取并编码，每块产出一次
+
+    CSV带UTF-8 BOM，Excel可直接打开中文；列表/JSON列写为JSON文本
+    """
+    async with async_engine.connect() as conn:
+        result = await conn.stream(query.order_by(id_column).execution_options(yield_per=chunk_size))
+        names = list(result.keys())
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+            yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+        async for rows in result.partitions(chunk_size):
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows([_csv_cell(value) for value in row] for row in rows)
+                chunk = buffer.getvalue()
+            else:
+                chunk = "".join(json.dumps(_jsonable(row._mapping), ensure_ascii=False) + "\n" for row in rows)
+            yield chunk.encode("utf-8")
+            # 编码一块后让出事件循环
+            await asyncio.sleep(0)
+
+
+class ExportLimiter:
+    """
+    限制同时进行的导出数：每个导出在整个过程中占用一个数据库连接
+
+    - chunk_size：每次从游标读取并发送的行数
+    """
+
+    def __init__(self, max_concurrent: int = 2, chunk_size: int = 1000):
+        self.max_concurrent = max_concurrent
+        self.chunk_size = chunk_size
+        self.active = 0
+
+    @classmethod
+    def from_env(cls) -> "ExportLimiter":
+        return cls(
+            max_concurrent=int(os.getenv("EXPORT_MAX_CONCURRENT", "2")),
+            chunk_size=int(os.getenv("EXPORT_CHUNK_SIZE", "1000")),
+        )
+
+    def try_acquire(self) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+
+    def response(self, chunks: AsyncIterator[bytes], media_type: str, headers: Dict[str, str]) -> StreamingResponse:
+        """在 try_acquire 成功后调用：把导出流包装为响应，响应结束时释放名额"""
+        return _ExportResponse(self, chunks, media_type=media_type, headers=headers)
+
+
+class _ExportResponse(StreamingResponse):
+    """
+    发送结束、出错或客户端断开（包括还没开始读取导出流就断开）时都释放导出名额
+
+    名额不能在导出流的finally中释放：生成器一次都没有迭代过时finally不会执行
+    """
+
+    def __init__(self, limiter: ExportLimiter, chunks: AsyncIterator[bytes], **kwargs):
+        super().__init__(chunks, **kwargs)
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # 中途断开时立即关闭导出流，归还其占用的数据库连接，不等垃圾回收
+            aclose = getattr(self.body_iterator, "aclose", None)
+            try:
+                if aclose is not None:
+                    await aclose()
+            finally:
+                self.limiter.release()
+
+
+def export_filename(table: str, fmt: str) -> str:
+    return f"{table}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}"
+
@@ -0,0 +1,231 @@
+"""
+只读接口的HTTP条件缓存：ETag / If-None-Match / Cache-Control，较大的JSON正文gzip压缩
+
+ETag由内存中的数据版本生成，不做任何I/O：会话写入队列每批提交、提交反馈后，"sessions" 版本和
+涉及地区各级的 "market:<层级键>" 版本加一。前端轮询带上 If-None-Match，版本未变直接返回304；
+没有带条件头的请求，同一版本的正文在进程内缓存，也不再查询数据库。
+多进程部署时版本同时写入共享状态，各worker在后台定期读回，其他worker的写入最多延迟一个刷新间隔
+（SHARED_STATE_FLUSH_SECONDS）反映到本worker的ETag。
+
+命令行维护工具（如 market_data rebuild）直接改库不会更新版本，运行后需重启服务。
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from services.location import parse_location
+from services.market_data import market_keys
+from services.shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+SESSIONS = "sessions"
+
+# 各接口的Cache-Control：no-cache 表示浏览器可以缓存但每次都要带ETag重新验证
+CACHE_CONTROL = {
+    "models": "public, max-age=10",
+    "stats": "no-cache",
+    "market": "public, max-age=30",
+}
+
+
+def market_version_name(location: str) -> str:
+    """/market-analysis 依赖的数据版本：能解析出地区时按该地区，否则（走区名/全文索引统计）按全局"""
+    key = parse_location(location).key()
+    return f"market:{key}" if key else SESSIONS
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match 弱比较"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any((tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()) == bare for tag in header.split(","))
+
+
+class DataVersions:
+    """
+    数据版本号，保存在进程内存中
+
+    shared 不为None时递增同时写入各worker共用的共享状态（不等待完成），并每隔 refresh_seconds
+    在后台读回；读回时每项取较大值，本进程刚递增、还没写入共享状态的版本不会倒退
+    """
+
+    def __init__(self, shared: Optional[SharedState] = None, refresh_seconds: float = 1.0):
+        self.shared = shared
+        self.refresh_seconds = refresh_seconds
+        self._versions: Dict[str, int] = {}
+        # 进程内的版本号重启后从0开始，加上启动时间避免与重启前的ETag相同
+        self._boot = time.time_ns()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        启动时调用：共享状态的版本在重启后保留，递增 boot 让重启前的ETag全部失效，
+        读入当前版本后开始后台刷新
+        """
+        if self.shared is None or self._task is not None:
+            return
+        self.shared.bump_versions(["boot"])
+        await self._refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh(self):
+        try:
+            versions = await self.shared.versions()
+        except Exception as e:
+            logger.warning("读取共享数据版本失败", extra={"error": str(e)})
+            return
+        for name, version in versions.items():
+            if version > self._versions.get(name, 0):
+                self._versions[name] = version
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            await self._refresh()
+
+    def bump(self, names: Iterable[str]):
+        names = sorted(set(names))
+        if not names:
+            return
+        for name in names:
+            self._versions[name] = self._versions.get(name, 0) + 1
+        if self.shared is not None:
+            self.shared.bump_versions(names)
+
+    def touch(self, locations: Iterable[Optional[str]]):
+        """会话或反馈写入后：全局版本和各地区各级版本加一"""
+        names = {SESSIONS}
+        for location in locations:
+            names.update(f"market:{key}" for key in market_keys(location))
+        self.bump(names)
+
+    def tag(self, names: List[str]) -> str:
+        boot = self._versions.get("boot", 0) if self.shared is not None else self._boot
+        return "-".join(str(value) for value in [boot] + [self._versions.get(name, 0) for name in names])
+
+
+class HttpCache:
+    """
+    条件请求与正文缓存
+
+    - max_entries：进程内缓存的正文数（按接口和参数）
+    - gzip_min_size：正文超过该字节数且客户端接受gzip时压缩
+    """
+
+    def __init__(self, versions: DataVersions, enabled: bool = True, max_entries: int = 256, gzip_min_size: int = 1024):
+        self.versions = versions
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.gzip_min_size = gzip_min_size
+        # 键 -> (数据版本, 正文, gzip正文, build()的结果)；带 live 的接口只缓存 build() 的结果
+        self._bodies: "OrderedDict[str, tuple]" = OrderedDict()
+        self.counters = {"not_modified": 0, "body_hits": 0, "rendered": 0}
+
+    @classmethod
+    def from_env(cls, shared: Optional[SharedState] = None) -> "HttpCache":
+        if shared is not None and not shared.enabled:
+            shared = None
+        return cls(
+            DataVersions(shared, refresh_seconds=shared.flush_seconds if shared is not None else 1.0),
+            enabled=os.getenv("HTTP_CACHE_ENABLED", "true").lower() == "true",
+            max_entries=int(os.getenv("HTTP_CACHE_MAX_ENTRIES", "256")),
+            gzip_min_size=int(os.getenv("HTTP_GZIP_MIN_SIZE", "1024")),
+        )
+
+    async def respond(self, request: Request, key: str, cache_control: str, build: Callable[[], Awaitable[Any]],
+                      versions: Optional[List[str]] = None,
+                      live: Optional[Callable[[], Dict[str, Any]]] = None) -> Response:
+        """
+        versions 给出时按数据版本生成ETag，先判断条件请求、再查正文缓存，都未命中才调用 build()；
+        不给时（如 /models，内容来自内存）每次 build() 后按正文哈希生成ETag
+
+        live 返回不随数据版本变化的内存数据（如缓存计数），每次请求都重新读取：合并到 build() 的结果中，
+        其哈希也计入ETag，数据版本未变但计数变化时不会返回304
+        """
+        if not self.enabled:
+            content = await build()
+            return self._response(request, self._render({**content, **live()} if live else content), None, None, {})
+
+        etag = tag = extra = None
+        headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if versions is not None:
+            tag = self.versions.tag(versions)
+            etag = f'W/"{tag}"'
+            if live is not None:
+                extra = live()
+                etag = f'W/"{tag}-{hashlib.sha1(self._render(extra)).hexdigest()[:12]}"'
+            headers["ETag"] = etag
+            if _etag_matches(request.headers.get("if-none-match"), etag):
+                self.counters["not_modified"] += 1
+                return Response(status_code=304, headers=headers)
+            cached = self._bodies.get(key)
+            if cached is not None and cached[0] == tag:
+                self._bodies.move_to_end(key)
+                self.counters["body_hits"] += 1
+                if extra is not None:
+                    return self._response(request, self._render({**cached[3], **extra}), None, None, headers)
+                return self._response(request, cached[1], cached[2], key, headers)
+
+        content = await build()
+        self.counters["rendered"] += 1
+        if extra is not None:
+            self._remember(key, tag, None, content)
+            return self._response(request, self._render({**content, **extra}), None, None, headers)
+        body = self._render(content)
+        if etag is None:
+            etag = f'W/"{hashlib.sha1(body).hexdigest()[:16]}"'
+            headers["ETag"] = etag
+            if _etag_matches(request.headers.get("if-none-match"), etag):
+                self.counters["not_modified"] += 1
+                return Response(status_code=304, headers=headers)
+            return self._response(request, body, None, None, headers)
+        self._remember(key, tag, body, None)
+        return self._response(request, body, None, key, headers)
+
+    def _render(self, content: Any) -> bytes:
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _remember(self, key: str, tag: str, body: Optional[bytes], content: Any):
+        self._bodies[key] = (tag, body, None, content)
+        self._bodies.move_to_end(key)
+        while len(self._bodies) > self.max_entries:
+            self._bodies.popitem(last=False)
+
+    def _response(self, request: Request, body: bytes, compressed: Optional[bytes], key: Optional[str],
+                  headers: Dict[str, str]) -> Response:
+        if len(body) >= self.gzip_min_size and "gzip" in request.headers.get("accept-encoding", "").lower():
+            if compressed is None:
+                compressed = gzip.compress(body, compresslevel=6)
+                if key is not None and key in self._bodies:
+                    # 压缩结果随正文一起缓存
+                    entry = self._bodies[key]
+                    self._bodies[key] = (entry[0], entry[1], compressed, entry[3])
+            return Response(content=compressed, media_type="application/json",
+                            headers={**headers, "Content-Encoding": "gzip"})
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, **self.counters, "entries": len(self._bodies)}
@@ -0,0 +1,348 @@
+"""
+单遍、括号感知的容错JSON提取器
+
+一次扫描完成：定位顶层对象、跳过代码块标记和前后说明文字、
+修复字符串中未转义的换行/引号、补上漏写的结束引号、去掉尾随逗号、
+丢弃只有键没有值的成员、补全被截断的输出，并返回实际应用了哪些修复。
+"""
+
+import json
+import json.decoder
+import json.scanner
+import re
+from typing import Any, List, Optional, Tuple
+
+# 修复类型
+REPAIR_NEWLINE = "unescaped_newline"
+REPAIR_CONTROL = "control_char"
+REPAIR_QUOTE = "unescaped_quote"
+REPAIR_UNCLOSED = "unclosed_string"
+REPAIR_TRAILING_COMMA = "trailing_comma"
+REPAIR_DROPPED = "dropped_member"
+REPAIR_TRUNCATED = "closed_truncated"
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+_OBJECT_START = re.compile(r'\{(?=[ \t\r\n]*(?:["}]|\Z))')
+_ARRAY_START = re.compile(r'\[')
+
+# 各容器中下一个成员的开头：对象为键，数组为值
+_NEXT_MEMBER = {'{': r'"', '[': r'[-"{\[0-9tfn]'}
+
+# 字符串的结束引号：之后只可能是 : } ] 或文本结尾；逗号之后还必须紧跟下一个成员的开头或右括号。
+# 其余未转义引号视为正文中的引号（如 "他说"可以"，然后…"），整段一次性转义。
+_CLOSE_AHEAD = r'(?=[ \t\r\n]*(?:[:}}\]]|\Z|,[ \t\r\n]*(?:{next}|[}}\]]|\Z)))'
+_STRING_ENDS = {
+    container: re.compile('"' + _CLOSE_AHEAD.format(next=next_member))
+    for container, next_member in _NEXT_MEMBER.items()
+}
+# 字符串内的 `, "xxx"` 之后若又是结束引号的位置（如 ["a, "b"]），说明漏写了结束引号，逗号是分隔符
+_MISSING_QUOTE = {
+    container: re.compile(r',(?=[ \t\r\n]*"[^"\\\x00-\x1f]*"' + _CLOSE_AHEAD.format(next=next_member) + ')')
+    for container, next_member in _NEXT_MEMBER.items()
+}
+# 换行/制表符以外的控制字符，修复时去掉
+_CONTROL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# 对象成员开头：不需要修复的键连同冒号一次取出
+_MEMBER_KEY = re.compile(r'[ \t\r\n]*"([^"\\\x00-\x1f]*)"[ \t\r\n]*:[ \t\r\n]*')
+# 值之后：分隔逗号（第1组，其后是下一个成员）、尾随逗号后的右括号（第2组）、右括号（第3组）或文本结尾
+_FOLLOWS = {
+    container: re.compile(
+        r'[ \t\r\n]*(?:,[ \t\r\n]*(?:()(?=' + next_member + r')|([}\]])|\Z)|([}\]])|\Z)'
+    )
+    for container, next_member in _NEXT_MEMBER.items()
+}
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+# 直到文本结尾都没有结构字符：被截断的数字或 true/false/null
+_TRUNCATED_SCALAR = re.compile(r'[^"{}\[\],]*\Z')
+
+# 严格解码：字符串中出现未转义的换行等控制字符时失败，由后续步骤记录修复
+_DECODER = json.JSONDecoder()
+# strict=False 允许字符串中出现未转义的控制字符，仅在严格解码因此失败时使用
+_LENIENT_DECODER = json.JSONDecoder(strict=False)
+# 严格解码因字符串中的控制字符失败时的错误信息（C实现与纯Python实现相同）
+_CONTROL_ERROR = "Invalid control character at"
+# C实现的单值扫描器：修复时格式正确的值（包括整个嵌套对象/数组）一次解析，只有出问题的部分逐段处理
+_SCAN_VALUE = json.scanner.make_scanner(_DECODER)
+_SCAN_STRING = json.decoder.scanstring
+# 对象中被丢弃的成员（只有键没有值）
+_DROPPED = object()
+
+
+def _escaped(text: str, pos: int) -> bool:
+    """pos前是否紧跟奇数个反斜杠（即pos处字符被转义）"""
+    count = 0
+    while pos - count > 0 and text[pos - count - 1] == '\\':
+        count += 1
+    return count % 2 == 1
+
+
+def _escape_stray_quotes(segment: str, repairs: set) -> str:
+    """
+    转义字符串正文中未转义的引号
+
+    片段中的\x00/\x01已在此之前去掉，借用它们临时保护已有的 \\\\ 和 \\"，全部用str.replace完成
+    """
+    if '"' not in segment:
+        return segment
+    if '\\' in segment:
+        protected = segment.replace('\\\\', '\x00').replace('\\"', '\x01')
+    else:
+        protected = segment
+    if '"' not in protected:
+        return segment
+    repairs.add(REPAIR_QUOTE)
+    return protected.replace('"', '\\"').replace('\x01', '\\"').replace('\x00', '\\\\')
+
+
+def extract_json(text: str, want: str = '{', required_key: Optional[str] = "suggested_price") -> Tuple[Optional[Any], List[str]]:
+    """
+    从模型输出中提取第一个合法的顶层JSON对象（want='['时提取数组）
+
+    每个候选起点先用C实现的解码器严格解析（格式正确的输出走这里）；只因字符串中
+    未转义的换行失败时改用宽松解码并记录修复；其余失败再用修复扫描器处理该括号组。文本中有多个括号组时，优先返回包含
+    required_key 的对象；都不包含时返回第一个可解析的对象；找不到则返回 (None, [])。
+
+    返回 (解析结果, 修复列表)
+    """
+    expected = dict if want == '{' else list
+    first: Optional[Tuple[Any, List[str]]] = None
+    n = len(text)
+    pos = 0
+
+    # 对象的第一个成员必须以引号开头，直接跳过 "{城市}" 这类模板占位符
+    candidates = _OBJECT_START if want == '{' else _ARRAY_START
+    # 最后一个右括号之后的候选不可能完整（截断的输出），不必先尝试直接解析
+    last_closer = text.rfind(_CLOSERS[want])
+
+    while pos < n:
+        match = candidates.search(text, pos)
+        if match is None:
+            break
+        start = match.start()
+
+        try:
+            if start > last_closer:
+                raise ValueError("未闭合")
+            parsed, end = _DECODER.raw_decode(text, start)
+            repairs: List[str] = []
+            completed = True
+        except ValueError as exc:
+            lenient = _decode_unescaped(text, start) if getattr(exc, 'msg', None) == _CONTROL_ERROR else None
+            if lenient is not None:
+                parsed, end = lenient
+                repairs = [REPAIR_NEWLINE]
+                completed = True
+            else:
+                parsed, end, completed, repairs = _repair_scan(text, start)
+
+        if isinstance(parsed, expected):
+            if required_key is None or expected is list or required_key in parsed:
+                return parsed, repairs
+            if first is None:
+                first = (parsed, repairs)
+
+        if not completed:
+            # 已扫描到文本末尾，不再回头重扫
+            break
+        # 从当前括号组之后继续寻找下一个候选
+        pos = end
+
+    return first if first is not None else (None, [])
+
+
+def _decode_unescaped(text: str, start: int) -> Optional[Tuple[Any, int]]:
+    """
+    宽松解码字符串中含未转义换行/制表符的括号组，返回 (解析结果, 结束位置)
+
+    还有其他问题，或含换行/制表符以外的控制字符（需要去掉）时返回None，交给修复扫描器
+    """
+    try:
+        parsed, end = _LENIENT_DECODER.raw_decode(text, start)
+    except ValueError:
+        return None
+    if _CONTROL.search(text, start, end):
+        return None
+    return parsed, end
+
+
+def _repair_scan(text: str, start: int) -> Tuple[Optional[Any], int, bool, List[str]]:
+    """
+    从start处的括号开始单遍扫描并修复，返回 (解析结果, 结束位置, 括号是否闭合, 修复列表)
+
+    边扫描边构造结果：格式正确的值交给C扫描器，只有出问题的字符串逐段修复、
+    出问题的容器逐个成员处理，最后不需要再整体解析一遍。
+    截断时保留已完整的成员；对象中只有键没有值的成员丢弃。
+    遇到无法修复的内容时只保留顶层最后一个分隔逗号之前的成员，一个都没有时解析结果为None。
+    """
+    n = len(text)
+    repairs = set()
+    match_key = _MEMBER_KEY.match
+    skip_space = _WHITESPACE.match
+    root: Any = {} if text[start] == '{' else []
+    stack = [root]
+    # 顶层已由分隔逗号确认完整的成员数
+    sealed = 0
+    # 当前位置是否为成员开头（刚过左括号或分隔逗号）
+    at_member = True
+    i = start + 1
+
+    while True:
+        container = stack[-1]
+        kind = '{' if type(container) is dict else '['
+        match_follows = _FOLLOWS[kind].match
+
+        if at_member:
+            key: Any = None
+            if kind == '{':
+                match = match_key(text, i)
+                if match is not None:
+                    key = match.group(1)
+                    i = match.end()
+                else:
+                    i = skip_space(text, i).end()
+                    if i < n and text[i] == '"':
+                        key, i, closed = _scan_string(text, i + 1, kind, repairs)
+                        if not closed:
+                            break
+                        if key is None:
+                            return _salvage(root, sealed, i, repairs)
+                        i = skip_space(text, i).end()
+                        if i < n and text[i] == ':':
+                            i = skip_space(text, i + 1).end()
+                        elif i < n:
+                            repairs.add(REPAIR_DROPPED)
+                            key = _DROPPED
+            else:
+                i = skip_space(text, i).end()
+            if i >= n:
+                break
+
+            ch = text[i]
+            if key is _DROPPED or ch in '}]':
+                # 被丢弃的成员或空容器，直接处理其后的逗号/右括号
+                pass
+            elif kind == '{' and key is None:
+                return _salvage(root, sealed, i, repairs)
+            else:
+                try:
+                    if ch in _CLOSERS and text.find(_CLOSERS[ch], i) < 0:
+                        # 之后没有对应的右括号，C扫描器必然失败
+                        raise ValueError("未闭合")
+                    value, end = _SCAN_VALUE(text, i)
+                    follows = match_follows(text, end)
+                except (StopIteration, ValueError):
+                    follows = None
+                if follows is None:
+                    if ch in '{[':
+                        # 容器内有需要修复的地方，进入该容器逐个成员处理
+                        value = {} if ch == '{' else []
+                        if kind == '{':
+                            container[key] = value
+                        else:
+                            container.append(value)
+                        stack.append(value)
+                        i += 1
+                        continue
+                    if ch == '"':
+                        value, i, closed = _scan_string(text, i + 1, kind, repairs)
+                        if value is None:
+                            if closed:
+                                return _salvage(root, sealed, i, repairs)
+                            break
+                        if closed:
+                            follows = match_follows(text, i)
+                            if follows is None:
+                                return _salvage(root, sealed, i, repairs)
+                    elif _TRUNCATED_SCALAR.match(text, i):
+                        break
+                    else:
+                        return _salvage(root, sealed, i, repairs)
+                if kind == '{':
+                    container[key] = value
+                else:
+                    container.append(value)
+                if follows is None:
+                    # 截断在字符串中间，保留已有的部分
+                    break
+                i = follows.start()
+            at_member = False
+
+        follows = match_follows(text, i)
+        if follows is None:
+            return _salvage(root, sealed, i, repairs)
+        i = follows.end()
+        if follows.group(1) is not None:
+            if len(stack) == 1:
+                sealed = len(root)
+            at_member = True
+            continue
+        closer = follows.group(2) or follows.group(3)
+        if closer is None:
+            break
+        if closer != _CLOSERS[kind]:
+            return _salvage(root, sealed, i, repairs)
+        if follows.group(2) is not None:
+            repairs.add(REPAIR_TRAILING_COMMA)
+        stack.pop()
+        if not stack:
+            return root, i, True, sorted(repairs)
+
+    repairs.add(REPAIR_TRUNCATED)
+    return root, n, False, sorted(repairs)
+
+
+def _salvage(root: Any, sealed: int, i: int, repairs: set) -> Tuple[Optional[Any], int, bool, List[str]]:
+    """无法修复时保留顶层前sealed个成员，丢弃其后的内容"""
+    if not sealed:
+        return None, i, True, sorted(repairs)
+    if type(root) is dict:
+        root = dict(list(root.items())[:sealed])
+    else:
+        del root[sealed:]
+    repairs.add(REPAIR_DROPPED)
+    return root, i, True, sorted(repairs)
+
+
+def _scan_string(text: str, i: int, container: str, repairs: set) -> Tuple[Optional[str], int, bool]:
+    """
+    从开引号之后的i处按结束引号的规则扫描字符串，修复未转义的引号和控制字符
+
+    返回 (字符串, 结束位置, 是否闭合)；含不合法的转义序列时字符串为None
+    """
+    n = len(text)
+    begin = i
+    search = _STRING_ENDS[container].search
+    while True:
+        match = search(text, i)
+        stop = match.start() if match else n
+        if match is None or not _escaped(text, stop):
+            break
+        # 已转义的引号不是结束引号，继续作为正文
+        i = stop + 1
+
+    # 结束引号之前（含该引号，其后的判断已经成立）出现的漏写结束引号
+    missing = _MISSING_QUOTE[container].search(text, begin, stop + 1)
+    if missing is not None:
+        repairs.add(REPAIR_UNCLOSED)
+        stop, end, closed = missing.start(), missing.start(), True
+    elif match is not None:
+        end, closed = stop + 1, True
+    else:
+        end, closed = n, False
+
+    segment = text[begin:stop]
+    if not closed and _escaped(text, n):
+        # 截断在转义序列中间时去掉孤立的反斜杠
+        segment = segment[:-1]
+    if not segment.isprintable():
+        if '\n' in segment or '\r' in segment or '\t' in segment:
+            repairs.add(REPAIR_NEWLINE)
+        if _CONTROL.search(segment):
+            repairs.add(REPAIR_CONTROL)
+            segment = _CONTROL.sub('', segment)
+    try:
+        # strict=False：换行等保留原样
+        return _SCAN_STRING(_escape_stray_quotes(segment, repairs) + '"', 0, False)[0], end, closed
+    except ValueError:
+        return None, end, closed
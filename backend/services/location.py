@@ -0,0 +1,125 @@
+"""
+位置解析：把 "北京朝阳区三里屯"、"广东省深圳市南山区" 这类自由文本拆成省/市/区
+
+写入会话时解析一次并存入带索引的列，市场查询按层级精确匹配，
+不再依赖 LIKE '%x%' 全表扫描。解析不出来的部分保持为None。
+"""
+
+import re
+from typing import List, NamedTuple, Optional
+
+MUNICIPALITIES = ("北京", "上海", "天津", "重庆")
+
+PROVINCES = (
+    "河北", "山西", "辽宁", "吉林", "黑龙江", "江苏", "浙江", "安徽", "福建", "江西", "山东",
+    "河南", "湖北", "湖南", "广东", "海南", "四川", "贵州", "云南", "陕西", "甘肃", "青海", "台湾",
+    "内蒙古", "广西", "西藏", "宁夏", "新疆", "香港", "澳门",
+)
+
+# 常见城市（省会及主要地级市）所属省份，用于 "深圳南山" 这类省略省份和后缀的写法
+CITY_PROVINCES = {
+    "石家庄": "河北", "唐山": "河北", "保定": "河北", "廊坊": "河北",
+    "太原": "山西", "沈阳": "辽宁", "大连": "辽宁", "长春": "吉林", "哈尔滨": "黑龙江",
+    "南京": "江苏", "苏州": "江苏", "无锡": "江苏", "常州": "江苏", "南通": "江苏", "徐州": "江苏",
+    "杭州": "浙江", "宁波": "浙江", "温州": "浙江", "嘉兴": "浙江", "绍兴": "浙江", "金华": "浙江",
+    "合肥": "安徽", "芜湖": "安徽", "福州": "福建", "厦门": "福建", "泉州": "福建",
+    "南昌": "江西", "济南": "山东", "青岛": "山东", "烟台": "山东", "潍坊": "山东",
+    "郑州": "河南", "洛阳": "河南", "武汉": "湖北", "宜昌": "湖北", "长沙": "湖南",
+    "广州": "广东", "深圳": "广东", "东莞": "广东", "佛山": "广东", "珠海": "广东", "惠州": "广东", "中山": "广东",
+    "海口": "海南", "三亚": "海南", "成都": "四川", "绵阳": "四川", "贵阳": "贵州", "昆明": "云南",
+    "西安": "陕西", "兰州": "甘肃", "西宁": "青海", "呼和浩特": "内蒙古", "包头": "内蒙古",
+    "南宁": "广西", "桂林": "广西", "拉萨": "西藏", "银川": "宁夏", "乌鲁木齐": "新疆",
+}
+
+_PROVINCE_SUFFIX = re.compile(r'^(?:省|壮族自治区|回族自治区|维吾尔自治区|自治区|特别行政区|市)')
+_CITY_UNIT = re.compile(r'^(.{2,6}?)(?:市|自治州|地区|盟)')
+_DISTRICT_UNIT = re.compile(r'^(.{1,6}?)(?:新区|区|县|旗|市)')
+# 没有后缀时，城市后面不超过这个长度的剩余文本视为区名（如 "上海浦东"）
+_BARE_DISTRICT_MAX = 4
+
+
+class ParsedLocation(NamedTuple):
+    province: Optional[str]
+    city: Optional[str]
+    district: Optional[str]
+
+    def keys(self) -> List[str]:
+        """
+        从粗到细的层级键，如 ["广东", "广东/深圳", "广东/深圳/南山"]；直辖市省市合并为一级
+        """
+        parts = [part for part in (self.province, self.city, self.district) if part]
+        if self.province and self.province == self.city:
+            parts.pop(0)
+        if self.district and not self.city:
+            # 只有省和区时无法确定归属，不生成区级键
+            parts.pop()
+        return ["/".join(parts[:i + 1]) for i in range(len(parts))]
+
+    def key(self) -> Optional[str]:
+        """最细一级的层级键"""
+        keys = self.keys()
+        return keys[-1] if keys else None
+
+
+def _strip_prefix(text: str, names) -> tuple:
+    for name in sorted(names, key=len, reverse=True):
+        if text.startswith(name):
+            return name, text[len(name):]
+    return None, text
+
+
+def parse_location(location: Optional[str]) -> ParsedLocation:
+    text = "".join((location or "").split())
+    if not text:
+        return ParsedLocation(None, None, None)
+
+    # 省级：直辖市、省/自治区（去掉行政后缀）
+    province, rest = _strip_prefix(text, MUNICIPALITIES + PROVINCES)
+    if province is not None:
+        suffix = _PROVINCE_SUFFIX.match(rest)
+        if suffix:
+            rest = rest[suffix.end():]
+
+    # 市级
+    city = None
+    if province in MUNICIPALITIES:
+        city = province
+    else:
+        known, after = _strip_prefix(rest, CITY_PROVINCES)
+        if known is not None and (province is None or CITY_PROVINCES[known] == province):
+            city, rest = known, after
+            rest = rest[1:] if rest.startswith("市") else rest
+            province = province or CITY_PROVINCES[known]
+        else:
+            match = _CITY_UNIT.match(rest)
+            if match and province is not None:
+                city, rest = match.group(1), rest[match.end():]
+
+    # 区级：带后缀的取后缀前的部分，没有后缀的短文本整体视为区名
+    district = None
+    if city is not None and rest:
+        match = _DISTRICT_UNIT.match(rest)
+        if match and len(match.group(1)) >= 2:
+            district = match.group(1)
+        elif len(rest) <= _BARE_DISTRICT_MAX:
+            district = rest
+
+    return ParsedLocation(province, city, district)
+
+
+def normalize_location(location: Optional[str]) -> Optional[str]:
+    """去掉首尾和内部多余空白，空值返回None"""
+    if not location:
+        return None
+    return "".join(location.split()) or None
+
+
+def region_keys(location: Optional[str], province: Optional[str], city: Optional[str], district: Optional[str]) -> List[str]:
+    """
+    按已解析的省/市/区生成从粗到细的层级键（与区域市场数据相同），都为空时按原文位置
+    """
+    keys = ParsedLocation(province, city, district).keys()
+    if keys:
+        return keys
+    key = normalize_location(location)
+    return [key] if key else []
@@ -0,0 +1,195 @@
+"""
+结构化日志：后台线程写出、按级别采样、按请求开启完整载荷
+
+请求路径上只把日志记录放进有界队列，由QueueListener线程格式化为JSON行写到stdout；
+队列满时直接丢弃并计数，不阻塞事件循环。prompt、模型原始响应这类大段载荷
+只有在 LOG_PAYLOADS=true 或请求带有追踪请求头时才会记录。
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+# 当前请求的ID，以及是否对该请求输出完整载荷
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+trace_var: contextvars.ContextVar[bool] = contextvars.ContextVar("trace", default=False)
+
+REQUEST_ID_HEADER = "x-request-id"
+TRACE_HEADER = os.getenv("LOG_TRACE_HEADER", "X-Debug-Trace").lower()
+
+# LogRecord自带的属性，其余通过extra传入的字段都作为结构化字段输出
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+_payloads_enabled = False
+
+
+def _parse_rates(raw: str) -> Dict[int, float]:
+    """解析 "DEBUG=0.01,INFO=0.5" 形式的采样率配置"""
+    rates = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        level, rate = item.split("=", 1)
+        level_no = logging.getLevelName(level.strip().upper())
+        if isinstance(level_no, int):
+            rates[level_no] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按级别采样；WARNING及以上、追踪中的请求和载荷日志始终保留
+    """
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or trace_var.get() or getattr(record, "payload", None) is not None:
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class ContextFilter(logging.Filter):
+    """在入队前捕获请求上下文（写出线程中读不到contextvars）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞请求"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 结构化字段原样保留，交给写出线程格式化
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = logging.Formatter().formatException(record.exc_info) if record.exc_info else None
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """
+    配置根日志：队列 + 后台写出线程，重复调用无副作用
+
+    环境变量：LOG_LEVEL、LOG_SAMPLE_RATES、LOG_QUEUE_SIZE、LOG_PAYLOADS
+    """
+    global _listener, _queue_handler, _payloads_enabled
+    if _listener is not None:
+        return
+
+    _payloads_enabled = os.getenv("LOG_PAYLOADS", "false").lower() == "true"
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(ContextFilter())
+    _queue_handler.addFilter(SamplingFilter(_parse_rates(os.getenv("LOG_SAMPLE_RATES", "DEBUG=0.01"))))
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """停止写出线程，并把队列中剩余的日志写完"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_count() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def payloads_enabled() -> bool:
+    """当前请求是否需要记录完整的prompt/响应内容"""
+    return _payloads_enabled or trace_var.get()
+
+
+def log_payload(logger: logging.Logger, label: str, body: Any, **fields: Any):
+    """记录大段载荷（prompt、模型原始响应、解析结果），未开启时不做任何格式化"""
+    if payloads_enabled():
+        logger.info(label, extra={"payload": body, **fields})
+
+
+class RequestContextMiddleware:
+    """
+    为每个请求设置请求ID与追踪标记，并在响应头中返回请求ID
+
+    纯ASGI实现，不会像BaseHTTPMiddleware那样缓冲流式响应
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        trace = headers.get(TRACE_HEADER.encode(), b"").decode("latin-1").lower() in ("1", "true", "yes")
+        request_id_token = request_id_var.set(request_id)
+        trace_token = trace_var.set(trace)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(request_id_token)
+            trace_var.reset(trace_token)
@@ -0,0 +1,269 @@
+"""
+区域市场数据：写入会话和反馈时增量更新 MarketData，查询时按地区直接读取一行
+
+累计值用 INSERT ... ON CONFLICT DO UPDATE 原子累加，与会话写入在同一事务中提交；
+平均价格、趋势、热度由累计值派生。历史数据或统计口径变化时可全量重建：
+
+    python -m services.market_data rebuild
+"""
+
+import argparse
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, func, select, text, update
+from sqlalchemy.orm import Session
+
+import database
+from models import MarketData, NegotiationSession, UserFeedback
+from services.location import normalize_location, parse_location, region_keys
+
+# 报价的快/慢指数移动平均平滑系数；快线高于/低于慢线该比例时判定为上涨/下跌
+TREND_FAST_ALPHA = 0.3
+TREND_SLOW_ALPHA = 0.05
+TREND_THRESHOLD = 0.03
+TREND_MIN_SAMPLES = 3
+# 平均砍价幅度低于HOT视为热门（房东不愁租），高于COLD视为冷淡
+HEAT_HOT_DISCOUNT = 0.03
+HEAT_COLD_DISCOUNT = 0.08
+
+EWMAS = (("price_ewma", TREND_FAST_ALPHA), ("price_ewma_slow", TREND_SLOW_ALPHA))
+
+COUNTERS = ("sample_size", "price_sum", "suggested_count", "discount_sum",
+            "feedback_count", "success_count", "deal_count", "deal_discount_sum")
+
+
+def market_keys(location: Optional[str]) -> List[str]:
+    """
+    一条会话需要计入的地区键：省/市/区各一级（如 "广东"、"广东/深圳"、"广东/深圳/南山"），
+    无法解析的位置按原文计入
+    """
+    return region_keys(location, *parse_location(location))
+
+
+def _accumulate(db: Session, keys: Iterable[str], price: Optional[int] = None, **increments: int):
+    """对每个地区原子累加计数，price不为空时同时更新EWMA，然后刷新派生字段"""
+    keys = list(keys)
+    if not keys:
+        return
+    insert = database.dialect_insert(db)
+    for key in keys:
+        values = {counter: 0 for counter in COUNTERS}
+        values.update(increments, location=key, **{name: price for name, _ in EWMAS})
+        stmt = insert(MarketData).values(**values)
+        set_ = {counter: getattr(MarketData, counter) + stmt.excluded[counter] for counter in increments}
+        if price is not None:
+            for name, alpha in EWMAS:
+                column = getattr(MarketData, name)
+                set_[name] = case(
+                    (column.is_(None), stmt.excluded[name]),
+                    else_=column * (1 - alpha) + stmt.excluded[name] * alpha
+                )
+        db.execute(stmt.on_conflict_do_update(index_elements=[MarketData.location], set_=set_))
+    _refresh_derived(db, MarketData.location.in_(keys))
+
+
+def _refresh_derived(db: Session, condition=None):
+    """由累计值重新计算平均价格、趋势和热度"""
+    average = MarketData.price_sum * 1.0 / MarketData.sample_size
+    discount_ratio = (MarketData.discount_sum * 1.0 / MarketData.suggested_count) / average
+    stmt = update(MarketData).values(
+        average_price=case((MarketData.sample_size > 0, MarketData.price_sum // MarketData.sample_size), else_=None),
+        price_trend=case(
+            (MarketData.sample_size == 0, None),
+            (MarketData.sample_size < TREND_MIN_SAMPLES, "stable"),
+            (MarketData.price_ewma > MarketData.price_ewma_slow * (1 + TREND_THRESHOLD), "rising"),
+            (MarketData.price_ewma < MarketData.price_ewma_slow * (1 - TREND_THRESHOLD), "falling"),
+            else_="stable"
+        ),
+        market_heat=case(
+            (MarketData.suggested_count == 0, None),
+            (MarketData.price_sum == 0, None),
+            (discount_ratio < HEAT_HOT_DISCOUNT, "hot"),
+            (discount_ratio > HEAT_COLD_DISCOUNT, "cold"),
+            else_="moderate"
+        )
+    )
+    if condition is not None:
+        stmt = stmt.where(condition)
+    db.execute(stmt.execution_options(synchronize_session=False))
+
+
+def record_session(db: Session, location: Optional[str], current_price: Optional[int]):
+    """新会话：计入样本数和报价"""
+    if current_price:
+        _accumulate(db, market_keys(location), price=current_price, sample_size=1, price_sum=current_price)
+
+
+def record_advice(db: Session, location: Optional[str], current_price: Optional[int], suggested_price: Optional[int]):
+    """会话得到建议价格：计入砍价幅度"""
+    if current_price and suggested_price:
+        _accumulate(db, market_keys(location), suggested_count=1, discount_sum=current_price - suggested_price)
+
+
+def record_feedback(db: Session, session: Optional[NegotiationSession], success: Optional[str], actual_price: Optional[int]):
+    """用户反馈：计入成功率和实际成交价"""
+    if session is None:
+        return
+    increments = {"feedback_count": 1, "success_count": 1 if success == "success" else 0}
+    if actual_price and session.current_price:
+        increments.update(deal_count=1, deal_discount_sum=session.current_price - actual_price)
+    _accumulate(db, market_keys(session.location), **increments)
+
+
+def get_market_data(db: Session, location: str) -> Optional[MarketData]:
+    """按查询文本解析出的最细一级层级键读取，如 深圳南山 -> 广东/深圳/南山"""
+    key = parse_location(location).key() or normalize_location(location)
+    if key is None:
+        return None
+    return db.execute(select(MarketData).where(MarketData.location == key)).scalar_one_or_none()
+
+
+def analyze(db: Session, location: str) -> Optional[Dict[str, Any]]:
+    """/market-analysis 的统计：先读层级聚合行，没有时走区名/全文索引，都没有数据返回None"""
+    row = get_market_data(db, location)
+    if row is not None and row.sample_size:
+        return market_summary(row)
+    return fallback_summary(db, location)
+
+
+def fallback_summary(db: Session, location: str) -> Optional[Dict[str, Any]]:
+    """
+    查询文本不是可解析的地区（如只给了 "朝阳"、"南山区"、小区名）时的统计
+
+    先按区名走district列索引，再用SQLite FTS5 trigram全文索引（需开启LOCATION_FTS），都没有则返回None
+    """
+    query = normalize_location(location)
+    if query is None:
+        return None
+
+    district = query
+    for suffix in ("新区", "区", "县"):
+        if district.endswith(suffix) and len(district) - len(suffix) >= 2:
+            district = district[:-len(suffix)]
+            break
+    summary = _session_summary(db, NegotiationSession.district == district)
+    if summary is None and database.location_fts_enabled() and len(query) >= 3:
+        matched = text("SELECT rowid FROM negotiation_sessions_fts WHERE negotiation_sessions_fts MATCH :query")
+        summary = _session_summary(db, NegotiationSession.id.in_(matched.bindparams(query='"' + query.replace('"', '""') + '"')))
+    return summary
+
+
+def _session_summary(db: Session, condition) -> Optional[Dict[str, Any]]:
+    """对满足条件的会话做一次SQL聚合"""
+    sample_size, average_price, suggested_count, average_discount = db.execute(
+        select(
+            func.count(NegotiationSession.id),
+            func.avg(NegotiationSession.current_price),
+            func.count(NegotiationSession.suggested_price),
+            func.avg(NegotiationSession.current_price - NegotiationSession.suggested_price)
+        ).where(condition)
+    ).one()
+    if not sample_size or not average_price:
+        return None
+    discount_percent = average_discount / average_price * 100 if suggested_count else 5
+    return {
+        "average_price": int(average_price),
+        "sample_size": sample_size,
+        "average_discount": f"{discount_percent:.1f}%",
+    }
+
+
+def market_summary(row: MarketData) -> Dict[str, Any]:
+    """/market-analysis 返回的统计字段"""
+    if row.suggested_count:
+        discount_percent = (row.discount_sum / row.suggested_count) / row.average_price * 100 if row.average_price else 0
+    else:
+        discount_percent = 5  # 默认值
+    summary = {
+        "average_price": row.average_price,
+        "sample_size": row.sample_size,
+        "average_discount": f"{discount_percent:.1f}%",
+        "price_trend": row.price_trend,
+        "market_heat": row.market_heat,
+        "feedback_count": row.feedback_count,
+        "success_rate": f"{row.success_count / row.feedback_count * 100:.1f}%" if row.feedback_count else None,
+    }
+    if row.deal_count and row.average_price:
+        summary["actual_discount"] = f"{row.deal_discount_sum / row.deal_count / row.average_price * 100:.1f}%"
+    return summary
+
+
+def rebuild(db: Session, batch_size: int = 1000) -> int:
+    """从会话和反馈表全量重建市场数据，返回地区数"""
+    totals: Dict[str, Dict[str, Any]] = {}
+
+    def bucket(key: str) -> Dict[str, Any]:
+        if key not in totals:
+            totals[key] = {counter: 0 for counter in COUNTERS}
+            totals[key].update({name: None for name, _ in EWMAS})
+        return totals[key]
+
+    # 顺带回填解析规则更新前写入的省/市/区列
+    backfill: List[Dict[str, Any]] = []
+    sessions = db.execute(
+        select(NegotiationSession.id, NegotiationSession.location, NegotiationSession.current_price,
+               NegotiationSession.suggested_price, NegotiationSession.province,
+               NegotiationSession.city, NegotiationSession.district)
+        .order_by(NegotiationSession.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for session_id, location, current_price, suggested_price, *stored in sessions:
+        parsed = parse_location(location)
+        if list(parsed) != stored:
+            backfill.append({"id": session_id, **parsed._asdict()})
+        if not current_price:
+            continue
+        for key in market_keys(location):
+            row = bucket(key)
+            row["sample_size"] += 1
+            row["price_sum"] += current_price
+            for name, alpha in EWMAS:
+                ewma = row[name]
+                row[name] = current_price if ewma is None else ewma * (1 - alpha) + current_price * alpha
+            if suggested_price:
+                row["suggested_count"] += 1
+                row["discount_sum"] += current_price - suggested_price
+
+    feedback = db.execute(
+        select(NegotiationSession.location, NegotiationSession.current_price, UserFeedback.success, UserFeedback.actual_price)
+        .join(NegotiationSession, NegotiationSession.id == UserFeedback.session_id)
+        .execution_options(yield_per=batch_size)
+    )
+    for location, current_price, success, actual_price in feedback:
+        for key in market_keys(location):
+            row = bucket(key)
+            row["feedback_count"] += 1
+            row["success_count"] += 1 if success == "success" else 0
+            if actual_price and current_price:
+                row["deal_count"] += 1
+                row["deal_discount_sum"] += current_price - actual_price
+
+    for start in range(0, len(backfill), batch_size):
+        db.execute(update(NegotiationSession), backfill[start:start + batch_size])
+
+    db.execute(delete(MarketData))
+    rows = [{"location": key, **values} for key, values in totals.items()]
+    for start in range(0, len(rows), batch_size):
+        db.execute(MarketData.__table__.insert(), rows[start:start + batch_size])
+    _refresh_derived(db)
+    db.commit()
+    return len(rows)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="区域市场数据维护")
+    arg_parser.add_argument("command", choices=["rebuild"])
+    args = arg_parser.parse_args()
+
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        if args.command == "rebuild":
+            count = rebuild(db)
+            print(f"已重建 {count} 个地区的市场数据")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
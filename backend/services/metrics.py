@@ -0,0 +1,247 @@
+"""
+请求阶段耗时与调用结果指标：进程内计数，/metrics 以Prometheus文本格式输出
+
+记录只是字典上的加法（单事件循环，无需加锁），格式化只在抓取时进行。
+多进程部署时各worker定期上报 snapshot()，抓取时合计后再格式化（见 services/shared_state.py）。
+请求开启Server-Timing时，stage()同时把各阶段耗时记到当前请求上，由中间件写进响应头。
+"""
+
+import bisect
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.log import TRACE_HEADER
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒；覆盖从微秒级的prompt构建到数十秒的模型调用
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 45.0, 90.0)
+
+# 当前请求的阶段耗时列表 [(阶段, 秒)]，未开启Server-Timing时为None
+_timings_var: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("server_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _key(values: Iterable[Any]) -> str:
+    """标签值元组 -> 快照中的键（JSON，可跨进程传递）"""
+    return json.dumps([str(value) for value in values], ensure_ascii=False)
+
+
+class Counter:
+    """单调递增计数"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "type": "counter",
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "samples": {_key(key): value for key, value in self._values.items()},
+        }
+
+
+class Histogram:
+    """固定分桶的耗时分布（秒）"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数（非累计，最后一格为+Inf）, 总和, 次数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, seconds: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        series[1] += seconds
+        series[2] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "type": "histogram",
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "samples": {_key(key): [list(counts), total, count] for key, (counts, total, count) in self._series.items()},
+        }
+
+    def render(self, samples: Dict[str, list]) -> Iterable[str]:
+        for key, (counts, total, count) in sorted(samples.items()):
+            values = json.loads(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {count}"
+
+
+class Registry:
+    """
+    指标注册表
+
+    除了直接记录的计数和分布，还可以注册采集函数：抓取时调用，产出 (名称, 类型, 说明, [(标签字典, 值)])，
+    用于输出队列长度、缓存命中数这类各组件已有的状态，类型为 gauge 或 counter
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable):
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """当前进程所有指标的取值：{名称: {type, help, labelnames, samples: {标签值键: 值}}}，可JSON序列化"""
+        result = {metric.name: metric.snapshot() for metric in self._metrics}
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                result[name] = {
+                    "type": metric_type,
+                    "help": help_text,
+                    "labelnames": list(samples[0][0]) if samples else [],
+                    "samples": {_key(labels.values()): value for labels, value in samples},
+                }
+        return result
+
+    def render(self, snapshot: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        """格式化为Prometheus文本；snapshot 默认为当前进程的取值，也可以是多个进程合计后的快照"""
+        histograms = {metric.name: metric for metric in self._metrics if isinstance(metric, Histogram)}
+        lines: List[str] = []
+        for name, metric in (self.snapshot() if snapshot is None else snapshot).items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            if name in histograms:
+                lines.extend(histograms[name].render(metric["samples"]))
+                continue
+            for key, value in sorted(metric["samples"].items()):
+                lines.append(f"{name}{_labels(metric['labelnames'], json.loads(key))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rent_stage_duration_seconds", "谈判请求各阶段耗时", ["stage"]
+)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "rent_llm_call_duration_seconds", "成功的模型调用耗时（含并发排队）", ["model", "mode"]
+)
+LLM_ERRORS = REGISTRY.counter(
+    "rent_llm_errors_total", "模型调用失败次数，按模型和异常类型", ["model", "error"]
+)
+PARSE_RESULTS = REGISTRY.counter(
+    "rent_parse_results_total", "模型响应解析结果：clean 直接解析，repaired 修复后解析，text 降级为文本提取", ["outcome"]
+)
+PARSE_REPAIRS = REGISTRY.counter(
+    "rent_parse_repairs_total", "JSON修复次数，按修复类型", ["repair"]
+)
+PRICE_BOUNDED = REGISTRY.counter(
+    "rent_price_bounded_total", "模型建议价超出合理区间被修正的次数：above_asking 高于报价，below_floor 低于定价模型下限", ["direction"]
+)
+SEMANTIC_CACHE_RESULTS = REGISTRY.counter(
+    "rent_semantic_cache_total", "语义缓存查询结果：hit 复用相似请求的建议，miss 未达到相似度阈值", ["outcome"]
+)
+FALLBACK_ADVICE = REGISTRY.counter(
+    "rent_fallback_advice_total", "返回兜底建议的次数：error 调用或解析失败，shed 被准入削减，packed 打包调用中缺失的房源", ["reason"]
+)
+
+
+@contextmanager
+def stage(name: str):
+    """记录一个阶段的耗时；当前请求开启Server-Timing时同时计入响应头"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _timings_var.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+class ServerTimingMiddleware:
+    """
+    在响应头中返回本次请求各阶段耗时（Server-Timing），浏览器开发者工具可直接展示
+
+    SERVER_TIMING_ENABLED=true 时对所有请求开启，否则只对带有追踪请求头的请求开启。
+    流式响应的响应头先于生成过程发出，只包含此前完成的阶段
+    """
+
+    def __init__(self, app, enabled: Optional[bool] = None):
+        self.app = app
+        self.enabled = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true" if enabled is None else enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not self.enabled:
+            headers = dict(scope.get("headers") or [])
+            if headers.get(TRACE_HEADER.encode(), b"").decode("latin-1").lower() not in ("1", "true", "yes"):
+                await self.app(scope, receive, send)
+                return
+
+        started = time.perf_counter()
+        timings: List[Tuple[str, float]] = []
+        token = _timings_var.set(timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                entries = [f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in timings]
+                entries.append(f"total;dur={(time.perf_counter() - started) * 1000:.2f}")
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", ", ".join(entries).encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings_var.reset(token)
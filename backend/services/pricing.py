@@ -0,0 +1,371 @@
+"""
+本地定价模型：用历史会话与成交反馈拟合的线性模型，微秒级给出建议价和成功率
+
+- 可达折让率（(报价 - 成交价) / 报价）：岭回归，训练样本为有成交价的反馈
+- 成功率：带L2正则的逻辑回归（IRLS），success=1、partial=0.5、failed=0
+
+特征为目标砍价幅度、面积、房型、房东类型、紧急程度和城市等级。拟合用NumPy向量化完成，
+在后台线程中定期重新拟合；预测只做一次系数查表求和，不依赖NumPy。
+模型用于三处：模型调用失败时的兜底建议、流式请求在模型返回前的即时预估、模型建议价的合理区间校验。
+
+    python -m services.pricing fit    # 拟合并输出样本数与误差
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, close_db
+from models import NegotiationSession, UserFeedback
+from services.location import parse_location
+
+logger = logging.getLogger(__name__)
+
+FIRST_TIER_CITIES = ("北京", "上海", "广州", "深圳")
+NEW_FIRST_TIER_CITIES = ("成都", "杭州", "重庆", "武汉", "西安", "苏州", "天津", "南京", "长沙", "郑州",
+                         "东莞", "青岛", "沈阳", "宁波", "昆明", "合肥", "佛山")
+
+NUMERIC_FEATURES = ("gap", "gap_sq", "log_area", "area_missing")
+CATEGORICAL_FEATURES = ("property_type", "landlord_type", "urgency", "tier")
+OTHER = "其他"
+
+OUTCOME_LABELS = {"success": 1.0, "partial": 0.5, "failed": 0.0}
+
+# 折让率的取值范围：成交价高于报价（负折让）或腰斩以上的反馈视为异常值截断
+MIN_DISCOUNT = -0.1
+MAX_DISCOUNT = 0.5
+
+
+def city_tier(city: Optional[str]) -> str:
+    """城市等级：1 一线、2 新一线、3 其他城市、0 无法解析"""
+    if not city:
+        return "0"
+    if city in FIRST_TIER_CITIES:
+        return "1"
+    if city in NEW_FIRST_TIER_CITIES:
+        return "2"
+    return "3"
+
+
+def _gap(current_price: Optional[float], user_budget: Optional[float]) -> float:
+    if not current_price or current_price <= 0 or user_budget is None:
+        return 0.0
+    return min(0.8, max(-0.5, (current_price - user_budget) / current_price))
+
+
+def _row_features(current_price, user_budget, area, property_type, landlord_type, urgency, city) -> Tuple[Dict[str, float], Dict[str, str]]:
+    gap = _gap(current_price, user_budget)
+    numeric = {
+        "gap": gap,
+        "gap_sq": gap * gap,
+        "log_area": math.log(area) if area and area > 0 else math.nan,
+        "area_missing": 0.0 if area and area > 0 else 1.0,
+    }
+    categorical = {
+        "property_type": property_type or OTHER,
+        "landlord_type": landlord_type or OTHER,
+        "urgency": (urgency or "normal").strip().lower(),
+        "tier": city_tier(city),
+    }
+    return numeric, categorical
+
+
+class Estimate(NamedTuple):
+    suggested_price: int
+    success_probability: float
+    discount: float
+    # 建议价的合理区间 [floor, ceiling]
+    floor: int
+    ceiling: int
+
+
+class _LinearModel:
+    """标准化数值特征 + 独热类别特征的线性模型；预测为截距加系数查表求和"""
+
+    def __init__(self, intercept: float, numeric: Dict[str, Tuple[float, float, float]],
+                 categorical: Dict[str, Dict[str, float]]):
+        self.intercept = intercept
+        # 特征名 -> (均值, 标准差, 系数)
+        self.numeric = numeric
+        # 特征名 -> {取值: 系数}，未见过的取值按"其他"
+        self.categorical = categorical
+
+    def score(self, numeric: Dict[str, float], categorical: Dict[str, str]) -> float:
+        z = self.intercept
+        for name, (mean, std, weight) in self.numeric.items():
+            value = numeric[name]
+            if math.isnan(value):
+                # 缺失值按均值填充，贡献为0
+                continue
+            z += (value - mean) / std * weight
+        for name, weights in self.categorical.items():
+            value = categorical[name]
+            z += weights.get(value, weights.get(OTHER, 0.0))
+        return z
+
+
+class _Design:
+    """把训练行编码为设计矩阵，并记录还原系数所需的列信息"""
+
+    def __init__(self, rows: Sequence[Tuple[Dict[str, float], Dict[str, str]]], min_category_count: int):
+        numeric = np.array([[row[0][name] for name in NUMERIC_FEATURES] for row in rows], dtype=float)
+        # 缺失值用列均值填充（面积缺失另有指示列）
+        means = np.nanmean(numeric, axis=0)
+        means = np.where(np.isnan(means), 0.0, means)
+        numeric = np.where(np.isnan(numeric), means, numeric)
+        stds = numeric.std(axis=0)
+        stds = np.where(stds > 1e-9, stds, 1.0)
+        self.means, self.stds = means, stds
+
+        columns = [np.ones(len(rows)), *((numeric - means) / stds).T]
+        self.categories: Dict[str, List[str]] = {}
+        for name in CATEGORICAL_FEATURES:
+            values = np.array([row[1][name] for row in rows])
+            levels, counts = np.unique(values, return_counts=True)
+            kept = [level for level, count in zip(levels.tolist(), counts.tolist()) if count >= min_category_count and level != OTHER]
+            self.categories[name] = kept + [OTHER]
+            mapped = np.where(np.isin(values, kept), values, OTHER)
+            columns.extend((mapped == level).astype(float) for level in self.categories[name])
+        self.matrix = np.column_stack(columns)
+
+    def model(self, weights: np.ndarray) -> _LinearModel:
+        numeric = {
+            name: (float(self.means[i]), float(self.stds[i]), float(weights[1 + i]))
+            for i, name in enumerate(NUMERIC_FEATURES)
+        }
+        categorical = {}
+        offset = 1 + len(NUMERIC_FEATURES)
+        for name in CATEGORICAL_FEATURES:
+            levels = self.categories[name]
+            categorical[name] = {level: float(weights[offset + j]) for j, level in enumerate(levels)}
+            offset += len(levels)
+        return _LinearModel(float(weights[0]), numeric, categorical)
+
+
+def _penalty(size: int, l2: float) -> np.ndarray:
+    penalty = np.full(size, l2)
+    penalty[0] = 0.0  # 截距不加正则
+    return np.diag(penalty)
+
+
+def fit_ridge(x: np.ndarray, y: np.ndarray, l2: float = 1.0) -> np.ndarray:
+    return np.linalg.solve(x.T @ x + _penalty(x.shape[1], l2), x.T @ y)
+
+
+def fit_logistic(x: np.ndarray, y: np.ndarray, l2: float = 1.0, iterations: int = 25) -> np.ndarray:
+    """IRLS（牛顿法）拟合逻辑回归；y可以是0~1之间的软标签"""
+    weights = np.zeros(x.shape[1])
+    penalty = _penalty(x.shape[1], l2)
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-np.clip(x @ weights, -30, 30)))
+        gradient = x.T @ (p - y) + penalty @ weights
+        hessian = (x.T * (p * (1 - p))) @ x + penalty
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return weights
+
+
+class PricingModel:
+    """一次拟合的结果"""
+
+    def __init__(self, discount: _LinearModel, success: _LinearModel, residual_std: float, stats: Dict[str, Any]):
+        self.discount = discount
+        self.success = success
+        self.residual_std = residual_std
+        self.stats = stats
+
+    @classmethod
+    def fit(cls, rows: Sequence[Tuple], l2: float = 1.0, min_category_count: int = 20) -> "PricingModel":
+        """
+        rows 中每项为 (报价, 目标价, 面积, 房型, 房东类型, 紧急程度, 城市, 反馈结果, 成交价)
+
+        样本不足时抛出ValueError
+        """
+        encoded, labels, discounts, deal_mask = [], [], [], []
+        for current_price, user_budget, area, property_type, landlord_type, urgency, city, outcome, actual_price in rows:
+            label = OUTCOME_LABELS.get(outcome)
+            if label is None or not current_price or current_price <= 0:
+                continue
+            encoded.append(_row_features(current_price, user_budget, area, property_type, landlord_type, urgency, city))
+            labels.append(label)
+            deal = actual_price is not None and actual_price > 0 and label > 0
+            deal_mask.append(deal)
+            discounts.append((current_price - actual_price) / current_price if deal else 0.0)
+        deal_mask = np.array(deal_mask, dtype=bool)
+        if len(encoded) < 2 or deal_mask.sum() < 2:
+            raise ValueError(f"反馈样本不足（{len(encoded)} 条反馈，{int(deal_mask.sum())} 条成交价）")
+
+        design = _Design(encoded, min_category_count)
+        success_weights = fit_logistic(design.matrix, np.array(labels), l2)
+
+        deal_x = design.matrix[deal_mask]
+        deal_y = np.clip(np.array(discounts)[deal_mask], MIN_DISCOUNT, MAX_DISCOUNT)
+        discount_weights = fit_ridge(deal_x, deal_y, l2)
+        residuals = deal_y - deal_x @ discount_weights
+
+        stats = {
+            "feedback": len(encoded),
+            "deals": int(deal_mask.sum()),
+            "discount_mae": round(float(np.abs(residuals).mean()), 4),
+            "mean_discount": round(float(deal_y.mean()), 4),
+            "success_rate": round(float(np.mean(labels)), 4),
+        }
+        return cls(design.model(discount_weights), design.model(success_weights), float(residuals.std()), stats)
+
+    def estimate(self, property_info: Dict[str, Any], user_budget: int, urgency: Optional[str] = None,
+                 bound_sigmas: float = 3.0) -> Optional[Estimate]:
+        current_price = property_info.get("current_price")
+        if not current_price or current_price <= 0:
+            return None
+        numeric, categorical = _row_features(
+            current_price, user_budget, property_info.get("area"), property_info.get("property_type"),
+            property_info.get("landlord_type"), urgency, parse_location(property_info.get("location")).city
+        )
+        discount = min(MAX_DISCOUNT, max(0.0, self.discount.score(numeric, categorical)))
+        probability = 1 / (1 + math.exp(-max(-30.0, min(30.0, self.success.score(numeric, categorical)))))
+        floor_discount = min(MAX_DISCOUNT, discount + bound_sigmas * self.residual_std)
+        return Estimate(
+            suggested_price=int(round(current_price * (1 - discount) / 10) * 10),
+            success_probability=round(min(0.9, max(0.1, probability)), 2),
+            discount=round(discount, 4),
+            floor=int(current_price * (1 - floor_discount)),
+            ceiling=int(current_price),
+        )
+
+
+async def load_training_rows(max_rows: int) -> List[Tuple]:
+    """最近的 max_rows 条反馈及其会话特征"""
+    stmt = (
+        select(
+            NegotiationSession.current_price, NegotiationSession.user_budget, NegotiationSession.area,
+            NegotiationSession.property_type, NegotiationSession.landlord_type, NegotiationSession.urgency,
+            NegotiationSession.city, UserFeedback.success, UserFeedback.actual_price,
+        )
+        .join(NegotiationSession, NegotiationSession.id == UserFeedback.session_id)
+        .order_by(UserFeedback.id.desc())
+        .limit(max_rows)
+    )
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(stmt)).all()
+
+
+class PricingEngine:
+    """
+    持有当前定价模型并定期重新拟合
+
+    - min_samples：有成交价的反馈少于该数量时不启用模型（沿用按价差分档的兜底规则）
+    - refresh_seconds：重新拟合的间隔
+    - max_rows：拟合使用的最近反馈条数上限
+    - bound_sigmas：合理区间下限为预测折让加上该倍数的残差标准差
+    """
+
+    def __init__(self, enabled: bool = True, min_samples: int = 50, refresh_seconds: float = 3600,
+                 max_rows: int = 200000, bound_sigmas: float = 3.0):
+        self.enabled = enabled
+        self.min_samples = min_samples
+        self.refresh_seconds = refresh_seconds
+        self.max_rows = max_rows
+        self.bound_sigmas = bound_sigmas
+        self.model: Optional[PricingModel] = None
+        self.fitted_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "PricingEngine":
+        return cls(
+            enabled=os.getenv("PRICING_MODEL_ENABLED", "true").lower() == "true",
+            min_samples=int(os.getenv("PRICING_MIN_SAMPLES", "50")),
+            refresh_seconds=float(os.getenv("PRICING_REFRESH_SECONDS", "3600")),
+            max_rows=int(os.getenv("PRICING_MAX_ROWS", "200000")),
+            bound_sigmas=float(os.getenv("PRICING_BOUND_SIGMAS", "3")),
+        )
+
+    def estimate(self, property_info: Dict[str, Any], user_budget: int, urgency: Optional[str] = None) -> Optional[Estimate]:
+        """模型未就绪时返回None"""
+        if self.model is None:
+            return None
+        return self.model.estimate(property_info, user_budget, urgency, self.bound_sigmas)
+
+    async def refresh(self) -> bool:
+        """读取反馈并在后台线程中拟合；样本不足或失败时保留原模型"""
+        if not self.enabled:
+            return False
+        started = time.perf_counter()
+        try:
+            rows = await load_training_rows(self.max_rows)
+            model = await asyncio.to_thread(PricingModel.fit, rows)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning("定价模型拟合失败", extra={"error": str(e)})
+            return False
+        if model.stats["deals"] < self.min_samples:
+            self.last_error = f"成交样本不足（{model.stats['deals']} < {self.min_samples}）"
+            logger.info("定价模型样本不足，暂不启用", extra={"deals": model.stats["deals"], "min_samples": self.min_samples})
+            return False
+        self.model = model
+        self.fitted_at = datetime.now()
+        self.last_error = None
+        logger.info("定价模型已更新", extra={**model.stats, "seconds": round(time.perf_counter() - started, 3)})
+        return True
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ready": self.model is not None,
+            "fitted_at": self.fitted_at.isoformat(timespec="seconds") if self.fitted_at else None,
+            "residual_std": round(self.model.residual_std, 4) if self.model else None,
+            **(self.model.stats if self.model else {}),
+            "last_error": self.last_error,
+        }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="定价模型维护")
+    arg_parser.add_argument("command", choices=["fit"])
+    arg_parser.add_argument("--max-rows", type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    async def load():
+        try:
+            return await load_training_rows(args.max_rows)
+        finally:
+            await close_db()
+
+    rows = asyncio.run(load())
+    started = time.perf_counter()
+    model = PricingModel.fit(rows)
+    print(f"拟合完成，耗时 {time.perf_counter() - started:.2f}s: {model.stats}，残差标准差 {model.residual_std:.4f}")
+
+
+if __name__ == "__main__":
+    main()
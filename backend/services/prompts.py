@@ -0,0 +1,124 @@
+"""
+谈判提示词：完整版（每次请求展开全部框架文本）、精简版（静态系统指令 + 最小请求数据），
+以及批量请求把多套房源打包进一次调用的打包版
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+PROMPT_MODE_FULL = "full"
+PROMPT_MODE_COMPACT = "compact"
+PROMPT_MODES = (PROMPT_MODE_FULL, PROMPT_MODE_COMPACT)
+# 批量请求打包调用时记录的提示词模式（不可由请求单独指定）
+PROMPT_MODE_PACKED = "packed"
+
+# additional_info 中 "标签：内容" 形式的字段，按 "；" 分隔
+ADDITIONAL_INFO_LABELS = {
+    "位置：": "city",
+    "同类房源价格：": "similar_properties",
+    "房屋优势：": "property_advantages",
+    "房屋劣势：": "property_disadvantages",
+    "租客身份：": "tenant_status",
+    "租住历史：": "rental_history",
+    "个人优势：": "personal_advantages",
+    "沟通方式：": "communication_preference",
+}
+
+_EXPERT = "你是中国顶级的租房谈判专家，有15年实战经验。"
+
+_ANALYSIS = """按4层框架系统分析，每层都要深入，不能跳过：
+1. 基础框架：价格差距在该城市是否现实；房东类型的决策模式
+2. 市场武器：用同类房源价格、房屋优劣势制定砍价依据；缺乏对比数据时必须强调收集市场信息
+3. 关系筹码：租客身份的核心优势；续租老租客要量化省心、稳定、避免空置的经济价值，与新租客策略完全不同
+4. 执行优化：结合沟通方式和紧急程度给出话术与时机
+另需给出房东接受/还价/拒绝三种反应的应对方案；价格差距>15%时提供分步骤砍价方案。"""
+
+_ADVICE_FIELDS = """{"suggested_price": 建议价格(整数),
+ "negotiation_strategy": "分【基础策略】【市场武器】【关系筹码】【执行优化】四段，至少400字",
+ "talking_points": ["开场信任建立：具体话术", "市场对比引入：具体话术", "关系优势强化：具体话术", "价格锚定成交：围绕目标价格的具体话术", "异议应对预案：房东拒绝时的具体话术"],
+ "risk_assessment": "1.最可能的3个阻力点 2.各自应对策略 3.谈判破裂信号 4.底线策略",
+ "success_probability": 0.1到0.9之间的数字,
+ "market_insights": "该城市该价位的供需、房东出租压力、季节性时机、竞品对比、租客议价空间，以及基于沟通方式的成功率提升建议"}"""
+
+# 精简模式的静态系统指令：与请求无关，模块加载时构建一次，每次请求逐字节相同
+COMPACT_SYSTEM_INSTRUCTION = (
+    _EXPERT + "用户消息是一个JSON，包含本次案例的已知信息（缺失的字段表示未提供）。\n"
+    + _ANALYSIS + "\n\n只输出一个严格的JSON对象，字段如下：\n" + _ADVICE_FIELDS
+)
+
+# 打包模式：一次调用评估多套房源，按输入顺序返回建议数组
+PACKED_SYSTEM_INSTRUCTION = (
+    _EXPERT + "用户消息是一个JSON数组，每个元素是一套独立房源的案例（index为序号，缺失的字段表示未提供）。"
+    "每个案例单独分析，互不参考。\n"
+    + _ANALYSIS + "\n\n只输出一个严格的JSON数组，按输入顺序每个案例一个对象，对象中带上对应的index，其余字段如下：\n"
+    + _ADVICE_FIELDS
+)
+
+
+def default_prompt_mode() -> str:
+    mode = os.getenv("PROMPT_MODE", PROMPT_MODE_FULL).lower()
+    return mode if mode in PROMPT_MODES else PROMPT_MODE_FULL
+
+
+def parse_additional_info(additional_info: Optional[str]) -> Dict[str, str]:
+    """解析additional_info中的关键信息，未出现的字段为空字符串"""
+    fields = {name: "" for name in ADDITIONAL_INFO_LABELS.values()}
+    if additional_info:
+        for info in additional_info.split('；'):
+            for label, name in ADDITIONAL_INFO_LABELS.items():
+                if label in info:
+                    fields[name] = info.replace(label, '').strip()
+                    break
+    return fields
+
+
+def _case_payload(property_info: Dict[str, Any], user_budget: int, urgency: str,
+                  additional_info: Optional[str], comparables: Optional[str] = None) -> Dict[str, Union[str, int]]:
+    """单个案例的请求数据，只携带非空字段；用户未提供同类房源价格时使用检索到的comparables"""
+    current_price = property_info.get('current_price', 0)
+    price_gap = current_price - user_budget
+    payload: Dict[str, Union[str, int]] = {
+        "当前报价": current_price,
+        "目标价格": user_budget,
+        "价格差距": f"{price_gap}元（{(price_gap / current_price * 100) if current_price > 0 else 0:.1f}%）",
+        "紧急程度": urgency,
+    }
+    optional = {
+        "房屋信息": property_info.get('description'),
+        "房东类型": property_info.get('landlord_type'),
+    }
+    labels = {name: label.rstrip('：') for label, name in ADDITIONAL_INFO_LABELS.items()}
+    parsed = parse_additional_info(additional_info)
+    optional.update({labels[name]: value for name, value in parsed.items()})
+    if comparables and not parsed["similar_properties"]:
+        optional[labels["similar_properties"]] = comparables
+    if additional_info and not any(parsed.values()):
+        # 非标签格式的补充信息原样带上
+        optional["补充信息"] = additional_info
+    payload.update({key: value for key, value in optional.items() if value})
+    return payload
+
+
+def build_compact_contents(property_info: Dict[str, Any], user_budget: int, urgency: str,
+                           additional_info: Optional[str], comparables: Optional[str] = None) -> List[str]:
+    """
+    精简模式的请求内容：[静态系统指令, 本次请求数据JSON]
+
+    只携带非空字段，不重复展开占位符
+    """
+    payload = _case_payload(property_info, user_budget, urgency, additional_info, comparables)
+    return [COMPACT_SYSTEM_INSTRUCTION, json.dumps(payload, ensure_ascii=False, separators=(",", ":"))]
+
+
+def build_packed_contents(cases: List[Tuple[Dict[str, Any], int, str, Optional[str]]],
+                          comparables: Optional[List[Optional[str]]] = None) -> List[str]:
+    """
+    打包模式的请求内容：[静态系统指令, 案例数组JSON]
+
+    cases 中每项为 (property_info, user_budget, urgency, additional_info)，index从0开始；
+    comparables 为与cases一一对应的同类房源文本
+    """
+    comparables = comparables or [None] * len(cases)
+    payload = [{"index": index, **_case_payload(*case, comparables[index])} for index, case in enumerate(cases)]
+    return [PACKED_SYSTEM_INSTRUCTION, json.dumps(payload, ensure_ascii=False, separators=(",", ":"))]
@@ -0,0 +1,426 @@
+"""
+语义缓存：相似请求复用历史会话中模型给出的建议，不再调用模型
+
+精确缓存按请求内容哈希，房源描述措辞稍有不同就无法命中。这里在本地把请求向量化：
+位置、房源描述、补充信息、房东类型的字符1-2元组哈希到固定维度（不依赖外部向量服务），
+再加上报价、预算差距、面积三个数值特征。只有同一区县（无法解析时为同一位置写法）、同一房型、
+同一紧急程度、同一模型的请求才会比较，相似度 = 文本余弦相似度 × 数值接近度，达到阈值即命中。
+
+命中的建议按新请求调整后返回：建议价保持在报价与预算之间的相对位置，
+正文中出现的旧报价、预算、建议价替换为新值。
+
+启动时在后台线程读取最近的模型建议会话建立索引，之后每次模型调用成功后追加。
+
+    python -m services.semantic_cache report --thresholds 0.8,0.85,0.9,0.95   # 按历史会话回放，评估各阈值的命中率
+"""
+
+import argparse
+import asyncio
+import copy
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import NegotiationSession
+from services.advice_cache import normalize_request_text
+from services.location import parse_location, region_keys
+from services.metrics import SEMANTIC_CACHE_RESULTS
+
+logger = logging.getLogger(__name__)
+
+# 文本哈希向量维度与字符n元组长度；标点和空白不参与
+TEXT_DIM = 256
+NGRAMS = (1, 2)
+_SEPARATORS = re.compile(r"[\W_]+")
+# 每个请求都带的常量特征：两边都没有文本时相似度为1，只有一边有文本时随文本长度降低
+BIAS_TOKEN = "__bias__"
+# 参与向量化的文本字段及权重；位置已用于分桶，权重较低
+TEXT_FIELDS = (("location", 0.5), ("description", 1.0), ("additional_info", 1.0), ("landlord_type", 1.0))
+
+# 数值接近度 = exp(-0.5 * Σ(差值 / 容差)^2)：报价对数差、预算差距（(报价-预算)/报价）之差、面积对数差
+PRICE_TOLERANCE = 0.05
+GAP_TOLERANCE = 0.03
+AREA_TOLERANCE = 0.1
+# 只有一边填写了面积时按此计入
+MISSING_AREA_TERM = 1.0
+
+ADVICE_FIELDS = ("suggested_price", "negotiation_strategy", "talking_points", "risk_assessment",
+                 "success_probability", "market_insights", "model_used")
+
+
+def _ngrams(text: str) -> List[str]:
+    text = _SEPARATORS.sub("", text)
+    return [text[i:i + n] for n in NGRAMS for i in range(len(text) - n + 1)]
+
+
+def text_vector(fields: Dict[str, Optional[str]]) -> np.ndarray:
+    """字段文本的哈希n元组向量（L2归一化）；crc32在进程间稳定，加载的历史会话与新请求可直接比较"""
+    vector = np.zeros(TEXT_DIM, dtype=np.float32)
+    vector[zlib.crc32(BIAS_TOKEN.encode("utf-8")) % TEXT_DIM] += 1.0
+    for name, weight in TEXT_FIELDS:
+        value = fields.get(name)
+        if not value:
+            continue
+        for gram in _ngrams(value):
+            vector[zlib.crc32(f"{name}|{gram}".encode("utf-8")) % TEXT_DIM] += weight
+    return vector / np.linalg.norm(vector)
+
+
+class _Request(NamedTuple):
+    """向量化后的请求"""
+    bucket: Tuple[str, str, str, str]
+    vector: np.ndarray
+    log_price: float
+    gap: float
+    log_area: float
+    current_price: int
+    user_budget: int
+
+
+def _vectorize(location: Optional[str], province: Optional[str], city: Optional[str], district: Optional[str],
+               property_type: Optional[str], area: Optional[int], current_price: int, user_budget: int,
+               urgency: Optional[str], model_name: Optional[str], description: Optional[str],
+               additional_info: Optional[str], landlord_type: Optional[str]) -> Optional[_Request]:
+    if not property_type or not current_price or current_price <= 0 or user_budget is None:
+        return None
+    keys = region_keys(location, province, city, district)
+    bucket = (keys[-1] if keys else "", property_type, (urgency or "normal").strip().lower(), model_name or "")
+    vector = text_vector({
+        "location": normalize_request_text(location),
+        "description": normalize_request_text(description),
+        "additional_info": normalize_request_text(additional_info),
+        "landlord_type": normalize_request_text(landlord_type),
+    })
+    return _Request(
+        bucket=bucket,
+        vector=vector,
+        log_price=math.log(current_price),
+        gap=(current_price - user_budget) / current_price,
+        log_area=math.log(area) if area and area > 0 else math.nan,
+        current_price=current_price,
+        user_budget=user_budget,
+    )
+
+
+def adapt_advice(advice: Dict[str, Any], source_price: int, source_budget: int, current_price: int, user_budget: int) -> Dict[str, Any]:
+    """
+    把相似请求的建议调整到新请求：建议价在报价与预算之间的相对位置不变（报价等于预算时按报价等比例），
+    取整到10元；正文中原报价、预算、建议价的数字替换为新值
+    """
+    advice = copy.deepcopy(advice)
+    suggested = advice.get("suggested_price") or 0
+    if source_price > source_budget and current_price > user_budget:
+        position = (source_price - suggested) / (source_price - source_budget)
+        adapted = current_price - position * (current_price - user_budget)
+    else:
+        adapted = suggested * current_price / source_price
+    adapted = int(round(adapted / 10) * 10) if suggested else 0
+    advice["suggested_price"] = adapted
+
+    replacements = {str(old): str(new) for old, new in ((source_price, current_price), (source_budget, user_budget), (suggested, adapted))
+                    if old and old != new}
+    if replacements:
+        # 一次替换，避免新值被后续规则再次替换；前后不是数字才替换
+        pattern = re.compile(r"(?<!\d)(" + "|".join(map(re.escape, sorted(replacements, key=len, reverse=True))) + r")(?!\d)")
+        substitute = lambda text: pattern.sub(lambda match: replacements[match.group(1)], text)  # noqa: E731
+        for field in ("negotiation_strategy", "risk_assessment", "market_insights"):
+            if isinstance(advice.get(field), str):
+                advice[field] = substitute(advice[field])
+        if isinstance(advice.get("talking_points"), list):
+            advice["talking_points"] = [substitute(point) if isinstance(point, str) else point for point in advice["talking_points"]]
+    return advice
+
+
+class _Bucket:
+    """同一分桶的历史建议：容量满后覆盖最早写入的（环形缓冲），容量不足时倍增直到上限"""
+
+    __slots__ = ("vectors", "log_price", "gap", "log_area", "created", "payloads", "size", "next", "max_size")
+
+    def __init__(self, max_size: int, capacity: int = 8):
+        capacity = min(capacity, max_size)
+        self.vectors = np.empty((capacity, TEXT_DIM), dtype=np.float32)
+        self.log_price = np.empty(capacity, dtype=np.float64)
+        self.gap = np.empty(capacity, dtype=np.float64)
+        self.log_area = np.empty(capacity, dtype=np.float64)
+        self.created = np.empty(capacity, dtype=np.float64)
+        # (会话ID, 报价, 预算, 建议)
+        self.payloads: List[Optional[Tuple[Optional[int], int, int, Dict[str, Any]]]] = [None] * capacity
+        self.size = 0
+        self.next = 0
+        self.max_size = max_size
+
+    def add(self, request: _Request, created: float, payload):
+        if self.size == len(self.log_price) and self.size < self.max_size:
+            capacity = min(self.size * 2, self.max_size)
+            for name in ("vectors", "log_price", "gap", "log_area", "created"):
+                old = getattr(self, name)
+                grown = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                grown[:self.size] = old[:self.size]
+                setattr(self, name, grown)
+            self.payloads.extend([None] * (capacity - self.size))
+            self.next = self.size
+        i = self.next
+        self.vectors[i] = request.vector
+        self.log_price[i] = request.log_price
+        self.gap[i] = request.gap
+        self.log_area[i] = request.log_area
+        self.created[i] = created
+        self.payloads[i] = payload
+        self.size = min(self.size + 1, len(self.log_price))
+        self.next = (i + 1) % len(self.log_price)
+
+    def best(self, request: _Request, min_created: float, threshold: float) -> Tuple[float, Optional[int]]:
+        """相似度最高的未过期条目 (相似度, 行号)；数值接近度已低于threshold的行不计算文本相似度"""
+        n = self.size
+        terms = ((self.log_price[:n] - request.log_price) / PRICE_TOLERANCE) ** 2 + ((self.gap[:n] - request.gap) / GAP_TOLERANCE) ** 2
+        if math.isnan(request.log_area):
+            terms += np.where(np.isnan(self.log_area[:n]), 0.0, MISSING_AREA_TERM)
+        else:
+            area_terms = ((self.log_area[:n] - request.log_area) / AREA_TOLERANCE) ** 2
+            terms += np.where(np.isnan(area_terms), MISSING_AREA_TERM, area_terms)
+        numeric = np.exp(-0.5 * terms)
+        candidates = np.flatnonzero((numeric >= threshold) & (self.created[:n] >= min_created))
+        if not len(candidates):
+            return 0.0, None
+        similarity = numeric[candidates] * (self.vectors[candidates] @ request.vector)
+        best = int(np.argmax(similarity))
+        return float(similarity[best]), int(candidates[best])
+
+
+class SemanticCache:
+    """
+    相似请求的建议缓存
+
+    - threshold：相似度阈值，越高越保守
+    - ttl_seconds：只复用这段时间内的建议
+    - bucket_size：每个分桶保留的最近建议数
+    - max_load：启动时从数据库加载的最近会话数
+    """
+
+    def __init__(self, enabled: bool = False, threshold: float = 0.85, ttl_seconds: int = 604800,
+                 bucket_size: int = 500, max_load: int = 20000):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.bucket_size = bucket_size
+        self.max_load = max_load
+        self._buckets: Dict[Tuple[str, str, str, str], _Bucket] = {}
+        self.ready = False
+        # 加载期间追加的建议，加载完成后补入
+        self._pending: Optional[List[Tuple[_Request, float, Any]]] = None
+        self._task: Optional[asyncio.Task] = None
+        # hit_similarity：命中时相似度之和，用于计算平均命中相似度
+        self.counters = {"hits": 0, "misses": 0, "adapted": 0, "added": 0, "hit_similarity": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "SemanticCache":
+        return cls(
+            enabled=os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true",
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85")),
+            ttl_seconds=int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "604800")),
+            bucket_size=int(os.getenv("SEMANTIC_CACHE_BUCKET_SIZE", "500")),
+            max_load=int(os.getenv("SEMANTIC_CACHE_MAX_LOAD", "20000")),
+        )
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self.load())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    async def load(self):
+        """在后台线程中读取最近的模型建议会话建立索引，完成后替换当前索引并补入加载期间追加的建议"""
+        started = time.perf_counter()
+        self._pending = []
+        try:
+            rows = await asyncio.to_thread(load_rows, self.max_load, self.ttl_seconds)
+            buckets = await asyncio.to_thread(self._build, rows)
+        except Exception as e:
+            self._pending = None
+            logger.error("语义缓存加载失败", extra={"error": str(e)})
+            return
+        pending, self._pending = self._pending, None
+        self._buckets = buckets
+        for entry in pending:
+            self._add(*entry)
+        self.ready = True
+        logger.info("语义缓存已加载", extra={"sessions": len(rows), "buckets": len(self._buckets),
+                                        "seconds": round(time.perf_counter() - started, 2)})
+
+    def _build(self, rows: Sequence[Tuple[_Request, float, Any]]) -> Dict[Tuple[str, str, str, str], _Bucket]:
+        buckets: Dict[Tuple[str, str, str, str], _Bucket] = {}
+        for request, created, payload in rows:
+            bucket = buckets.get(request.bucket)
+            if bucket is None:
+                bucket = buckets[request.bucket] = _Bucket(self.bucket_size)
+            bucket.add(request, created, payload)
+        return buckets
+
+    def _add(self, request: _Request, created: float, payload):
+        bucket = self._buckets.get(request.bucket)
+        if bucket is None:
+            bucket = self._buckets[request.bucket] = _Bucket(self.bucket_size)
+        bucket.add(request, created, payload)
+
+    def add(self, property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str],
+            model_name: str, advice: Dict[str, Any], session_id: Optional[int] = None):
+        """追加一条模型生成的建议；与启动加载一致，按实际给出建议的模型分桶"""
+        if not self.enabled:
+            return
+        request = _request_from(property_info, user_budget, urgency, additional_info, advice.get("model_used") or model_name)
+        if request is None:
+            return
+        advice = {field: copy.deepcopy(advice.get(field)) for field in ADVICE_FIELDS}
+        entry = (request, time.time(), (session_id, request.current_price, request.user_budget, advice))
+        self._add(*entry)
+        if self._pending is not None:
+            self._pending.append(entry)
+        self.counters["added"] += 1
+
+    def lookup(self, property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str],
+               model_name: str) -> Optional[Dict[str, Any]]:
+        """相似度达到阈值时返回调整后的建议，否则返回None"""
+        if not self.enabled:
+            return None
+        request = _request_from(property_info, user_budget, urgency, additional_info, model_name)
+        bucket = self._buckets.get(request.bucket) if request is not None else None
+        similarity, row = (0.0, None) if bucket is None else bucket.best(request, time.time() - self.ttl_seconds, self.threshold)
+        if row is None or similarity < self.threshold:
+            self.counters["misses"] += 1
+            SEMANTIC_CACHE_RESULTS.inc(outcome="miss")
+            return None
+        session_id, source_price, source_budget, advice = bucket.payloads[row]
+        self.counters["hits"] += 1
+        SEMANTIC_CACHE_RESULTS.inc(outcome="hit")
+        self.counters["hit_similarity"] += similarity
+        if (source_price, source_budget) != (request.current_price, request.user_budget):
+            self.counters["adapted"] += 1
+        logger.info("命中语义缓存", extra={"model": model_name, "similarity": round(similarity, 4), "source_session_id": session_id})
+        return adapt_advice(advice, source_price, source_budget, request.current_price, request.user_budget)
+
+    def stats(self, counters: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """counters：多进程部署时所有worker合计的计数，默认为本进程的"""
+        counters = counters or self.counters
+        hits = counters["hits"]
+        lookups = hits + counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "threshold": self.threshold,
+            **{name: counters[name] for name in ("hits", "misses", "adapted", "added")},
+            "hit_rate": f"{(hits / lookups * 100) if lookups else 0:.1f}%",
+            "mean_hit_similarity": round(counters["hit_similarity"] / hits, 4) if hits else None,
+            "entries": sum(bucket.size for bucket in self._buckets.values()),
+            "buckets": len(self._buckets),
+        }
+
+
+def _request_from(property_info: Dict[str, Any], user_budget: int, urgency: str, additional_info: Optional[str],
+                  model_name: str) -> Optional[_Request]:
+    location = property_info.get("location")
+    parsed = parse_location(location)
+    return _vectorize(location, parsed.province, parsed.city, parsed.district, property_info.get("property_type"),
+                      property_info.get("area"), property_info.get("current_price"), user_budget, urgency, model_name,
+                      property_info.get("description"), additional_info, property_info.get("landlord_type"))
+
+
+def load_rows(max_rows: int, ttl_seconds: Optional[int] = None) -> List[Tuple[_Request, float, Any]]:
+    """
+    最近的至多max_rows个模型建议会话（prompt_mode非空，即本次实际调用了模型；缓存命中与兜底建议不计入），
+    按写入顺序返回 [(向量化请求, 写入时间, 载荷)]
+    """
+    columns = (NegotiationSession.id, NegotiationSession.location, NegotiationSession.province, NegotiationSession.city,
+               NegotiationSession.district, NegotiationSession.property_type, NegotiationSession.area,
+               NegotiationSession.current_price, NegotiationSession.user_budget, NegotiationSession.urgency,
+               NegotiationSession.model_used, NegotiationSession.description, NegotiationSession.additional_info,
+               NegotiationSession.landlord_type, NegotiationSession.created_at,
+               *(getattr(NegotiationSession, field) for field in ADVICE_FIELDS))
+    # 已归档的会话正文不在表中（见 services/archive.py）
+    query = select(*columns).where(NegotiationSession.prompt_mode.is_not(None), NegotiationSession.suggested_price.is_not(None),
+                                   NegotiationSession.archived_at.is_(None))
+    if ttl_seconds is not None:
+        query = query.where(NegotiationSession.created_at >= datetime.now() - timedelta(seconds=ttl_seconds))
+    with SessionLocal() as db:
+        result = db.execute(query.order_by(NegotiationSession.id.desc()).limit(max_rows)).all()
+
+    rows = []
+    for row in reversed(result):
+        (session_id, location, province, city, district, property_type, area, current_price, user_budget, urgency,
+         model_used, description, additional_info, landlord_type, created_at, *advice_values) = row
+        request = _vectorize(location, province, city, district, property_type, area, current_price, user_budget,
+                             urgency, model_used, description, additional_info, landlord_type)
+        if request is None:
+            continue
+        advice = dict(zip(ADVICE_FIELDS, advice_values))
+        advice["talking_points"] = advice["talking_points"] or []
+        created = created_at.timestamp() if created_at else time.time()
+        rows.append((request, created, (session_id, current_price, user_budget, advice)))
+    return rows
+
+
+def report(rows: Sequence[Tuple[_Request, float, Any]], thresholds: Sequence[float], bucket_size: int) -> List[Dict[str, Any]]:
+    """
+    按写入顺序回放历史会话：每个会话先以此前的会话为索引查找最相似的一条，再加入索引。
+    统计各阈值下的命中率，以及命中时调整后的建议价与该会话实际建议价的相对误差
+    """
+    cache = SemanticCache(enabled=True, bucket_size=bucket_size)
+    floor = min(thresholds)
+    best: List[Tuple[float, Optional[float]]] = []
+    for request, created, payload in rows:
+        bucket = cache._buckets.get(request.bucket)
+        if bucket is not None:
+            similarity, row = bucket.best(request, -math.inf, floor)
+            if row is not None:
+                _, source_price, source_budget, source_advice = bucket.payloads[row]
+                adapted = adapt_advice(source_advice, source_price, source_budget, request.current_price, request.user_budget)
+                actual = payload[3]["suggested_price"]
+                best.append((similarity, abs(adapted["suggested_price"] - actual) / request.current_price))
+            else:
+                best.append((0.0, None))
+        else:
+            best.append((0.0, None))
+        cache._add(request, created, payload)
+
+    results = []
+    for threshold in sorted(thresholds):
+        errors = sorted(error for similarity, error in best if similarity >= threshold and error is not None)
+        results.append({
+            "threshold": threshold,
+            "hit_rate": round(len(errors) / len(best), 4) if best else 0.0,
+            "hits": len(errors),
+            "median_price_error": round(errors[len(errors) // 2], 4) if errors else None,
+            "p90_price_error": round(errors[int(len(errors) * 0.9)], 4) if errors else None,
+        })
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="语义缓存维护")
+    arg_parser.add_argument("command", choices=["report"])
+    arg_parser.add_argument("--thresholds", default="0.8,0.85,0.9,0.95")
+    arg_parser.add_argument("--max-rows", type=int, default=20000)
+    arg_parser.add_argument("--bucket-size", type=int, default=500)
+    args = arg_parser.parse_args()
+
+    started = time.perf_counter()
+    rows = load_rows(args.max_rows)
+    print(f"已加载 {len(rows)} 个模型建议会话，耗时 {time.perf_counter() - started:.2f}s")
+    for result in report(rows, [float(value) for value in args.thresholds.split(",")], args.bucket_size):
+        print(f"阈值 {result['threshold']:.2f}: 命中率 {result['hit_rate'] * 100:.1f}%（{result['hits']}），"
+              f"建议价相对误差 中位数 {result['median_price_error']}，P90 {result['p90_price_error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+谈判会话的后写（write-behind）持久化
+
+请求路径只做两件事：从预留的ID段中同步分配 session_id，把写操作放进有界队列。
+后台任务按数量或时间攒批，同一会话的插入和建议更新合并成一行，
+每批在一个事务中提交（连同区域市场数据的累加）。关闭时排空队列。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import AsyncSessionLocal
+from models import IdSequence, NegotiationSession
+from services import market_data
+from services.metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_INSERT = "insert"
+_ADVICE = "advice"
+
+
+class IdBlockAllocator:
+    """
+    从 id_sequences 表按段预留ID，段内分配不访问数据库
+
+    预留用单条 UPDATE ... RETURNING 完成，多进程共享同一数据库时也不会重复；
+    进程重启时未用完的ID会被跳过（ID不连续，但保持递增唯一）
+    """
+
+    def __init__(self, name: str, block_size: int = 100):
+        self.name = name
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def next_id(self) -> int:
+        if self._next >= self._end:
+            async with self._lock:
+                if self._next >= self._end:
+                    self._next, self._end = await self._reserve()
+        allocated = self._next
+        self._next += 1
+        return allocated
+
+    async def _reserve(self):
+        """预留 [start, end) 一段ID"""
+        while True:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    update(IdSequence)
+                    .where(IdSequence.name == self.name)
+                    .values(next_value=IdSequence.next_value + self.block_size)
+                    .returning(IdSequence.next_value)
+                )
+                end = result.scalar_one_or_none()
+                if end is None:
+                    # 首次使用：从现有会话的最大ID之后开始
+                    start = (await db.scalar(select(func.max(NegotiationSession.id))) or 0) + 1
+                    end = start + self.block_size
+                    db.add(IdSequence(name=self.name, next_value=end))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    # 其他进程同时完成了初始化，重新预留
+                    continue
+                return end - self.block_size, end
+
+
+class SessionWriter:
+    """
+    会话写入队列
+
+    - queue_size：队列上限，满时请求等待（背压），不会无限堆积
+    - batch_size / flush_interval：攒够batch_size个操作或距第一个操作超过flush_interval秒即提交
+    - enabled=False 时每个操作立即在独立事务中写入
+    - on_insert：每批提交后以新插入的会话（字段字典列表）调用，用于维护内存索引
+    - on_commit：每批提交后以本批涉及的会话位置列表调用，用于更新数据版本（HTTP缓存的ETag）
+    """
+
+    def __init__(self, enabled: bool = True, queue_size: int = 1000, batch_size: int = 100,
+                 flush_interval: float = 0.05, id_block_size: int = 100):
+        self.enabled = enabled
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ids = IdBlockAllocator(NegotiationSession.__tablename__, id_block_size)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 尚未落库的会话ID -> 未完成的操作数
+        self._pending: Dict[int, int] = {}
+        self._written: Optional[asyncio.Condition] = None
+        self.counters = {"batches": 0, "operations": 0, "failed": 0}
+        self.on_insert: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+        self.on_commit: Optional[Callable[[List[Optional[str]]], None]] = None
+
+    @classmethod
+    def from_env(cls) -> "SessionWriter":
+        return cls(
+            enabled=os.getenv("SESSION_WRITE_BEHIND", "true").lower() == "true",
+            queue_size=int(os.getenv("SESSION_WRITE_QUEUE_SIZE", "1000")),
+            batch_size=int(os.getenv("SESSION_WRITE_BATCH_SIZE", "100")),
+            flush_interval=float(os.getenv("SESSION_WRITE_FLUSH_MS", "50")) / 1000,
+            id_block_size=int(os.getenv("SESSION_ID_BLOCK_SIZE", "100")),
+        )
+
+    def start(self):
+        if self._task is not None or not self.enabled:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._written = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """排空队列并停止后台任务"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def create(self, values: Dict[str, Any]) -> int:
+        """分配会话ID并排队插入，返回ID"""
+        session_id = await self.ids.next_id()
+        await self._submit({"kind": _INSERT, "id": session_id, "values": {**values, "id": session_id}})
+        return session_id
+
+    async def save_advice(self, session_id: int, values: Dict[str, Any], location: Optional[str], current_price: Optional[int]):
+        """排队更新会话的建议字段；location/current_price用于累加区域市场数据"""
+        await self._submit({"kind": _ADVICE, "id": session_id, "values": values,
+                            "location": location, "current_price": current_price})
+
+    async def wait_written(self, session_id: int):
+        """等待该会话之前排队的写操作落库（如提交反馈前需要读取会话）"""
+        if self._written is None or session_id not in self._pending:
+            return
+        async with self._written:
+            await self._written.wait_for(lambda: session_id not in self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **self.counters,
+        }
+
+    async def _submit(self, op: Dict[str, Any]):
+        if not self.enabled:
+            await self._write([op])
+            return
+        self.start()
+        self._pending[op["id"]] = self._pending.get(op["id"], 0) + 1
+        await self._queue.put(op)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            op = await self._queue.get()
+            if op is None:
+                break
+            batch = [op]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    op = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        op = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if op is None:
+                    stopping = True
+                    break
+                batch.append(op)
+            await self._flush(batch)
+
+        # 关闭：写完队列中剩余的操作
+        remaining_ops = []
+        while not self._queue.empty():
+            op = self._queue.get_nowait()
+            if op is not None:
+                remaining_ops.append(op)
+        for start in range(0, len(remaining_ops), self.batch_size):
+            await self._flush(remaining_ops[start:start + self.batch_size])
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        try:
+            await self._write(batch)
+        except Exception as e:
+            logger.error("会话批量写入失败，逐条重试", extra={"operations": len(batch), "error": str(e)})
+            for op in batch:
+                try:
+                    await self._write([op])
+                except Exception as op_error:
+                    self.counters["failed"] += 1
+                    logger.error("会话写入失败", extra={"session_id": op["id"], "kind": op["kind"], "error": str(op_error)})
+        finally:
+            self.counters["batches"] += 1
+            self.counters["operations"] += len(batch)
+            for op in batch:
+                count = self._pending.get(op["id"], 0) - 1
+                if count > 0:
+                    self._pending[op["id"]] = count
+                else:
+                    self._pending.pop(op["id"], None)
+            if self._written is not None:
+                async with self._written:
+                    self._written.notify_all()
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        """在一个事务中写入一批操作：同一会话的插入与建议更新合并为一次插入"""
+        inserts: Dict[int, Dict[str, Any]] = {}
+        updates: Dict[int, Dict[str, Any]] = {}
+        market_ops = []
+        for op in batch:
+            values = op["values"]
+            if op["kind"] == _INSERT:
+                inserts[op["id"]] = dict(values)
+                market_ops.append((market_data.record_session, values.get("location"), values.get("current_price")))
+            else:
+                if op["id"] in inserts:
+                    inserts[op["id"]].update(values)
+                else:
+                    updates.setdefault(op["id"], {"id": op["id"]}).update(values)
+                market_ops.append((market_data.record_advice, op["location"], op["current_price"], values.get("suggested_price")))
+
+        def record_market(sync_db):
+            for record, *args in market_ops:
+                record(sync_db, *args)
+
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            if inserts:
+                await db.execute(insert(NegotiationSession), list(inserts.values()))
+            if updates:
+                await db.execute(update(NegotiationSession), list(updates.values()))
+            await db.run_sync(record_market)
+            await db.commit()
+        # 后台批量提交不属于某个请求，只计入指标，不进入Server-Timing
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="db_write")
+        if inserts and self.on_insert is not None:
+            try:
+                self.on_insert(list(inserts.values()))
+            except Exception as e:
+                logger.error("会话插入回调失败", extra={"error": str(e)})
+        if self.on_commit is not None:
+            try:
+                self.on_commit([location for _, location, *_ in market_ops])
+            except Exception as e:
+                logger.error("会话提交回调失败", extra={"error": str(e)})
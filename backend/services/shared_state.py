@@ -0,0 +1,304 @@
+"""
+多进程部署（uvicorn --workers / gunicorn）时各worker共用的状态
+
+每个worker是独立的进程：限速令牌桶各算各的，实际调用量会变成配额的N倍；/metrics 和 /stats
+只反映恰好处理这次请求的worker。共享状态放在本机一个单独的SQLite文件（WAL）中：
+
+- 令牌桶：取令牌是一个 BEGIN IMMEDIATE 短事务（按时间补充、扣减、写回），所有worker共用一个桶
+- 计数：各worker每隔 flush_seconds 把本进程的指标和缓存计数整体写入自己的一行，同时读回其他worker的，
+  读取时把这份数据与本进程的实时数据逐项相加，请求处理中不访问SQLite
+- 数据版本：写入会话/反馈时递增，各worker定期读回，据此生成一致的ETag（见 services/http_cache.py）
+- 文件锁：建表/补列串行执行；归档这类只需一个进程做的后台任务由取得锁的worker负责
+
+所有SQLite操作都在一个专用线程中执行，不阻塞事件循环；文件被其他worker锁住时只等待
+busy_timeout_ms，超时即报错，调用方（如令牌桶）立即改用进程内的数据。
+
+建议缓存的持久层本来就在数据库中，各worker共用；内存LRU、语义缓存、同类房源索引仍是每个worker一份，
+其他worker新写入的会话要等本worker重启后才会进入索引。
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows没有flock，只支持单进程运行
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS worker_stats (
+    worker TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _add(a: Any, b: Any) -> Any:
+    if isinstance(a, dict) and isinstance(b, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = _add(merged[key], value) if key in merged else value
+        return merged
+    if isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        return [_add(x, y) for x, y in zip(a, b)]
+    if _is_number(a) and _is_number(b):
+        return a + b
+    return a
+
+
+def merge(values: List[Any]) -> Any:
+    """逐项合计多个worker的数据：数值相加，字典按键合并，等长列表逐个元素相加，其他（说明、开关等）取第一个"""
+    return functools.reduce(_add, values)
+
+
+class SharedState:
+    """
+    本机多进程共用的令牌桶、计数与数据版本
+
+    - enabled：默认在 WEB_CONCURRENCY > 1（uvicorn/gunicorn的worker数）时开启
+    - path：共享状态的SQLite文件，文件锁也放在同一目录
+    - flush_seconds：本进程计数的上报间隔
+    - stale_seconds：超过该时间未上报的worker（已退出）不再计入合计
+    - busy_timeout_ms：共享文件被其他worker的事务锁住时的最长等待
+    """
+
+    def __init__(self, enabled: bool = False, path: str = "./shared_state.db", flush_seconds: float = 1.0,
+                 stale_seconds: float = 300.0, busy_timeout_ms: int = 50):
+        self.enabled = enabled
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.stale_seconds = stale_seconds
+        self.busy_timeout_ms = busy_timeout_ms
+        self.worker = str(os.getpid())
+        self.last_error: Optional[str] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # 连接只在这一个线程中使用，各操作自然串行，不需要加锁
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        # 其他worker最近一次上报的计数，随本进程上报一起读回
+        self._peers: List[Dict[str, Any]] = []
+        self._collect: Optional[Callable[[], Dict[str, Any]]] = None
+        self._task: Optional[asyncio.Task] = None
+        # 进程存活期间持有的文件锁 {角色: 文件}
+        self._leases: Dict[str, Any] = {}
+
+    @classmethod
+    def from_env(cls) -> "SharedState":
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        return cls(
+            enabled=os.getenv("SHARED_STATE_ENABLED", "true" if workers > 1 else "false").lower() == "true",
+            path=os.getenv("SHARED_STATE_PATH", "./shared_state.db"),
+            flush_seconds=float(os.getenv("SHARED_STATE_FLUSH_SECONDS", "1")),
+            stale_seconds=float(os.getenv("SHARED_STATE_STALE_SECONDS", "300")),
+            busy_timeout_ms=int(os.getenv("SHARED_STATE_BUSY_TIMEOUT_MS", "50")),
+        )
+
+    async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """在共享状态线程中执行一次SQLite操作"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # isolation_level=None：事务由 BEGIN IMMEDIATE 显式控制
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 断电丢失最近的写入无妨：令牌桶按时间补充，计数由各worker重新上报
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    async def take_token(self, name: str, rate: float, capacity: float) -> Tuple[bool, float, float]:
+        """
+        从共用的令牌桶取一个令牌（rate：每秒补充的令牌数，capacity：桶容量）
+
+        返回 (是否取得, 剩余令牌数, 下一个令牌的等待秒数)
+        """
+        return await self._call(self._take_token, name, rate, capacity)
+
+    def _take_token(self, name: str, rate: float, capacity: float) -> Tuple[bool, float, float]:
+        with self._transaction() as conn:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM token_buckets WHERE name = ?", (name,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+            taken = tokens >= 1
+            if taken:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (name, tokens, now)
+            )
+        return taken, tokens, 0.0 if taken else (1 - tokens) / rate
+
+    async def give_back(self, name: str, capacity: float) -> float:
+        """归还一个令牌，返回剩余令牌数"""
+        return await self._call(self._give_back, name, capacity)
+
+    def _give_back(self, name: str, capacity: float) -> float:
+        with self._transaction() as conn:
+            conn.execute("UPDATE token_buckets SET tokens = MIN(?, tokens + 1) WHERE name = ?", (capacity, name))
+            row = conn.execute("SELECT tokens FROM token_buckets WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else capacity
+
+    def bump_versions(self, names: Iterable[str]):
+        """各数据版本加一：在共享状态线程中排队执行，不等待结果，失败只记录日志"""
+        self._executor.submit(self._bump_versions, list(names)).add_done_callback(self._log_bump_failure)
+
+    def _log_bump_failure(self, future):
+        error = future.exception()
+        if error is not None:
+            self.last_error = str(error)
+            logger.warning("更新共享数据版本失败", extra={"error": str(error)})
+
+    def _bump_versions(self, names: List[str]):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO data_versions (name, version) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+                [(name,) for name in names]
+            )
+
+    async def versions(self) -> Dict[str, int]:
+        """读取全部数据版本；在此之前排队的 bump_versions 都已执行"""
+        return await self._call(self._versions)
+
+    def _versions(self) -> Dict[str, int]:
+        return dict(self._connection().execute("SELECT name, version FROM data_versions").fetchall())
+
+    def _publish(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """写入本进程的计数，清理已退出的worker，返回其他worker最近上报的计数"""
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        with self._transaction() as conn:
+            now = time.time()
+            conn.execute(
+                "INSERT INTO worker_stats (worker, payload, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(worker) DO UPDATE SET payload = excluded.payload, updated = excluded.updated",
+                (self.worker, data, now)
+            )
+            conn.execute("DELETE FROM worker_stats WHERE updated < ?", (now - self.stale_seconds,))
+            rows = conn.execute("SELECT payload FROM worker_stats WHERE worker != ?", (self.worker,)).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def combined(self, key: str, local: Any) -> Any:
+        """本进程的实时数据 local 与其他worker最近一次上报的同名数据合计；未启用时只返回本进程的"""
+        if not self.enabled:
+            return local
+        others = [payload[key] for payload in self._peers if key in payload]
+        return merge([local] + others)
+
+    @contextmanager
+    def exclusive(self, name: str) -> Iterator[None]:
+        """跨进程互斥执行一段代码（阻塞等待），如建表/补列"""
+        if not self.enabled or fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.{name}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, name: str) -> bool:
+        """尝试取得名为 name 的独占角色，取得后在进程存活期间一直持有；未启用时总是取得"""
+        if not self.enabled or fcntl is None or name in self._leases:
+            return True
+        f = open(f"{self.path}.{name}.lock", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._leases[name] = f
+        return True
+
+    def start(self, collect: Callable[[], Dict[str, Any]]):
+        """定期上报 collect() 返回的本进程计数"""
+        if self._task is None and self.enabled:
+            self.worker = str(os.getpid())
+            self._collect = collect
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # 退出前上报最后一次，已处理的请求仍计入合计
+            await self._flush()
+        for f in self._leases.values():
+            f.close()
+        self._leases.clear()
+        await self._call(self._close)
+        self._executor.shutdown(wait=False)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _flush(self):
+        try:
+            self._peers = await self._call(self._publish, self._collect())
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning("上报共享计数失败", extra={"error": str(e)})
+
+    async def _run(self):
+        while True:
+            await self._flush()
+            await asyncio.sleep(self.flush_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        result = {"enabled": self.enabled}
+        if not self.enabled:
+            return result
+        return {
+            **result,
+            "path": self.path,
+            "worker": self.worker,
+            "workers": len(self._peers) + 1,
+            "roles": sorted(self._leases),
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,59 @@
+"""
+相同请求合并（single-flight）：同一请求哈希同时只有一次模型调用在进行
+
+后到的重复请求（客户端重试、表单重复提交、代理重放）等待第一次调用的结果，
+而不是各自构建prompt再调用一次模型。
+"""
+
+import asyncio
+import copy
+import os
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """
+    按键合并进行中的异步调用
+
+    调用在独立任务中执行：发起者被取消（如客户端断开）时，等待同一结果的其他请求不受影响
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.counters = {"leaders": 0, "coalesced": 0}
+
+    @classmethod
+    def from_env(cls) -> "SingleFlight":
+        return cls(enabled=os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true")
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行call，或等待同键进行中的调用；返回 (结果, 是否为合并得到的结果)
+
+        每个调用方拿到各自的深拷贝，可以自由修改；call抛出的异常会传给所有等待者
+        """
+        if not self.enabled:
+            return await call(), False
+
+        task = self._calls.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+            result = await asyncio.shield(task)
+            return copy.deepcopy(result), True
+
+        self.counters["leaders"] += 1
+        task = asyncio.ensure_future(call())
+        self._calls[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result), False
+
+    def _forget(self, key: str, task: asyncio.Future):
+        self._calls.pop(key, None)
+        # 所有等待者都已取消时，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "in_flight": len(self._calls), **self.counters}
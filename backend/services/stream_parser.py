@@ -0,0 +1,134 @@
+"""
+流式响应的增量JSON解析：字段一旦完整就立即产出
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+# 逐条推送的数组字段
+ARRAY_ITEM_FIELDS = {"talking_points"}
+
+
+class IncrementalAdviceParser:
+    """
+    逐块喂入模型输出，按字段产出事件
+
+    只跟踪第一个顶层对象；字符串内部的括号不会影响层级判断。
+    单个字段解码失败时直接跳过，最终结果仍以完整文本的解析为准。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.finished = False
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        # 顶层对象内的状态：key -> colon -> value
+        self.state = "key"
+        self.current_key: Optional[str] = None
+        self.value_start: Optional[int] = None
+        self.item_index = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.buffer += chunk
+        events: List[Dict[str, Any]] = []
+        while self.pos < len(self.buffer) and not self.finished:
+            self._step(self.buffer[self.pos], events)
+            self.pos += 1
+        return events
+
+    def _step(self, ch: str, events: List[Dict[str, Any]]):
+        if not self.started:
+            if ch == '{':
+                self.started = True
+                self.stack.append('{')
+            return
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == '\\':
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                self._on_string_end(events)
+            return
+
+        depth = len(self.stack)
+        if ch == '"':
+            self.in_string = True
+            self.string_start = self.pos
+            if depth == 1 and self.state == "value" and self.value_start is None:
+                self.value_start = self.pos
+        elif ch in '{[':
+            if depth == 1 and self.state == "value" and self.value_start is None:
+                self.value_start = self.pos
+            self.stack.append(ch)
+        elif ch in '}]':
+            if self.stack:
+                self.stack.pop()
+            if not self.stack:
+                # 顶层对象结束：最后一个字段可能是未加引号的数字
+                self._emit_scalar(self.pos, events)
+                self.finished = True
+            elif len(self.stack) == 1 and self.state == "value" and self.value_start is not None:
+                self._emit_value(self.pos + 1, events)
+        elif depth == 1:
+            if ch == ':' and self.state == "colon":
+                self.state = "value"
+                self.value_start = None
+            elif ch == ',':
+                self._emit_scalar(self.pos, events)
+                self.state = "key"
+            elif self.state == "value" and self.value_start is None and not ch.isspace():
+                self.value_start = self.pos
+
+    def _on_string_end(self, events: List[Dict[str, Any]]):
+        depth = len(self.stack)
+        if depth == 1:
+            if self.state == "key":
+                self.current_key = self._decode(self.string_start, self.pos + 1)
+                self.state = "colon"
+            elif self.state == "value" and self.value_start == self.string_start:
+                self._emit_value(self.pos + 1, events)
+        elif depth == 2 and self.stack[-1] == '[' and self.current_key in ARRAY_ITEM_FIELDS:
+            value = self._decode(self.string_start, self.pos + 1)
+            if isinstance(value, str):
+                events.append({"field": self.current_key, "index": self.item_index, "value": value})
+                self.item_index += 1
+
+    def _emit_scalar(self, end: int, events: List[Dict[str, Any]]):
+        """数字、布尔等没有结束符的值，遇到逗号或右括号时才算完整"""
+        if self.state == "value" and self.value_start is not None:
+            self._emit_value(end, events)
+
+    def _emit_value(self, end: int, events: List[Dict[str, Any]]):
+        key = self.current_key
+        value = self._decode(self.value_start, end)
+        self.state = "done"
+        self.value_start = None
+        if key is None or key in ARRAY_ITEM_FIELDS:
+            return
+        if value is not None:
+            events.append({"field": key, "value": value})
+
+    def _decode(self, start: int, end: int) -> Any:
+        try:
+            # strict=False 允许字符串中出现未转义的换行
+            return json.loads(self.buffer[start:end].strip(), strict=False)
+        except ValueError:
+            return None
+
+
+def advice_events(advice: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把已完整的建议拆成与增量解析相同格式的事件（用于缓存命中）"""
+    events: List[Dict[str, Any]] = []
+    for key, value in advice.items():
+        if key in ARRAY_ITEM_FIELDS and isinstance(value, list):
+            events.extend({"field": key, "index": i, "value": item} for i, item in enumerate(value))
+        else:
+            events.append({"field": key, "value": value})
+    return events
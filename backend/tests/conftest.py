@@ -0,0 +1,38 @@
+"""
+测试环境
+
+database.py 在导入时读取 DATABASE_URL，所以必须在导入任何应用模块之前指向临时SQLite数据库；
+测试不访问Gemini API。
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="rent-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+os.environ["GEMINI_API_KEY"] = "test"
+os.environ["LOG_LEVEL"] = "ERROR"
+os.environ["ARCHIVE_ENABLED"] = "false"
+
+import pytest
+
+from database import async_engine, init_db
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """所有测试共用一个事件循环，异步连接池中的连接随之在测试间复用"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(async_engine.dispose())
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def db():
+    """建表，整个测试会话共用一个数据库文件"""
+    init_db()
+    yield
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
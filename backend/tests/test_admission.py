@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionRejected, AdmissionScheduler
+
+MODEL = "gemini-1.5-flash"
+
+
+def _scheduler(rpm=60, burst=1, max_queue=2, waits=None, **kwargs):
+    return AdmissionScheduler(
+        default_rpm=rpm, burst=burst, max_queue=max_queue,
+        max_waits=waits or {0: 5.0, 1: 5.0, 2: 5.0}, models=[MODEL], **kwargs
+    )
+
+
+async def test_unlimited_model_is_admitted_immediately():
+    scheduler = _scheduler(rpm=0)
+    await scheduler.admit(MODEL)
+    assert scheduler.counters["admitted"] == 1
+    assert scheduler.snapshot()["models"] == {}
+
+
+async def test_unknown_model_is_rejected():
+    with pytest.raises(ValueError):
+        await _scheduler().admit("bogus")
+
+
+async def test_queued_request_is_admitted_when_token_arrives():
+    # 600 rpm：每0.1秒一个令牌
+    scheduler = _scheduler(rpm=600)
+    await scheduler.admit(MODEL)
+    await asyncio.wait_for(scheduler.admit(MODEL), 1.0)
+    assert scheduler.counters["queued"] == 1
+    assert scheduler.counters["admitted"] == 2
+
+
+async def test_full_queue_sheds_new_request():
+    scheduler = _scheduler(max_queue=1)
+    await scheduler.admit(MODEL)
+    waiting = asyncio.create_task(scheduler.admit(MODEL, "normal"))
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected) as excinfo:
+        await scheduler.admit(MODEL, "normal")
+    assert excinfo.value.reason == "队列已满"
+    assert excinfo.value.retry_after > 0
+    assert scheduler.counters["shed_queue_full"] == 1
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+
+
+async def test_higher_priority_evicts_lower_priority_waiter():
+    scheduler = _scheduler(max_queue=1)
+    await scheduler.admit(MODEL)
+    flexible = asyncio.create_task(scheduler.admit(MODEL, "flexible"))
+    await asyncio.sleep(0)
+    urgent = asyncio.create_task(scheduler.admit(MODEL, "urgent"))
+    with pytest.raises(AdmissionRejected) as excinfo:
+        await flexible
+    assert excinfo.value.reason == "被更高优先级的请求挤出队列"
+    assert not urgent.done()
+    assert scheduler.snapshot()["models"][MODEL]["queued"] == {"urgent": 1, "normal": 0, "flexible": 0}
+    urgent.cancel()
+    await asyncio.gather(urgent, return_exceptions=True)
+
+
+async def test_waiter_is_shed_after_its_priority_timeout():
+    scheduler = _scheduler(rpm=1, waits={0: 5.0, 1: 0.05, 2: 5.0})
+    await scheduler.admit(MODEL)
+    with pytest.raises(AdmissionRejected) as excinfo:
+        await scheduler.admit(MODEL, "normal")
+    assert excinfo.value.reason == "等待超时"
+    assert scheduler.counters["shed_timeout"] == 1
+    assert scheduler.snapshot()["models"][MODEL]["queued"]["normal"] == 0
+
+
+async def test_try_acquire_does_not_queue():
+    scheduler = _scheduler()
+    assert await scheduler.try_acquire(MODEL)
+    assert not await scheduler.try_acquire(MODEL)
+    assert scheduler.counters["queued"] == 0
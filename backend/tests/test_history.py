@@ -0,0 +1,59 @@
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal
+from models import NegotiationSession
+from services import history
+
+
+async def _seed(model, count):
+    """插入count个会话，返回升序的ID；各测试用不同的 model 互不干扰"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            insert(NegotiationSession).returning(NegotiationSession.id),
+            [{"location": "杭州西湖区", "current_price": 4000 + i, "property_type": "两居室",
+              "user_budget": 3800, "model_used": model} for i in range(count)],
+        )
+        ids = sorted(result.scalars().all())
+        await session.commit()
+    return ids
+
+
+async def _page(model, cursor, limit):
+    query = history.page(history.session_query(model=model), NegotiationSession.id, cursor, limit)
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(query)).all()
+    return history.page_result(rows, limit)
+
+
+async def test_keyset_pages_cover_all_rows_in_descending_order(db):
+    ids = await _seed("test-pages", 7)
+
+    pages, cursor = [], None
+    while True:
+        result = await _page("test-pages", cursor, 3)
+        pages.append([item["id"] for item in result["items"]])
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+        assert cursor == pages[-1][-1]
+
+    assert pages == [ids[:3:-1], ids[3:0:-1], ids[:1]]
+
+
+async def test_last_full_page_has_no_cursor(db):
+    ids = await _seed("test-exact", 4)
+    first = await _page("test-exact", None, 2)
+    assert first["next_cursor"] == ids[2]
+    second = await _page("test-exact", first["next_cursor"], 2)
+    assert [item["id"] for item in second["items"]] == [ids[1], ids[0]]
+    assert second["next_cursor"] is None
+
+
+async def test_newer_rows_do_not_shift_later_pages(db):
+    ids = await _seed("test-stable", 4)
+    first = await _page("test-stable", None, 2)
+    await _seed("test-stable", 3)
+    # 新会话的ID更大，游标之后的页与插入之前相同，不会重复或遗漏
+    second = await _page("test-stable", first["next_cursor"], 2)
+    assert [item["id"] for item in second["items"]] == [ids[1], ids[0]]
+    assert second["next_cursor"] is None
@@ -0,0 +1,102 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from services.http_cache import SESSIONS, DataVersions, HttpCache
+
+
+@pytest.fixture
+def cache():
+    return HttpCache(DataVersions(), gzip_min_size=64)
+
+
+@pytest.fixture
+def client(cache):
+    app = FastAPI()
+    builds = []
+
+    @app.get("/stats")
+    async def stats(request: Request):
+        async def build():
+            builds.append(1)
+            return {"total": len(builds), "padding": "x" * 100}
+        return await cache.respond(request, "stats", "no-cache", build, versions=[SESSIONS])
+
+    @app.get("/models")
+    async def models(request: Request):
+        async def build():
+            return {"models": ["gemini-1.5-flash"]}
+        return await cache.respond(request, "models", "max-age=300", build)
+
+    with TestClient(app) as client:
+        client.builds = builds
+        yield client
+
+
+def test_matching_etag_returns_304_without_building(client, cache):
+    first = client.get("/stats")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+    assert first.headers["cache-control"] == "no-cache"
+
+    second = client.get("/stats", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["etag"] == etag
+    assert len(client.builds) == 1
+    assert cache.counters["not_modified"] == 1
+
+
+def test_weak_and_list_forms_match(client):
+    etag = client.get("/stats").headers["etag"]
+    assert client.get("/stats", headers={"If-None-Match": etag[2:]}).status_code == 304
+    assert client.get("/stats", headers={"If-None-Match": f'W/"other", {etag}'}).status_code == 304
+    assert client.get("/stats", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/stats", headers={"If-None-Match": 'W/"other"'}).status_code == 200
+
+
+def test_data_change_invalidates_etag_and_body(client, cache):
+    first = client.get("/stats")
+    assert client.get("/stats").json() == first.json()
+    assert len(client.builds) == 1
+    assert cache.counters["body_hits"] == 1
+
+    cache.versions.touch(["北京朝阳区"])
+    changed = client.get("/stats", headers={"If-None-Match": first.headers["etag"]})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != first.headers["etag"]
+    assert changed.json()["total"] == 2
+
+
+def test_content_hash_etag_without_versions(client):
+    first = client.get("/models")
+    assert first.status_code == 200
+    again = client.get("/models", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    assert again.headers["cache-control"] == "max-age=300"
+
+
+def test_large_body_is_gzipped_for_accepting_clients(client):
+    response = client.get("/stats", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["total"] == 1
+    raw = client.get("/stats", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+    assert raw.json() == response.json()
+
+
+def test_disabled_cache_always_builds(cache):
+    cache.enabled = False
+    app = FastAPI()
+
+    @app.get("/stats")
+    async def stats(request: Request):
+        async def build():
+            return {"total": 1}
+        return await cache.respond(request, "stats", "no-cache", build, versions=[SESSIONS])
+
+    with TestClient(app) as client:
+        response = client.get("/stats", headers={"If-None-Match": "*"})
+    assert response.status_code == 200
+    assert "etag" not in response.headers
@@ -0,0 +1,82 @@
+from services.json_extractor import (
+    REPAIR_CONTROL,
+    REPAIR_DROPPED,
+    REPAIR_NEWLINE,
+    REPAIR_QUOTE,
+    REPAIR_TRAILING_COMMA,
+    REPAIR_TRUNCATED,
+    REPAIR_UNCLOSED,
+    extract_json,
+)
+
+
+def test_clean_object_needs_no_repair():
+    text = '```json\n{\n  "suggested_price": 5000,\n  "talking_points": ["a", "b"]\n}\n```'
+    assert extract_json(text) == ({"suggested_price": 5000, "talking_points": ["a", "b"]}, [])
+
+
+def test_raw_newline_in_string_is_recorded():
+    parsed, repairs = extract_json('{"suggested_price": 4200, "negotiation_strategy": "第一步\n第二步"}')
+    assert parsed["negotiation_strategy"] == "第一步\n第二步"
+    assert repairs == [REPAIR_NEWLINE]
+
+
+def test_raw_newline_in_nested_string_is_recorded():
+    parsed, repairs = extract_json('{"suggested_price": 1, "talking_points": ["a\nb"], "x": [1,]}')
+    assert parsed == {"suggested_price": 1, "talking_points": ["a\nb"], "x": [1]}
+    assert repairs == [REPAIR_TRAILING_COMMA, REPAIR_NEWLINE]
+
+
+def test_other_control_characters_are_removed():
+    parsed, repairs = extract_json('{"suggested_price": 1, "risk_assessment": "高\x01风险"}')
+    assert parsed["risk_assessment"] == "高风险"
+    assert repairs == [REPAIR_CONTROL]
+
+
+def test_inner_quotes_are_escaped():
+    parsed, repairs = extract_json('{"suggested_price": 3300, "negotiation_strategy": "强调"长期稳定"和"爱护房屋"。"}')
+    assert parsed["negotiation_strategy"] == '强调"长期稳定"和"爱护房屋"。'
+    assert repairs == [REPAIR_QUOTE]
+
+
+def test_trailing_commas_are_dropped():
+    parsed, repairs = extract_json('{"suggested_price": 2700, "talking_points": ["a", "b",],}')
+    assert parsed == {"suggested_price": 2700, "talking_points": ["a", "b"]}
+    assert repairs == [REPAIR_TRAILING_COMMA]
+
+
+def test_truncated_output_keeps_complete_members():
+    parsed, repairs = extract_json('{"suggested_price": 9500, "talking_points": ["a", "b", "c')
+    assert parsed == {"suggested_price": 9500, "talking_points": ["a", "b", "c"]}
+    assert repairs == [REPAIR_TRUNCATED]
+
+
+def test_dangling_key_is_dropped():
+    assert extract_json('{"suggested_price": 4500, "s": "a", "b"}') == (
+        {"suggested_price": 4500, "s": "a"}, [REPAIR_DROPPED]
+    )
+
+
+def test_missing_closing_quote_in_array():
+    assert extract_json('{"suggested_price": 4500, "talking_points": ["a, "b"]}') == (
+        {"suggested_price": 4500, "talking_points": ["a", "b"]}, [REPAIR_UNCLOSED]
+    )
+
+
+def test_skips_placeholders_and_prefers_required_key():
+    text = '模板 {城市} 示例 {"note": "无关"}，结果：{"suggested_price": 7800}'
+    assert extract_json(text) == ({"suggested_price": 7800}, [])
+
+
+def test_falls_back_to_first_object_without_required_key():
+    assert extract_json('{"a": 1} {"b": 2}') == ({"a": 1}, [])
+
+
+def test_array_extraction():
+    assert extract_json('结果：[{"index": 0}, {"index": 1}]', want='[', required_key=None) == (
+        [{"index": 0}, {"index": 1}], []
+    )
+
+
+def test_plain_text_yields_nothing():
+    assert extract_json("抱歉，我无法给出建议。") == (None, [])
@@ -0,0 +1,62 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from database import AsyncSessionLocal
+from models import IdSequence, NegotiationSession
+from services.session_writer import IdBlockAllocator, SessionWriter
+
+
+def _session(**values):
+    return {
+        "location": "北京朝阳区", "current_price": 6000, "property_type": "一居室",
+        "user_budget": 5500, "urgency": "normal", **values,
+    }
+
+
+async def test_blocks_start_after_existing_sessions(db):
+    async with AsyncSessionLocal() as session:
+        session.add(NegotiationSession(**_session()))
+        await session.commit()
+        existing = await session.scalar(select(func.max(NegotiationSession.id)))
+
+    allocator = IdBlockAllocator("test-start", block_size=3)
+    assert [await allocator.next_id() for _ in range(3)] == [existing + 1, existing + 2, existing + 3]
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(select(IdSequence.next_value).where(IdSequence.name == "test-start")) == existing + 4
+
+
+async def test_allocators_sharing_a_sequence_never_overlap(db):
+    first = IdBlockAllocator("test-shared", block_size=4)
+    second = IdBlockAllocator("test-shared", block_size=4)
+    ids = await asyncio.gather(*[allocator.next_id() for _ in range(10) for allocator in (first, second)])
+    assert len(set(ids)) == 20
+
+    # 段内分配不访问数据库，只在用完一段时预留下一段
+    taken = [await first.next_id() for _ in range(4)]
+    assert taken == sorted(taken)
+    async with AsyncSessionLocal() as session:
+        assert await session.scalar(select(IdSequence.next_value).where(IdSequence.name == "test-shared")) > max(ids + taken)
+
+
+async def test_write_behind_merges_insert_and_advice(db):
+    writer = SessionWriter(batch_size=10, flush_interval=0.01, id_block_size=5)
+    inserted = []
+    writer.on_insert = inserted.extend
+    try:
+        ids = [await writer.create(_session(location=f"上海徐汇区{i}")) for i in range(7)]
+        assert ids == list(range(ids[0], ids[0] + 7))
+        await writer.save_advice(ids[0], {"suggested_price": 5200, "model_used": "fallback"}, "上海徐汇区0", 6000)
+        await asyncio.wait_for(writer.wait_written(ids[0]), 2.0)
+    finally:
+        await writer.stop()
+
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(
+            select(NegotiationSession.id, NegotiationSession.suggested_price)
+            .where(NegotiationSession.id.in_(ids)).order_by(NegotiationSession.id)
+        )).all()
+    assert [row.id for row in rows] == ids
+    assert rows[0].suggested_price == 5200
+    assert sorted(values["id"] for values in inserted) == ids
+    assert writer.stats()["failed"] == 0
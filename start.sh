@@ -16,7 +16,14 @@ cd backend
 python -m venv venv 2>/dev/null || true
 source venv/bin/activate || source venv/Scripts/activate  # Windows兼容
 pip install -r requirements.txt
-uvicorn main:app --reload --host 0.0.0.0 --port 8088 &
+# BACKEND_WORKERS>1 时以多个worker运行（不自动重载），各worker通过 SHARED_STATE_PATH 共享限速与计数
+BACKEND_WORKERS=${BACKEND_WORKERS:-1}
+if [ "$BACKEND_WORKERS" -gt 1 ]; then
+    echo "🧵 以 $BACKEND_WORKERS 个worker启动"
+    WEB_CONCURRENCY=$BACKEND_WORKERS uvicorn main:app --host 0.0.0.0 --port 8088 --workers "$BACKEND_WORKERS" &
+else
+    uvicorn main:app --reload --host 0.0.0.0 --port 8088 &
+fi
 BACKEND_PID=$!
 
 # 等待后端启动